@@ -1,6 +1,7 @@
 import os
 from celery import Celery
 from celery.schedules import crontab
+from celery.signals import worker_process_shutdown
 from kombu import Exchange, Queue
 
 # ── Load settings from environment ──────────────────────────────────────────────
@@ -11,6 +12,8 @@ DATABASE_URL = os.getenv(
 BROKER_URL     = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
 RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/0")
 TIMEZONE       = os.getenv("TZ", "UTC")
+# esecuzione sincrona in-process (test locali di group/chord senza broker)
+ALWAYS_EAGER   = os.getenv("CELERY_TASK_ALWAYS_EAGER", "0") == "1"
 
 # ── Create and configure Celery app ─────────────────────────────────────────────
 app = Celery(
@@ -42,8 +45,16 @@ app.conf.update(
     task_serializer="json",
     result_serializer="json",
     accept_content=["json"],
+    task_always_eager=ALWAYS_EAGER,
+    task_eager_propagates=True,
+    # shard di calcolo lunghi: un task alla volta per processo, ack a fine task
+    worker_prefetch_multiplier=1,
 )
 
+# ── Prometheus: opt-in cleanup on exit (PROMETHEUS_CLEANUP_ON_EXIT=1) ────────────
+from backend.services import compute_metrics  # noqa: E402
+worker_process_shutdown.connect(compute_metrics.shutdown, weak=False)
+
 # ── Auto-discover tasks in the jobs package ─────────────────────────────────────
 app.autodiscover_tasks(["backend.jobs"])
 
@@ -61,12 +72,18 @@ app.conf.beat_schedule = {
         "schedule": 10.0,
         "options": {"queue": "computations"},
     },
-    # Historical data fetch nightly at 02:00
+    # Historical data fetch nightly at 02:00, chained to the incremental pattern refresh
     "fetch-historical-every-night": {
-        "task": "backend.jobs.fetch_historical.fetch_and_save_task",
+        "task": "backend.jobs.fetch_historical.fetch_and_refresh_task",
         "schedule": crontab(hour=2, minute=0),
         "options": {"queue": "fetchers"},
     },
+    # History compaction (delta segments → yearly partitions) weekly, Saturday at 23:00
+    "compact-history-weekly": {
+        "task": "backend.jobs.fetch_historical.compact_history_task",
+        "schedule": crontab(day_of_week="sat", hour=23, minute=0),
+        "options": {"queue": "fetchers"},
+    },
     # Weekly pattern computation every Sunday at 03:00
     "compute-patterns-weekly": {
         "task": "backend.jobs.compute_patterns.compute_patterns_task",
@@ -1,11 +1,25 @@
 #!/usr/bin/env python3
-import os
+import argparse
+import sys
 from pathlib import Path
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 import pandas as pd
 import yaml
-import MetaTrader5 as mt5
+
+# eseguibile anche come script: python backend/data_fetch/download_all_mt5.py
+ROOT_DIR = str(Path(__file__).resolve().parents[2])
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from backend.data_fetch.sources import get_source, BarSource  # noqa: E402
+from backend.data_fetch.scheduler import FetchJob, run_jobs, FETCH_WORKERS  # noqa: E402
+from backend.services.history_catalog import refresh_entry  # noqa: E402
+from backend.services.history_resample import update_derived  # noqa: E402
+from backend.services.history_parquet import (  # noqa: E402
+    write_history, append_segment, compact, delta_counts, history_bounds,
+    is_partitioned, migrate_legacy, COMPACT_SEGMENTS,
+)
 
 # --- 1) TROVA E CARICA LA CONFIG in <PROJECT_ROOT>/config/default.yaml ---
 HERE      = Path(__file__).resolve().parent            # …/backend/data_fetch
@@ -19,17 +33,14 @@ with open(CONFIG_FP, 'r') as f:
     cfg = yaml.safe_load(f)
 
 # --- 2) CONFIGURAZIONE TIMEFRAME E DATE ---------------------------
-TIMEFRAME_MAP = {
-    'H1':  mt5.TIMEFRAME_H1,
-    'H4':  mt5.TIMEFRAME_H4,
-    'D1':  mt5.TIMEFRAME_D1,
-    'W1':  mt5.TIMEFRAME_W1,
-    'MN1': mt5.TIMEFRAME_MN1,
-}
+# scaricati da MT5; i derivati (derived_timeframes) li costruisce history_resample
 TIMEFRAMES   = cfg['mt5']['timeframes']
+YEARS_BACK   = 20
 
-DATE_TO      = datetime.now()
-DATE_FROM    = DATE_TO - relativedelta(years=20)
+def date_window(date_to: datetime | None = None) -> tuple[datetime, datetime]:
+    """(inizio, fine) del download completo; calcolata a ogni run, non all'import."""
+    date_to = date_to or datetime.now()
+    return date_to - relativedelta(years=YEARS_BACK), date_to
 
 # --- 3) GRUPPI MT5 DA PROCESSARE (primo segmento di sym.path) ------
 MT5_GROUPS   = cfg['mt5']['groups']   # es. ['Cryptocurrencies']
@@ -38,30 +49,13 @@ MT5_GROUPS   = cfg['mt5']['groups']   # es. ['Cryptocurrencies']
 OUTPUT_ROOT  = PROJECT / cfg['mt5'].get('history_path', 'mt5_history')
 OUTPUT_ROOT.mkdir(parents=True, exist_ok=True)
 
-# --- 5) INIT / SHUTDOWN MT5 ---------------------------------------
-def init_mt5():
-    if not mt5.initialize():
-        raise RuntimeError(f"Errore init MT5: {mt5.last_error()}")
-    print("✅ MT5 initialized")
-
-def shutdown_mt5():
-    mt5.shutdown()
-    print("✅ MT5 shutdown")
-
-# --- 6) DISCOVERY SIMBOLI PER GRUPPO -----------------------------
-def discover_symbols_by_group():
+# --- 5) DISCOVERY SIMBOLI PER GRUPPO -----------------------------
+def discover_symbols_by_group(source: BarSource, groups=None) -> dict[str, list[str]]:
     """
-    Restituisce un dict { gruppo: [symbol1, symbol2, ...], ... }
-    filtrando mt5.symbols_get() per root = sym.path.split('\\')[0].
+    Restituisce un dict { gruppo: [symbol1, symbol2, ...], ... } dalla
+    sorgente e crea le cartelle di output.
     """
-    all_syms = mt5.symbols_get()
-    assets   = {g: [] for g in MT5_GROUPS}
-
-    for sym in all_syms:
-        root = sym.path.split('\\')[0]
-        if root in MT5_GROUPS:
-            assets[root].append(sym.name)
-
+    assets = source.symbols_by_group(groups or MT5_GROUPS)
     for group, syms in assets.items():
         if not syms:
             print(f"⚠️ Nessun simbolo trovato per gruppo '{group}'")
@@ -71,106 +65,122 @@ def discover_symbols_by_group():
         print(f"→ Gruppo '{group}': trovati {len(syms)} simboli")
     return assets
 
-# --- 7) FUNZIONE DI DOWNLOAD & SALVATAGGIO ------------------------
-def fetch_and_save(symbol: str, tf_str: str, tf_const: int, out_dir: Path):
-    try:
-        # paths sia CSV (retrocompatibilità) che Parquet
-        csv_path = out_dir / f"{symbol}_{tf_str}.csv"
-        pq_path  = csv_path.with_suffix('.parquet')
-
-        # Seleziona il simbolo
-        if not mt5.symbol_select(symbol, True):
-            print(f"   ⚠️ symbol_select fallita per {symbol}, skip")
-            return
-
-        # Download range completo
-        print(f"   → Download {symbol} {tf_str} ({DATE_FROM.date()} → {DATE_TO.date()})")
-        rates = mt5.copy_rates_range(symbol, tf_const, DATE_FROM, DATE_TO)
-
-        # controlla se dati presenti
-        if rates is None or len(rates) == 0:
-            print(f"      ⚠️ Nessun dato per {symbol} {tf_str}")
-            return
-
-        df = pd.DataFrame(rates)
-        df.rename(columns={"time": "timestamp"}, inplace=True)
-        df["timestamp"] = pd.to_datetime(df["timestamp"], unit="s")
-
-        # salva Parquet
-        df.to_parquet(pq_path, index=False)
-        print(f"      ✅ Salvato {pq_path}")
-
-        # (opzionale) salva ancora CSV per retrocompatibilità
-        # df.to_csv(csv_path, index=False)
-
-    except Exception as e:
-        print(f"   ⚠️ Errore in fetch_and_save per {symbol} {tf_str}: {e}")
-
-def update_csv(symbol: str, tf_str: str, tf_const: int, out_dir: Path):
+# --- 6) DOWNLOAD & SALVATAGGIO (un job = simbolo × timeframe) -----
+def _out_dir(job: FetchJob) -> Path:
+    return OUTPUT_ROOT / job.group / job.symbol
+
+def fetch_and_save(gate, job: FetchJob, date_to: datetime | None = None):
+    """Download completo: gli anni scaricati sostituiscono i precedenti."""
+    symbol, tf_str = job.symbol, job.tf_str
+    # storico partizionato per anno: <out_dir>/<symbol>_<tf>/year=YYYY/
+    ds_dir = _out_dir(job) / f"{symbol}_{tf_str}"
+    date_from, date_to = date_window(date_to)
+
+    print(f"   → Download {symbol} {tf_str} ({date_from.date()} → {date_to.date()})")
+    with gate.request() as source:
+        df = source.fetch(symbol, tf_str, date_from, date_to)
+    if df is None:
+        print(f"      ⚠️ Nessun dato per {symbol} {tf_str}")
+        return 0
+
+    write_history(ds_dir, df, replace=True)
+    refresh_entry(job.group, symbol, tf_str, ds_dir, root=OUTPUT_ROOT)
+    print(f"      ✅ Salvato {ds_dir}")
+    _refresh_derived(job)
+    return len(df)
+
+def _refresh_derived(job: FetchJob, since=None):
+    """Ricostruisce (o aggiorna da `since`) i timeframe derivati dal timeframe del job."""
+    for tf_str in update_derived(job.group, job.symbol, job.tf_str, root=OUTPUT_ROOT, since=since):
+        refresh_entry(job.group, job.symbol, tf_str, _out_dir(job) / f"{job.symbol}_{tf_str}",
+                      root=OUTPUT_ROOT)
+        print(f"      ↳ {job.symbol} {tf_str} derivato da {job.tf_str}")
+
+def update_csv(gate, job: FetchJob, date_to: datetime | None = None):
     """
-    Aggiorna il Parquet di `symbol`+`tf_str` in out_dir,
-    scaricando solo le barre successive a quelle già presenti.
+    Aggiorna lo storico partizionato per anno di `symbol`+`tf_str`,
+    scaricando solo le barre successive a quelle già presenti. Le barre nuove
+    vanno in un segmento delta (nessuna partizione riscritta); gli anni con
+    più di COMPACT_SEGMENTS delta vengono compattati subito.
+    Ritorna il numero di barre nuove.
     """
-    pq_path = out_dir / f"{symbol}_{tf_str}.parquet"
-    # 1) se non esiste, full download in parquet
-    if not pq_path.exists():
+    group, symbol, tf_str = job
+    ds_dir = _out_dir(job) / f"{symbol}_{tf_str}"
+    # file unico legacy → layout per anno, una volta sola
+    if not is_partitioned(ds_dir) and migrate_legacy(group, symbol, tf_str, root=OUTPUT_ROOT):
+        print(f"   → {symbol} {tf_str} migrato nel layout per anno")
+
+    # 1) se non esiste, full download
+    if not is_partitioned(ds_dir):
         print(f"   → {symbol} {tf_str} non trovato, full download → Parquet")
-        rates = mt5.copy_rates_range(symbol, tf_const, DATE_FROM, DATE_TO)
-        if rates is None or len(rates) == 0:
-            print(f"      ⚠️ Nessun dato per {symbol} {tf_str}")
-            return
-        df = pd.DataFrame(rates)
-        df.rename(columns={"time":"timestamp"}, inplace=True)
-        df["timestamp"] = pd.to_datetime(df["timestamp"], unit="s")
-        df.to_parquet(pq_path, index=False)
-        print(f"      ✅ Salvato {pq_path}")
-        return
-
-    # 2) altrimenti, append delle nuove barre
-    df_exist = pd.read_parquet(pq_path)
-    last_ts  = df_exist['timestamp'].max()
-    start_dt = last_ts + pd.Timedelta(seconds=1)
-    if start_dt >= DATE_TO:
+        return fetch_and_save(gate, job, date_to)
+
+    # 2) altrimenti, append delle nuove barre (ultima barra dai metadati);
+    #    partizioni senza barre → dall'inizio della finestra del full download
+    date_from, date_to = date_window(date_to)
+    last_ts  = history_bounds(ds_dir)[1]
+    start_dt = pd.Timestamp(date_from) if last_ts is None else last_ts + pd.Timedelta(seconds=1)
+    if start_dt >= date_to:
         print(f"   → {symbol} {tf_str} già aggiornato fino a {last_ts}")
-        return
+        return 0
 
-    print(f"   → Update {symbol} {tf_str} ({start_dt.date()} → {DATE_TO.date()})")
-    rates = mt5.copy_rates_range(symbol, tf_const, start_dt, DATE_TO)
-    # qui il controllo corretto
-    if rates is None or len(rates) == 0:
+    print(f"   → Update {symbol} {tf_str} ({start_dt.date()} → {date_to.date()})")
+    with gate.request() as source:
+        df_new = source.fetch(symbol, tf_str, start_dt.to_pydatetime(), date_to)
+    if df_new is None:
         print(f"      ⚠️ Nessuna barra nuova per {symbol} {tf_str}")
-        return
-
-    df_new = pd.DataFrame(rates)
-    df_new.rename(columns={"time":"timestamp"}, inplace=True)
-    df_new["timestamp"] = pd.to_datetime(df_new["timestamp"], unit="s")
-    df_combined = pd.concat([df_exist, df_new], ignore_index=True)
-    df_combined.to_parquet(pq_path, index=False)
-    print(f"      ✅ Aggiornato {pq_path} (+{len(df_new)} barre)")
-
+        return 0
+
+    append_segment(ds_dir, df_new)
+    if any(n > COMPACT_SEGMENTS for n in delta_counts(ds_dir).values()):
+        compact(ds_dir, min_deltas=COMPACT_SEGMENTS + 1)
+    refresh_entry(group, symbol, tf_str, ds_dir, root=OUTPUT_ROOT)
+    print(f"      ✅ Aggiornato {ds_dir} (+{len(df_new)} barre)")
+    _refresh_derived(job, since=df_new['timestamp'].iloc[0])
+    return len(df_new)
+
+# --- 7) FETCH CONCORRENTE -----------------------------------------
+def fetch_all(source: BarSource | None = None, full: bool = False,
+              max_workers: int = FETCH_WORKERS, timeframes=None, groups=None) -> dict:
+    """
+    Aggiorna (o scarica da zero con `full`) tutti i simboli × timeframe
+    della sorgente, in parallelo con lo scheduler. Ritorna il riepilogo
+    di `run_jobs`.
+    """
+    source  = source or get_source()
+    handler = fetch_and_save if full else update_csv
+    date_to = datetime.now()
+    with source:
+        assets = discover_symbols_by_group(source, groups)
+        jobs = [
+            FetchJob(group, symbol, tf_str)
+            for group, symbols in assets.items()
+            for symbol in symbols
+            for tf_str in (timeframes or TIMEFRAMES)
+        ]
+        if not jobs:
+            print("❌ Nessun asset da scaricare – controlla la config dei gruppi")
+            return {"ok": 0, "failed": 0, "errors": {}, "seconds": 0.0}
+
+        print(f"\n📥 {len(jobs)} job su {max_workers} thread (sorgente {source.name}, "
+              f"concorrenza {source.max_concurrency}, rate {source.rate_limit or '∞'}/s)")
+        summary = run_jobs(source, jobs, lambda gate, job: handler(gate, job, date_to), max_workers)
+    print(f"\n🏁 Update terminato: {summary['ok']} ok, {summary['failed']} falliti "
+          f"in {summary['seconds']:.1f}s")
+    return summary
 
 # --- 8) MAIN -----------------------------------------------------
-def main():
-    init_mt5()
-    try:
-        assets = discover_symbols_by_group()
-        if not any(assets.values()):
-            print("❌ Nessun asset da scaricare – controlla la config dei gruppi MT5")
-            return
-
-        for group, symbols in assets.items():
-            print(f"\n📁 Aggiorno gruppo '{group}' ({len(symbols)} simboli)")
-            for symbol in symbols:
-                out_dir = OUTPUT_ROOT / group / symbol
-                for tf_str in TIMEFRAMES:
-                    tf_const = TIMEFRAME_MAP.get(tf_str)
-                    if not tf_const:
-                        print(f"   ⚠️ Timeframe non supportato: {tf_str}")
-                        continue
-                    update_csv(symbol, tf_str, tf_const, out_dir)
-    finally:
-        shutdown_mt5()
-        print("\n🏁 Update terminato.")
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Download storico (MT5 o replay locale)")
+    ap.add_argument('--source', choices=('mt5', 'replay'), help="default env BAR_SOURCE")
+    ap.add_argument('--replay-root', help="cartella servita dalla sorgente replay")
+    ap.add_argument('--workers', type=int, default=FETCH_WORKERS)
+    ap.add_argument('--full', action='store_true', help="riscarica tutto lo storico")
+    args = ap.parse_args(argv)
+
+    kwargs = {'root': args.replay_root} if args.replay_root else {}
+    summary = fetch_all(get_source(args.source, **kwargs), full=args.full, max_workers=args.workers)
+    return 1 if summary['failed'] else 0
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,112 @@
+# backend/data_fetch/scheduler.py
+from __future__ import annotations
+
+"""
+Scheduler concorrente del download dello storico.
+
+I job (group, symbol, timeframe) girano su un pool di FETCH_WORKERS thread;
+per ogni sorgente valgono
+
+  • max_concurrency – richieste contemporanee (semaforo);
+  • rate_limit      – richieste/s (token bucket, 0 = libero);
+  • FETCH_RETRIES   – tentativi per job, con backoff esponenziale
+                      (FETCH_BACKOFF · 2^n secondi) sugli errori.
+
+Il tempo totale cresce così con (job / concorrenza) invece che con il
+numero di simboli. Lettura, scrittura parquet e catalogo di un job girano
+fuori dal semaforo: con MT5 (una richiesta alla volta) il disco lavora in
+parallelo al terminale.
+"""
+
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from typing import NamedTuple
+
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", 8))
+FETCH_RETRIES = int(os.getenv("FETCH_RETRIES", 3))
+FETCH_BACKOFF = float(os.getenv("FETCH_BACKOFF", 1.0))
+
+
+class FetchJob(NamedTuple):
+    group:  str
+    symbol: str
+    tf_str: str
+
+
+class RateLimiter:
+    """Token bucket thread-safe: al più `rate` acquisizioni al secondo (burst 1)."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next    = 0.0
+        self._lock    = threading.Lock()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now  = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+class SourceGate:
+    """Concorrenza e ritmo di una sorgente: `with gate.request(): source.fetch(...)`."""
+
+    def __init__(self, source):
+        self.source  = source
+        self.limiter = RateLimiter(source.rate_limit)
+        self._sem    = threading.BoundedSemaphore(max(1, source.max_concurrency))
+
+    @contextmanager
+    def request(self):
+        with self._sem:
+            self.limiter.acquire()
+            yield self.source
+
+
+def run_jobs(source, jobs, handler, max_workers: int = FETCH_WORKERS,
+             retries: int = FETCH_RETRIES, backoff: float = FETCH_BACKOFF) -> dict:
+    """
+    Esegue `handler(gate, job)` per ogni job sul pool. L'handler passa da
+    `gate.request()` per ogni chiamata alla sorgente. Un job che solleva
+    viene ritentato fino a `retries` volte; gli errori finali non fermano
+    gli altri job.
+
+    Ritorna {"ok", "failed", "errors": {job: traceback}, "seconds"}.
+    """
+    gate = SourceGate(source)
+    jobs = list(jobs)
+
+    def attempt(job):
+        for n in range(retries + 1):
+            try:
+                return handler(gate, job)
+            except Exception:
+                if n == retries:
+                    raise
+                delay = backoff * 2 ** n
+                print(f"   ↻ {job.symbol} {job.tf_str}: tentativo {n + 1} fallito, riprovo fra {delay:.1f}s")
+                time.sleep(delay)
+
+    t0 = time.perf_counter()
+    summary = {"ok": 0, "failed": 0, "errors": {}}
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="fetch") as pool:
+        futures = {pool.submit(attempt, job): job for job in jobs}
+        for fut in as_completed(futures):
+            job = futures[fut]
+            try:
+                fut.result()
+                summary["ok"] += 1
+            except Exception:
+                summary["failed"] += 1
+                summary["errors"][job] = traceback.format_exc()
+                print(f"   ❌ {job.group}/{job.symbol} {job.tf_str}: {summary['errors'][job].splitlines()[-1]}")
+    summary["seconds"] = time.perf_counter() - t0
+    return summary
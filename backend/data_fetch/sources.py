@@ -0,0 +1,191 @@
+# backend/data_fetch/sources.py
+from __future__ import annotations
+
+"""
+Sorgenti di barre OHLC per il download dello storico.
+
+    BarSource           interfaccia: open/close, symbols_by_group, fetch
+    MT5Source           terminale MetaTrader5 (import pigro: il modulo si
+                        importa anche su Linux, senza il client MT5)
+    ReplaySource        barre servite da parquet locali (layout per anno o
+                        file unico), con latenza simulata opzionale: sostituto
+                        di MT5 per test, sviluppo e benchmark del fetch
+
+Ogni sorgente dichiara quante richieste regge in parallelo
+(`max_concurrency`) e a che ritmo (`rate_limit`, richieste/s, 0 = libero):
+lo scheduler (`scheduler.py`) li rispetta.
+
+    BAR_SOURCE=mt5|replay   sorgente di default di `get_source()`
+    BAR_REPLAY_ROOT         cartella servita da ReplaySource
+"""
+
+import os
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from backend.services.history_parquet import load_history, normalize_bars
+
+BAR_SOURCE      = os.getenv("BAR_SOURCE", "mt5")
+BAR_REPLAY_ROOT = os.getenv("BAR_REPLAY_ROOT")
+
+# il client MT5 parla con un solo terminale: chiamate serializzate di default
+MT5_MAX_CONCURRENCY = int(os.getenv("MT5_MAX_CONCURRENCY", 1))
+MT5_RATE_LIMIT      = float(os.getenv("MT5_RATE_LIMIT", 0))
+
+
+class SourceError(RuntimeError):
+    """Errore della sorgente (connessione, simbolo, richiesta): ritentabile."""
+
+
+class BarSource:
+    """Interfaccia di una sorgente di barre."""
+
+    name            = "base"
+    max_concurrency = 1
+    rate_limit      = 0.0
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def symbols_by_group(self, groups) -> dict[str, list[str]]:
+        """{gruppo: [simboli]} per i gruppi richiesti."""
+        raise NotImplementedError
+
+    def fetch(self, symbol: str, tf_str: str, start: datetime, end: datetime) -> pd.DataFrame | None:
+        """
+        Barre di `symbol`+`tf_str` con start <= timestamp <= end, come
+        DataFrame con colonna `timestamp` (datetime64[ns]) ordinata;
+        None se non ci sono barre.
+        """
+        raise NotImplementedError
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+# ── MetaTrader5 ────────────────────────────────────────────────────────────────
+class MT5Source(BarSource):
+    name = "mt5"
+
+    def __init__(self, max_concurrency: int = MT5_MAX_CONCURRENCY,
+                 rate_limit: float = MT5_RATE_LIMIT):
+        self.max_concurrency = max_concurrency
+        self.rate_limit      = rate_limit
+        self._mt5      = None
+        self._selected = set()
+        self._lock     = threading.Lock()
+
+    def open(self):
+        import MetaTrader5 as mt5               # solo Windows, solo qui
+        if not mt5.initialize():
+            raise SourceError(f"Errore init MT5: {mt5.last_error()}")
+        self._mt5 = mt5
+        print("✅ MT5 initialized")
+
+    def close(self):
+        if self._mt5 is not None:
+            self._mt5.shutdown()
+            self._mt5 = None
+            print("✅ MT5 shutdown")
+
+    def timeframe(self, tf_str: str) -> int:
+        tf_const = getattr(self._mt5, f"TIMEFRAME_{tf_str}", None)
+        if tf_const is None:
+            raise ValueError(f"Timeframe non supportato: {tf_str}")
+        return tf_const
+
+    def symbols_by_group(self, groups) -> dict[str, list[str]]:
+        """Filtra mt5.symbols_get() per root = sym.path.split('\\')[0]."""
+        assets = {g: [] for g in groups}
+        for sym in self._mt5.symbols_get():
+            root = sym.path.split('\\')[0]
+            if root in assets:
+                assets[root].append(sym.name)
+        return assets
+
+    def fetch(self, symbol, tf_str, start, end):
+        tf_const = self.timeframe(tf_str)
+        with self._lock:
+            if symbol not in self._selected:
+                if not self._mt5.symbol_select(symbol, True):
+                    raise SourceError(f"symbol_select fallita per {symbol}")
+                self._selected.add(symbol)
+        # parallelismo limitato dallo scheduler a max_concurrency
+        rates = self._mt5.copy_rates_range(symbol, tf_const, start, end)
+        if rates is None:
+            raise SourceError(f"copy_rates_range fallita per {symbol} {tf_str}: {self._mt5.last_error()}")
+        if len(rates) == 0:
+            return None
+        df = pd.DataFrame(rates)
+        df["time"] = pd.to_datetime(df["time"], unit="s")
+        return normalize_bars(df)
+
+
+# ── Replay da parquet locali ───────────────────────────────────────────────────
+class ReplaySource(BarSource):
+    """
+    Serve le barre di uno storico locale con la stessa struttura di
+    `mt5_history/` (group/symbol/...). `latency` aggiunge un ritardo per
+    richiesta, per simulare il round trip verso il broker.
+    """
+    name = "replay"
+
+    def __init__(self, root: str, latency: float = 0.0, max_concurrency: int = 8,
+                 rate_limit: float = 0.0):
+        self.root            = str(root)
+        self.latency         = latency
+        self.max_concurrency = max_concurrency
+        self.rate_limit      = rate_limit
+
+    def open(self):
+        if not os.path.isdir(self.root):
+            raise SourceError(f"Cartella di replay non trovata: {self.root}")
+
+    def symbols_by_group(self, groups) -> dict[str, list[str]]:
+        assets = {}
+        for group in groups:
+            gdir = os.path.join(self.root, group)
+            assets[group] = sorted(
+                s for s in os.listdir(gdir) if os.path.isdir(os.path.join(gdir, s))
+            ) if os.path.isdir(gdir) else []
+        return assets
+
+    def _group_of(self, symbol: str) -> str:
+        for group in os.listdir(self.root):
+            if os.path.isdir(os.path.join(self.root, group, symbol)):
+                return group
+        raise SourceError(f"Simbolo non presente nel replay: {symbol}")
+
+    def fetch(self, symbol, tf_str, start, end):
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            df = load_history(self._group_of(symbol), symbol, tf_str,
+                              start=start, end=end, root=self.root)
+        except FileNotFoundError:
+            return None
+        return df if len(df) else None
+
+
+def get_source(name: str | None = None, **kwargs) -> BarSource:
+    """Sorgente per nome (default env BAR_SOURCE)."""
+    name = name or BAR_SOURCE
+    if name == "mt5":
+        return MT5Source(**kwargs)
+    if name == "replay":
+        root = kwargs.pop("root", None) or BAR_REPLAY_ROOT
+        if not root:
+            raise ValueError("ReplaySource richiede root (o BAR_REPLAY_ROOT)")
+        return ReplaySource(root, **kwargs)
+    raise ValueError(f"Sorgente di barre sconosciuta: {name!r}")
@@ -8,6 +8,11 @@ from backend.db.models import (
     Pattern,
     Statistic,
     EquitySeries,
+    EquityBlob,
+    ScreenerRow,
+    ComputeWatermark,
+    ComputeRun,
+    ComputeShard,
     BacktestParams,
     BacktestResult,
     Trade,
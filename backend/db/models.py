@@ -3,7 +3,7 @@ import enum
 
 from sqlalchemy import (
     Column, Integer, String, Float, DateTime, JSON, ForeignKey,
-    Text, Numeric, func
+    Text, Numeric, Index, LargeBinary, func
 )
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import JSONB
@@ -34,10 +34,18 @@ class Pattern(Base):
     params       = Column(JSON, nullable=False)
     years_back   = Column(Integer, nullable=False)
     source       = Column(String, nullable=False, default="precomputed")
+    # sha256(asset|type|params canonici|years_back) e hash dei trade (upsert idempotente)
+    pattern_key  = Column(String(64), nullable=True)
+    inputs_hash  = Column(String(64), nullable=True)
+
+    __table_args__ = (
+        Index('ux_patterns_pattern_key', 'pattern_key', unique=True),
+    )
 
     asset         = relationship('Asset', back_populates='patterns')
     statistics    = relationship('Statistic', back_populates='pattern', uselist=False)
     equity_series = relationship('EquitySeries', back_populates='pattern')
+    equity_blob   = relationship('EquityBlob', back_populates='pattern', uselist=False)
 
 class Statistic(Base):
     __tablename__ = 'statistics'
@@ -72,6 +80,124 @@ class EquitySeries(Base):
 
     pattern = relationship('Pattern', back_populates='equity_series')
 
+class EquityBlob(Base):
+    """Curva di equity di un pattern in un'unica riga (vedi services/equity_codec)."""
+    __tablename__ = 'equity_blobs'
+    pattern_id = Column(Integer, ForeignKey('patterns.id'), primary_key=True)
+    n_points   = Column(Integer, nullable=False)
+    first_ts   = Column(DateTime, nullable=True)
+    last_ts    = Column(DateTime, nullable=True)
+    data       = Column(LargeBinary, nullable=False)
+
+    pattern = relationship('Pattern', back_populates='equity_blob')
+
+class ScreenerRow(Base):
+    """
+    Read model del screener: una riga larga per pattern (asset, params tipizzati,
+    metriche, drawdown realizzato/flottante), rigenerata a fine run da
+    services/screener_view. Niente join né filtri su JSON a ogni richiesta.
+    """
+    __tablename__ = 'screener_rows'
+    # niente FK: la tabella è derivata e rigenerabile per intero
+    pattern_id    = Column(Integer, primary_key=True)
+    asset_id      = Column(Integer, nullable=False)
+    asset_symbol  = Column(String, nullable=False)
+    asset_group   = Column(String, nullable=False)
+    pattern_type  = Column(String, nullable=False)
+    years_back    = Column(Integer, nullable=False)
+    params        = Column(JSON, nullable=False)
+    # params tipizzati (NULL dove il tipo di pattern non li usa)
+    start_month   = Column(Integer)
+    start_day     = Column(Integer)
+    end_month     = Column(Integer)
+    end_day       = Column(Integer)
+    start_hour    = Column(Integer)
+    end_hour      = Column(Integer)
+    window_days   = Column(Integer)
+    # metriche (copia di Statistic)
+    gross_profit_pct      = Column(Float)
+    gross_loss_pct        = Column(Float)
+    net_return_pct        = Column(Float)
+    win_rate              = Column(Float)
+    profit_factor         = Column(Float)
+    expectancy            = Column(Float)
+    max_drawdown_pct      = Column(Float)
+    recovery_days         = Column(Integer)
+    sharpe_ratio          = Column(Float)
+    sortino_ratio         = Column(Float)
+    annual_volatility_pct = Column(Float)
+    num_trades            = Column(Integer)
+    avg_trade_pct         = Column(Float)
+    max_consec_wins       = Column(Integer)
+    max_consec_losses     = Column(Integer)
+    # drawdown da Statistic.extra_json
+    realized_max_drawdown_pct = Column(Float)
+    realized_dd_duration_days = Column(Integer)
+    floating_max_drawdown_pct = Column(Float)
+    floating_dd_duration_days = Column(Integer)
+    refreshed_at  = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        # filtri: tipo + anni + gruppo/simbolo, e simbolo da solo
+        Index('ix_screener_type_years_group', 'pattern_type', 'years_back', 'asset_group', 'asset_symbol'),
+        Index('ix_screener_symbol_type', 'asset_symbol', 'pattern_type', 'years_back'),
+        Index('ix_screener_asset', 'asset_id'),
+        # params per tipo di pattern
+        Index('ix_screener_annual', 'pattern_type', 'start_month', 'start_day', 'end_month', 'end_day'),
+        Index('ix_screener_monthly', 'pattern_type', 'start_day', 'window_days'),
+        Index('ix_screener_intraday', 'pattern_type', 'start_hour', 'end_hour'),
+        # ordinamenti più usati, dentro un tipo e un orizzonte
+        Index('ix_screener_sort_net', 'pattern_type', 'years_back', 'net_return_pct'),
+        Index('ix_screener_sort_winrate', 'pattern_type', 'years_back', 'win_rate'),
+        Index('ix_screener_sort_pf', 'pattern_type', 'years_back', 'profit_factor'),
+        Index('ix_screener_sort_sharpe', 'pattern_type', 'years_back', 'sharpe_ratio'),
+        Index('ix_screener_sort_mdd', 'pattern_type', 'years_back', 'max_drawdown_pct'),
+    )
+
+class ComputeWatermark(Base):
+    """Ultima barra (per asset / timeframe / tipo) già inclusa nei pattern salvati."""
+    __tablename__ = 'compute_watermarks'
+    asset_id     = Column(Integer, ForeignKey('assets.id'), primary_key=True)
+    timeframe    = Column(String, primary_key=True)
+    pattern_type = Column(String, primary_key=True)
+    last_bar_ts  = Column(DateTime, nullable=False)
+    updated_at   = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+class ComputeRun(Base):
+    """Run di calcolo pattern (completo o incrementale) con i suoi shard."""
+    __tablename__ = 'compute_runs'
+    id          = Column(Integer, primary_key=True)
+    kind        = Column(String, nullable=False, default="full")      # full | incremental
+    mode        = Column(String, nullable=False, default="asset")     # asset | asset_type
+    status      = Column(String, nullable=False, default="running")   # running | done | failed
+    n_shards    = Column(Integer, nullable=False, default=0)
+    started_at  = Column(DateTime, default=datetime.utcnow, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+
+    shards = relationship('ComputeShard', back_populates='run', order_by='ComputeShard.id')
+
+class ComputeShard(Base):
+    """Uno shard (asset × tipi di pattern) di un ComputeRun: stato, tempi, errore."""
+    __tablename__ = 'compute_shards'
+    id            = Column(Integer, primary_key=True)
+    run_id        = Column(Integer, ForeignKey('compute_runs.id'), nullable=False)
+    asset_id      = Column(Integer, ForeignKey('assets.id'), nullable=False)
+    pattern_types = Column(String, nullable=False)                      # "intraday,monthly"
+    status        = Column(String, nullable=False, default="pending")   # pending | running | done | failed
+    attempts      = Column(Integer, nullable=False, default=0)
+    saved         = Column(Integer, nullable=True)
+    seconds       = Column(Float, nullable=True)
+    host          = Column(String, nullable=True)
+    error         = Column(Text, nullable=True)
+    started_at    = Column(DateTime, nullable=True)
+    finished_at   = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index('ix_compute_shards_run_status', 'run_id', 'status'),
+    )
+
+    run = relationship('ComputeRun', back_populates='shards')
+
 class BacktestParams(Base):
     __tablename__ = "backtest_params"
     id           = Column(Integer, primary_key=True)
@@ -0,0 +1,96 @@
+# backend/jobs/backfill_drawdowns.py
+"""
+Backfill del drawdown realizzato / flottante in `Statistic.extra_json` per i
+pattern salvati prima che venisse calcolato in scrittura.
+
+  1. scorre `statistics` per pattern_id a blocchi e tiene le righe senza
+     `dd_realized.max_drawdown_pct` (tutte con `--all`);
+  2. legge l'equity del blocco in una volta (EquityBlob, poi EquitySeries
+     legacy) e calcola i drawdown vettoriali (`drawdown_info`);
+  3. aggiorna `extra_json` e le colonne di drawdown di `screener_rows`.
+
+Ogni blocco è una transazione: il job può essere interrotto e rilanciato.
+I pattern senza equity salvata restano senza drawdown.
+
+    python -m backend.jobs.backfill_drawdowns [--all]
+"""
+
+import argparse
+
+from sqlalchemy import inspect as sa_inspect, update
+
+from backend.db.session import SessionLocal
+from backend.db.models import Statistic, ScreenerRow
+from backend.services.pattern_store import equity_arrays, drawdown_info
+
+PATTERNS_PER_BATCH = 2000
+
+
+def _missing(extra_json) -> bool:
+    ej = extra_json or {}
+    return (ej.get("dd_realized") or {}).get("max_drawdown_pct") is None
+
+
+def _pending(session, after: int, recompute: bool):
+    """(ultimo pattern_id letto, [(pattern_id, extra_json)] da aggiornare) dopo `after`."""
+    rows = session.query(Statistic.pattern_id, Statistic.extra_json) \
+                  .filter(Statistic.pattern_id > after) \
+                  .order_by(Statistic.pattern_id) \
+                  .limit(PATTERNS_PER_BATCH).all()
+    if not rows:
+        return None, []
+    return rows[-1][0], [(pid, ej) for pid, ej in rows if recompute or _missing(ej)]
+
+
+def backfill_drawdowns(recompute: bool = False) -> int:
+    session = SessionLocal()
+    try:
+        has_screener = sa_inspect(session.get_bind()).has_table(ScreenerRow.__tablename__)
+        after, done, no_equity = 0, 0, 0
+        while True:
+            after, pending = _pending(session, after, recompute)
+            if after is None:
+                break
+            if not pending:
+                continue
+
+            curves = equity_arrays(session, [pid for pid, _ in pending])
+            found  = [(pid, ej) for pid, ej in pending if pid in curves]
+            no_equity += len(pending) - len(found)
+            dds = drawdown_info([curves[pid] for pid, _ in found])
+
+            stat_rows, screener_rows = [], []
+            for (pid, ej), (dd, _, _) in zip(found, dds):
+                ej = dict(ej or {})
+                ej["dd_realized"] = dd
+                # floating = stessa curva, come in pattern_store.statistic_rows
+                if recompute or (ej.get("dd_floating") or {}).get("max_drawdown_pct") is None:
+                    ej["dd_floating"] = dict(dd)
+                stat_rows.append({'pattern_id': pid, 'extra_json': ej})
+                screener_rows.append({
+                    'pattern_id': pid,
+                    'realized_max_drawdown_pct': dd["max_drawdown_pct"],
+                    'realized_dd_duration_days': dd["dd_duration_days"],
+                    'floating_max_drawdown_pct': ej["dd_floating"]["max_drawdown_pct"],
+                    'floating_dd_duration_days': ej["dd_floating"]["dd_duration_days"],
+                })
+
+            session.bulk_update_mappings(Statistic, stat_rows)
+            if has_screener and screener_rows:
+                # UPDATE per chiave primaria in executemany (righe assenti ignorate)
+                session.execute(update(ScreenerRow), screener_rows)
+            session.commit()
+            done += len(stat_rows)
+            print(f"📉 Drawdown salvati: {done} (fino a pattern {after})")
+
+        print(f"✅ Backfill completato: {done} pattern aggiornati, {no_equity} senza equity")
+        return done
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Backfill del drawdown in statistics.extra_json")
+    ap.add_argument('--all', action='store_true', help="ricalcola anche i drawdown già presenti")
+    args = ap.parse_args()
+    backfill_drawdowns(recompute=args.all)
@@ -0,0 +1,97 @@
+# backend/jobs/backfill_pattern_keys.py
+"""
+Migrazione una tantum per l'upsert idempotente dei pattern.
+
+  1. aggiunge `patterns.pattern_key` / `patterns.inputs_hash` se mancano;
+  2. calcola la chiave dei pattern esistenti; `inputs_hash` resta NULL, così
+     il primo run della pipeline nuova riscrive statistiche ed equity legacy
+     invece di saltarli come invariati;
+  3. fra i duplicati della stessa chiave tiene il più recente (id maggiore) e
+     cancella gli altri con statistiche ed equity – tranne quelli ancora
+     referenziati da `equity_point`, che restano senza chiave;
+  4. crea l'indice unico `ux_patterns_pattern_key`.
+
+    python -m backend.jobs.backfill_pattern_keys
+"""
+
+from collections import defaultdict
+
+from sqlalchemy import inspect as sa_inspect, text
+
+from backend.db.session import SessionLocal
+from backend.db.models import Pattern, Statistic, EquitySeries, EquityBlob, EquityPoint
+from backend.services.pattern_store import pattern_key, _chunks
+
+BATCH = 5000
+
+
+def _add_columns(session):
+    bind = session.get_bind()
+    cols = {c['name'] for c in sa_inspect(bind).get_columns('patterns')}
+    for name in ('pattern_key', 'inputs_hash'):
+        if name not in cols:
+            session.execute(text(f"ALTER TABLE patterns ADD COLUMN {name} VARCHAR(64)"))
+    session.commit()
+
+
+def backfill_pattern_keys():
+    session = SessionLocal()
+    try:
+        _add_columns(session)
+
+        rows = session.query(Pattern.id, Pattern.asset_id, Pattern.type, Pattern.params, Pattern.years_back) \
+                      .filter(Pattern.pattern_key.is_(None)) \
+                      .order_by(Pattern.id).all()
+        by_key = defaultdict(list)
+        for pid, asset_id, ptype, params, yb in rows:
+            by_key[pattern_key(asset_id, ptype, params, yb)].append(pid)
+
+        # chiavi già assegnate (run precedente interrotto): quelle restano le più recenti
+        taken = dict(session.query(Pattern.pattern_key, Pattern.id)
+                            .filter(Pattern.pattern_key.isnot(None)))
+
+        keep, drop = {}, []
+        for key, ids in by_key.items():
+            if key in taken:
+                drop.extend(ids)
+            else:
+                keep[key] = ids[-1]
+                drop.extend(ids[:-1])
+
+        referenced = set()
+        for chunk in _chunks(drop):
+            referenced.update(pid for (pid,) in session.query(EquityPoint.pattern_id)
+                                                      .filter(EquityPoint.pattern_id.in_(chunk))
+                                                      .distinct())
+        drop = [pid for pid in drop if pid not in referenced]
+
+        for chunk in _chunks(drop):
+            session.query(Statistic).filter(Statistic.pattern_id.in_(chunk)).delete(synchronize_session=False)
+            session.query(EquitySeries).filter(EquitySeries.pattern_id.in_(chunk)).delete(synchronize_session=False)
+            session.query(EquityBlob).filter(EquityBlob.pattern_id.in_(chunk)).delete(synchronize_session=False)
+            session.query(Pattern).filter(Pattern.id.in_(chunk)).delete(synchronize_session=False)
+        session.commit()
+        print(f"🗑  Rimossi {len(drop)} pattern duplicati ({len(referenced)} tenuti: usati da equity_point)")
+
+        items = list(keep.items())
+        for i in range(0, len(items), BATCH):
+            batch = items[i:i + BATCH]
+            # inputs_hash NULL: diverso da qualunque hash calcolato → ricalcolo al primo run
+            session.bulk_update_mappings(Pattern, [
+                {'id': pid, 'pattern_key': key, 'inputs_hash': None}
+                for key, pid in batch
+            ])
+            session.commit()
+            print(f"🔑 Chiavi assegnate: {min(i + BATCH, len(items))}/{len(items)}")
+
+        for idx in Pattern.__table__.indexes:
+            if idx.name == 'ux_patterns_pattern_key':
+                idx.create(session.get_bind(), checkfirst=True)
+        session.commit()
+        print("✅ Indice ux_patterns_pattern_key pronto")
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    backfill_pattern_keys()
@@ -2,112 +2,102 @@
 import os
 import pandas as pd
 import numpy as np
-from datetime import timedelta
+from datetime import datetime, timedelta
 from joblib import Parallel, delayed
 import traceback
+import socket
+import time
+from celery import shared_task, group, chord
 
 from backend.db.session import SessionLocal
-from backend.db.models import Asset, Pattern, Statistic, EquitySeries
-from backend.services.statistics import get_pattern_statistics
-from backend.services.backtest_engine import _drawdown_duration
+from backend.db.models import Asset, ComputeWatermark, ComputeRun
+from backend.services.statistics import get_pattern_statistics, BATCH_ENGINES
+from backend.services.history_parquet import load_history
+from backend.services.history_store import convert_history, load_history_arrays
+from backend.services.history_catalog import load_catalog, has_history
+from backend.services import compute_metrics as metrics
+from backend.services.run_ledger import (
+    create_run, resumable_run, reopen_run, unfinished_shards, finish_run, active_run, ensure_tables,
+    shard_started, shard_finished, run_summary,
+)
+from backend.services.pattern_store import upsert_patterns, PatternSink, safe_value
+from backend.services.screener_view import refresh_after_run
 
 # ── Config paths ───────────────────────────────────────────────────────────────
 ROOT_DIR     = os.path.abspath(os.path.join(os.path.dirname(__file__), '../..'))
 HISTORY_ROOT = os.path.join(ROOT_DIR, 'mt5_history')
 
 # ── Parallel params ─────────────────────────────────────────────────────────────
-NUM_WORKERS = 14
+# core usati da joblib in modalità locale
+NUM_WORKERS = int(os.getenv("COMPUTE_NUM_WORKERS", 14))
 # ciascun worker prende questo numero di job alla volta
 CHUNK_SIZE  = 100
 
-# ── Helpers ────────────────────────────────────────────────────────────────────
-def load_symbol_history(group: str, symbol: str, tf_str: str = 'D1') -> pd.DataFrame:
-    """
-    Parquet-first; restituisce DataFrame con colonne
-    ['timestamp','open','high','low','close'].
-    """
-    parquet_fp = os.path.join(HISTORY_ROOT, group, symbol, f"{symbol}_{tf_str}.parquet")
-    if not os.path.isfile(parquet_fp):
-        raise FileNotFoundError(f"History file Parquet non trovato: {parquet_fp}")
-    df = pd.read_parquet(parquet_fp)
-
-    # se 'time' esiste, rinominala in 'timestamp'
-    if 'time' in df.columns and 'timestamp' not in df.columns:
-        df = df.rename(columns={'time':'timestamp'})
+# scritture: soglie di flush/commit in PatternSink
+# (env PATTERN_FLUSH_ROWS / PATTERN_FLUSH_BYTES, vedi services/pattern_store)
 
-    # se il timestamp è nell'indice anziché in colonna, lo resettiamo
-    if not ('timestamp' in df.columns):
-        df = df.reset_index().rename(columns={'index':'timestamp'})
+# "distributed" (sotto-task Celery per shard) o "local" (joblib)
+COMPUTE_MODE = os.getenv("COMPUTE_MODE", "distributed")
 
-    # assicuriamoci che timestamp sia datetime e ordinato
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
-    df = df.sort_values('timestamp')
+# ── Definitions ────────────────────────────────────────────────────────────────
+intraday_defs = [
+    {'tf':'H1','start_hour':h,'end_hour':h+d}
+    for d in range(1,7) for h in range(0,24-d+1)
+]
+monthly_defs = [
+    {'start_day':d,'window_days':w}
+    for d in range(1,29) for w in (3,7,15) if d+w-1<=31
+]
+annual_defs = []
+for m in range(1,13):
+    days = pd.Period(f"2000-{m:02d}", freq='M').days_in_month
+    for d in range(1,days+1):
+        start = pd.Timestamp(2000,m,d)
+        for k in range(1,27):
+            end = start + timedelta(days=7*k)
+            if end.year==2000:
+                annual_defs.append({
+                    'start_month':m,'start_day':d,
+                    'end_month':end.month,'end_day':end.day
+                })
+years_options = [5,10,15,20]
 
-    return df[['timestamp','open','high','low','close']]
+PATTERN_DEFS = {
+    'intraday': intraday_defs,
+    'monthly':  monthly_defs,
+    'annual':   annual_defs,
+}
+PATTERN_TF = {'intraday': 'H1', 'monthly': 'D1', 'annual': 'D1'}
 
+# ── Helpers ────────────────────────────────────────────────────────────────────
+def load_symbol_history(group: str, symbol: str, tf_str: str = 'D1', start=None, end=None,
+                        columns=('open', 'high', 'low', 'close'), years_back=None) -> pd.DataFrame:
+    """
+    Storico fra `start` e `end` (o gli ultimi `years_back` anni) con le sole
+    colonne richieste: DataFrame ['timestamp', *columns]. Dal layout per anno
+    legge solo partizioni, row group e colonne necessari; altrimenti
+    ripiega sul file unico parquet/CSV.
+    """
+    return load_history(group, symbol, tf_str, start=start, end=end,
+                        columns=list(columns), years_back=years_back, root=HISTORY_ROOT)
 
-def safe_value(val):
-    if isinstance(val, (np.generic,)):
-        return val.item()
-    if isinstance(val, pd.Timestamp):
-        return val.to_pydatetime()
-    if pd.isna(val):
-        return None
-    return val
 
 def convert_types_for_sqlalchemy(d: dict) -> dict:
     return {k: safe_value(v) for k,v in d.items()}
 
-# ── Core save (per singolo pattern) ────────────────────────────────────────────
+# ── Core save (upsert idempotente per pattern_key) ─────────────────────────────
 def save_pattern(session, asset, pattern_type, params, years_back, stats, equity_series):
-    pat = Pattern(
-        asset_id   = asset.id,
-        type       = pattern_type,
-        params     = params,
-        years_back = years_back,
-        source     = "precomputed"
-    )
-    session.add(pat)
-    session.flush()  # pat.id disponibile
-
-    # ricostruisci equity series e calcola drawdown
-    full_idx = pd.DatetimeIndex(sorted(pt["timestamp"] for pt in equity_series))
-    eq = pd.Series(
-        [pt["value"] for pt in sorted(equity_series, key=lambda x: x["timestamp"])],
-        index=full_idx
-    )
-    dd_realized = _drawdown_duration(eq)
-    dd_floating = dd_realized
-
-    # serializza datetime
-    from datetime import datetime
-    def _iso_dates(d: dict) -> dict:
-        return {k: (v.isoformat() if isinstance(v,(pd.Timestamp,datetime)) else v)
-                for k,v in d.items()}
-
-    stats["extra_json"] = {
-        "dd_realized": _iso_dates(dd_realized),
-        "dd_floating": _iso_dates(dd_floating),
-    }
-    stats.setdefault("recovery_days", 0)
-
-    # filtra per colonne presenti in Statistic
-    stat_kwargs = convert_types_for_sqlalchemy(stats)
-    from sqlalchemy.inspection import inspect
-    cols = {c.key for c in inspect(Statistic).mapper.column_attrs}
-    stat_kwargs = {k:v for k,v in stat_kwargs.items() if k in cols}
+    upsert_patterns(session, asset.id, pattern_type, [(params, years_back, stats, equity_series)])
 
-    session.add(Statistic(pattern_id=pat.id, **stat_kwargs))
-
-    # EquitySeries objects
-    for pt in equity_series:
-        if pt["value"] is None:
-            continue
-        session.add(EquitySeries(
-            pattern_id   = pat.id,
-            timestamp    = safe_value(pt['timestamp']),
-            equity_value = safe_value(pt['value'])
-        ))
+def save_patterns_batch(session, asset, pattern_type, items) -> int:
+    """
+    items: list[(params, years_back, stats, equity_series)].
+    Upsert per pattern_key via BulkWriter (COPY su PostgreSQL), pattern con
+    trade invariati saltati.
+    Ritorna il numero di pattern scritti (nuovi + aggiornati).
+    """
+    res = upsert_patterns(session, asset.id, pattern_type, items)
+    return res["inserted"] + res["updated"]
 
 # ── Singolo worker per job (asset×pattern) ─────────────────────────────────────
 def process_single_pattern(asset_id, pattern_type, params, years_back):
@@ -118,7 +108,8 @@ def process_single_pattern(asset_id, pattern_type, params, years_back):
             return
         tf = 'H1' if pattern_type=='intraday' else 'D1'
         try:
-            df = load_symbol_history(asset.group, asset.symbol, tf)
+            # solo gli anni della finestra `years_back`
+            df = load_symbol_history(asset.group, asset.symbol, tf, years_back=years_back)
         except Exception as e:
             print(f"❌ [Load] {asset.symbol} ({pattern_type}) ERRORE: {e}")
             return
@@ -133,62 +124,389 @@ def process_single_pattern(asset_id, pattern_type, params, years_back):
     finally:
         session.close()
 
-# ── Entry point parallelo ───────────────────────────────────────────────────────
-def compute_patterns_parallel(
-    num_workers: int = NUM_WORKERS,
-    chunk_size:  int = CHUNK_SIZE
-):
+# ── Watermark dei dati già calcolati ───────────────────────────────────────────
+def _last_bar(hist) -> datetime:
+    return pd.Timestamp(int(hist.timestamp[-1])).to_pydatetime()
+
+def _set_watermark(session, asset_id, tf, pattern_type, last_bar):
+    wm = session.get(ComputeWatermark, (asset_id, tf, pattern_type))
+    if wm is None:
+        session.add(ComputeWatermark(
+            asset_id=asset_id, timeframe=tf, pattern_type=pattern_type, last_bar_ts=last_bar
+        ))
+    else:
+        wm.last_bar_ts = last_bar
+
+# ── Worker a shard (asset, o asset × tipo): storico caricato una volta ─────────
+def _compute_pattern_type(session, asset, pattern_type, hist) -> int:
+    # estrazione unica al lookback massimo, viste in coda per gli altri;
+    # un lookback alla volta: scritto nel sink prima di calcolare il successivo
+    engine = BATCH_ENGINES[pattern_type]
+    t0, n_results = time.perf_counter(), 0
+    with metrics.labels(pattern_type):
+        # flush a soglia (righe o byte) con commit: il buffer resta limitato
+        with PatternSink(session, asset.id) as sink:
+            for yb, res in metrics.timed("extract", engine(hist, PATTERN_DEFS[pattern_type], years_options)):
+                n_results += len(res)
+                metrics.patterns_computed(len(res))
+                for params, stats, equity in res:
+                    if stats and equity:
+                        sink.add(pattern_type, params, yb, stats, equity)
+                del res
+        metrics.throughput(n_results, time.perf_counter() - t0)
+    return sink.written
+
+def process_asset_shard(asset_id, pattern_types=tuple(PATTERN_DEFS), raise_errors=False):
+    session = SessionLocal()
+    saved = 0
+    try:
+        ensure_tables(session)          # watermark su database esistenti
+        asset = session.get(Asset, asset_id)
+        if not asset:
+            return 0
+
+        histories = {}
+        for pattern_type in pattern_types:
+            tf = PATTERN_TF[pattern_type]
+            with metrics.labels(pattern_type, asset.group):
+                if tf not in histories:
+                    try:
+                        # memory-map condiviso fra i worker, nessuna copia pandas
+                        with metrics.stage("load"):
+                            histories[tf] = load_history_arrays(asset.group, asset.symbol, tf)
+                    except FileNotFoundError as e:
+                        print(f"❌ [Load] {asset.symbol} ({tf}) ERRORE: {e}")
+                        histories[tf] = None
+                hist = histories[tf]
+                if hist is None:
+                    continue
+
+                saved += _compute_pattern_type(session, asset, pattern_type, hist)
+                if len(hist):
+                    _set_watermark(session, asset.id, tf, pattern_type, _last_bar(hist))
+                with metrics.stage("commit"):
+                    session.commit()
+
+        print(f"✔ {asset.symbol} | {'+'.join(pattern_types)} | {saved} pattern")
+        return saved
+    except Exception:
+        session.rollback()
+        print(f"❌ [Calc] {asset_id} - shard {pattern_types} - ERRORE:\n{traceback.format_exc()}")
+        if raise_errors:
+            raise
+        return saved
+    finally:
+        session.close()
+
+# ── Ricalcolo incrementale (nuove barre oltre il watermark) ────────────────────
+def _month_day(months, day):
+    """Giorno `day` (1-based) di ciascun mese di `months` (datetime64[M]), limitato a fine mese."""
+    first  = months.astype("datetime64[D]")
+    length = (months + 1).astype("datetime64[D]") - first
+    return first + np.minimum((day - 1).astype("timedelta64[D]"), length - np.timedelta64(1, "D"))
+
+def _touches(pattern_type, defs, lo: pd.Timestamp, hi: pd.Timestamp) -> np.ndarray:
+    """
+    Maschera delle definizioni con almeno una finestra di trade (date di
+    calendario, sovrainsieme delle barre usate dal motore) che interseca
+    [lo, hi]. Le definizioni che il motore batch non scompone (intraday non
+    H1 o senza ore) sono sempre incluse.
+    """
+    one_day = np.timedelta64(1, "D")
+    if pattern_type == "annual":
+        years = (np.arange(lo.year, hi.year + 1) - 1970).astype("datetime64[Y]")[:, None]
+        col   = lambda k: np.array([p[k] for p in defs])
+        start = _month_day(years.astype("datetime64[M]") + (col("start_month") - 1), col("start_day"))
+        end   = _month_day(years.astype("datetime64[M]") + (col("end_month") - 1), col("end_day")) + one_day
+        keep  = np.ones(len(defs), dtype=bool)
+    elif pattern_type == "monthly":
+        months = np.arange(np.datetime64(lo, "M"), np.datetime64(hi, "M") + 1)[:, None]
+        sd = np.array([p["start_day"] for p in defs])
+        wd = np.array([p["window_days"] for p in defs])
+        start = _month_day(months, sd)
+        end   = _month_day(months, sd + wd - 1) + one_day
+        keep  = np.ones(len(defs), dtype=bool)
+    else:
+        keep = np.array([
+            p.get("tf") == "H1" and p.get("start_hour") is not None and p.get("end_hour") is not None
+            for p in defs
+        ])
+        days = np.arange(np.datetime64(lo, "D"), np.datetime64(hi, "D") + 1)[:, None]
+        sh = np.array([p["start_hour"] if k else 0 for p, k in zip(defs, keep)])
+        eh = np.array([p["end_hour"] if k else 0 for p, k in zip(defs, keep)])
+        start = days + sh.astype("timedelta64[h]")
+        end   = days + eh.astype("timedelta64[h]")
+    hit = ((start <= np.datetime64(hi)) & (end >= np.datetime64(lo))).any(axis=0)
+    return hit | ~keep
+
+def affected_definitions(pattern_type, defs, since: pd.Timestamp, last: pd.Timestamp, years_back: int) -> np.ndarray:
+    """
+    Definizioni i cui risultati a `years_back` possono cambiare passando
+    dall'ultima barra `since` (watermark) a `last`: trade che chiudono dopo il
+    watermark, oppure trade nel tratto uscito dalla finestra di lookback
+    (l'inizio della finestra avanza con l'ultima barra).
+    """
+    old_start = since - pd.DateOffset(years=years_back)
+    new_start = last - pd.DateOffset(years=years_back)
+    return _touches(pattern_type, defs, since, last) | _touches(pattern_type, defs, old_start, new_start)
+
+def _refresh_pattern_type(session, asset, pattern_type, hist, since) -> int:
+    """
+    Aggiorna i pattern di `pattern_type` toccati dalle barre arrivate dopo
+    `since`: il motore gira solo sulle definizioni e sui lookback interessati
+    (`affected_definitions`) e i risultati passano da PatternSink, che
+    riscrive statistiche ed equity dei pattern con trade cambiati (hash) e
+    inserisce quelli nuovi. Gli altri restano invariati.
+    """
+    defs = PATTERN_DEFS[pattern_type]
+    last = pd.Timestamp(int(hist.timestamp[-1]))
+    affected = {yb: affected_definitions(pattern_type, defs, since, last, yb) for yb in years_options}
+    years = [yb for yb in years_options if affected[yb].any()]
+    idx   = np.flatnonzero(np.logical_or.reduce([affected[yb] for yb in years])) if years else []
+    if not len(idx):
+        return 0
+
+    engine = BATCH_ENGINES[pattern_type]
+    with PatternSink(session, asset.id) as sink:
+        for yb, res in metrics.timed("extract", engine(hist, [defs[j] for j in idx], years)):
+            metrics.patterns_computed(len(res))
+            for j, (params, stats, equity) in zip(idx, res):
+                if affected[yb][j] and stats and equity:
+                    sink.add(pattern_type, params, yb, stats, equity)
+            del res
+    return sink.written
+
+def process_asset_incremental(asset_id, pattern_types=tuple(PATTERN_DEFS), raise_errors=False):
+    """
+    Come `process_asset_shard`, ma tocca solo i tipi con barre nuove rispetto
+    al watermark e, fra questi, solo i pattern con trade chiusi dopo di esso.
+    Senza watermark ricade nel calcolo completo.
+    """
+    session = SessionLocal()
+    updated = 0
+    try:
+        ensure_tables(session)          # watermark su database esistenti
+        asset = session.get(Asset, asset_id)
+        if not asset:
+            return 0
+
+        for pattern_type in pattern_types:
+            tf = PATTERN_TF[pattern_type]
+            with metrics.labels(pattern_type, asset.group):
+                try:
+                    with metrics.stage("load"):
+                        hist = load_history_arrays(asset.group, asset.symbol, tf)
+                except FileNotFoundError:
+                    continue
+                if not len(hist):
+                    continue
+
+                last_bar = _last_bar(hist)
+                wm = session.get(ComputeWatermark, (asset.id, tf, pattern_type))
+                if wm is None:
+                    updated += _compute_pattern_type(session, asset, pattern_type, hist)
+                elif wm.last_bar_ts >= last_bar:
+                    continue            # nessuna barra nuova
+                else:
+                    updated += _refresh_pattern_type(
+                        session, asset, pattern_type, hist, pd.Timestamp(wm.last_bar_ts)
+                    )
+                _set_watermark(session, asset.id, tf, pattern_type, last_bar)
+                with metrics.stage("commit"):
+                    session.commit()
+
+        print(f"✔ {asset.symbol} | incrementale | {updated} pattern aggiornati")
+        return updated
+    except Exception:
+        session.rollback()
+        print(f"❌ [Incr] {asset_id} - ERRORE:\n{traceback.format_exc()}")
+        if raise_errors:
+            raise
+        return updated
+    finally:
+        session.close()
+
+def compute_patterns_incremental(num_workers: int = NUM_WORKERS, resume: bool = False):
+    """Ricalcolo incrementale di tutti gli asset con storico (es. dopo il fetch notturno)."""
+    run_id, shard_ids = open_run("incremental", "asset", resume)
+    print(f"\n🔁 Ricalcolo incrementale di {len(shard_ids)} asset su {num_workers} core\n")
+    _execute_shards(run_id, shard_ids, True, num_workers)
+
+def _live_run():
+    session = SessionLocal()
+    try:
+        ensure_tables(session)
+        return active_run(session)
+    finally:
+        session.close()
+
+@shared_task(name="backend.jobs.compute_patterns.compute_patterns_incremental_task")
+def compute_patterns_incremental_task(mode=None):
+    """
+    Job Celery: refresh incrementale dei pattern, in chain dopo il fetch
+    notturno (`fetch_and_refresh_task`). Salta se un altro run (es. il
+    completo settimanale) è ancora in corso nel ledger.
+    """
+    live = _live_run()
+    if live is not None:
+        print(f"⏭ Ricalcolo incrementale saltato: run {live.id} ({live.kind}) in corso")
+        return None
+    if (mode or COMPUTE_MODE) == "local":
+        compute_patterns_incremental()
+        return None
+    res = compute_patterns_distributed(incremental=True)
+    return res.id if res is not None else None
+
+# ── Pianificazione job ─────────────────────────────────────────────────────────
+def plan_jobs(mode: str = "asset", prepare: bool = True) -> list:
+    """
+    Lista di (funzione, args) per tutti gli asset con storico.
+
+    mode:
+        "asset"       – un job per asset (tutti i tipi, storico caricato una volta)
+        "asset_type"  – un job per asset × tipo di pattern
+        "pattern"     – legacy: un job per (asset, tipo, params, years_back)
+
+    `prepare` converte gli storici nello store memory-mapped locale; in modalità
+    distribuita ogni nodo lo fa da sé alla prima lettura.
+    """
+    if mode not in ("asset", "asset_type", "pattern"):
+        raise ValueError(f"mode non valido: {mode!r}")
+
     session = SessionLocal()
     try:
         assets = session.query(Asset).all()
     finally:
         session.close()
 
-    # rigenera pattern definitions
-    intraday_defs = [
-        {'tf':'H1','start_hour':h,'end_hour':h+d}
-        for d in range(1,7) for h in range(0,24-d+1)
-    ]
-    monthly_defs = [
-        {'start_day':d,'window_days':w}
-        for d in range(1,29) for w in (3,7,15) if d+w-1<=31
-    ]
-    annual_defs = []
-    for m in range(1,13):
-        days = pd.Period(f"2000-{m:02d}", freq='M').days_in_month
-        for d in range(1,days+1):
-            start = pd.Timestamp(2000,m,d)
-            for k in range(1,27):
-                end = start + timedelta(days=7*k)
-                if end.year==2000:
-                    annual_defs.append({
-                        'start_month':m,'start_day':d,
-                        'end_month':end.month,'end_day':end.day
-                    })
-    years_options = [5,10,15,20]
-
-    # costruisci job list
+    # costruisci job list: esistenza dal catalogo, senza aprire i parquet
+    catalog = load_catalog()
     jobs = []
     for asset in assets:
-        has_int = True
-        has_dly = True
-        # skip se parquet mancante
-        try: load_symbol_history(asset.group, asset.symbol, 'H1')
-        except: has_int = False
-        try: load_symbol_history(asset.group, asset.symbol, 'D1')
-        except: has_dly = False
-
-        for yb in years_options:
-            if has_int:
-                for p in intraday_defs:
-                    jobs.append((asset.id,'intraday',p,yb))
-            if has_dly:
-                for p in monthly_defs:
-                    jobs.append((asset.id,'monthly',p,yb))
-                for p in annual_defs:
-                    jobs.append((asset.id,'annual',p,yb))
-
-    print(f"\n🚀 Lancio {len(jobs)} job su {num_workers} core (batch_size={chunk_size})\n")
+        available = {
+            tf: has_history(catalog, asset.group, asset.symbol, tf)
+            for tf in set(PATTERN_TF.values())
+        }
+        # converte una volta per run nello store memory-mapped (no-op se aggiornato)
+        if prepare:
+            for tf, present in available.items():
+                if present:
+                    convert_history(asset.group, asset.symbol, tf)
+
+        types = [t for t in PATTERN_DEFS if available[PATTERN_TF[t]]]
+        if not types:
+            continue
+        if mode == "asset":
+            jobs.append((process_asset_shard, (asset.id, tuple(types))))
+        elif mode == "asset_type":
+            for ptype in types:
+                jobs.append((process_asset_shard, (asset.id, (ptype,))))
+        else:
+            for ptype in types:
+                for yb in years_options:
+                    for p in PATTERN_DEFS[ptype]:
+                        jobs.append((process_single_pattern, (asset.id, ptype, p, yb)))
+    return jobs
+
+# ── Ledger dei run: shard registrati, ripresi e ritentati ──────────────────────
+def run_shard(shard_id, incremental=False) -> dict:
+    """Esegue uno shard del ledger registrando stato, tempi ed eventuale errore."""
+    asset_id, types = shard_started(shard_id)
+    fn = process_asset_incremental if incremental else process_asset_shard
+    t0 = time.perf_counter()
+    saved, error = None, None
+    try:
+        saved = fn(asset_id, types, raise_errors=True)
+    except Exception:
+        error = traceback.format_exc()
+    seconds = round(time.perf_counter() - t0, 3)
+    shard_finished(shard_id, saved, seconds, error)
+    metrics.export()
+    return {
+        'shard_id':      shard_id,
+        'asset_id':      asset_id,
+        'pattern_types': list(types),
+        'status':        'failed' if error else 'done',
+        'saved':         saved or 0,
+        'seconds':       seconds,
+        'host':          socket.gethostname(),
+    }
+
+def open_run(kind: str, mode: str = "asset", resume: bool = False, prepare: bool = True):
+    """
+    Registra un nuovo run (uno shard per job di `plan_jobs`) oppure, con
+    `resume`, riapre l'ultimo run interrotto/fallito dello stesso tipo.
+    Ritorna (run_id, id degli shard da eseguire).
+    """
+    session = SessionLocal()
+    try:
+        ensure_tables(session)
+        if resume:
+            live = active_run(session, kind, mode)
+            if live is not None:
+                raise RuntimeError(f"run {live.id} ({kind}/{mode}) ancora in corso: niente ripresa")
+        run = resumable_run(session, kind, mode) if resume else None
+        if run is None:
+            shards = [args for _, args in plan_jobs(mode, prepare)]
+            run = create_run(session, kind, mode, shards)
+            print(f"📒 Run {run.id} ({kind}/{mode}): {len(shards)} shard")
+        else:
+            reopen_run(session, run.id)
+            print(f"📒 Ripresa del run {run.id} ({kind}/{mode})")
+        return run.id, [sh.id for sh in unfinished_shards(session, run.id)]
+    finally:
+        session.close()
+
+def _execute_shards(run_id, shard_ids, incremental, num_workers) -> dict:
+    Parallel(n_jobs=num_workers, backend="loky", verbose=5, batch_size=1)(
+        delayed(run_shard)(sid, incremental) for sid in shard_ids
+    )
+    summary = finish_run(run_id)
+    print(f"\n📒 Run {run_id}: {summary}")
+    refresh_after_run(run_id)
+    return summary
+
+def retry_failed(run_id: int, shard_ids=None, num_workers: int = NUM_WORKERS,
+                 distributed: bool = False):
+    """Riesegue solo gli shard `failed` del run (o quelli indicati fra essi)."""
+    session = SessionLocal()
+    try:
+        run = session.get(ComputeRun, run_id)
+        if run is None:
+            raise ValueError(f"run {run_id} inesistente")
+        incremental = run.kind == "incremental"
+        ids = [sh.id for sh in unfinished_shards(session, run_id, only_failed=True, shard_ids=shard_ids)]
+        reopen_run(session, run_id)
+    finally:
+        session.close()
+
+    print(f"🔁 Run {run_id}: {len(ids)} shard falliti da ritentare")
+    if distributed:
+        return _dispatch(run_id, ids, incremental)
+    return _execute_shards(run_id, ids, incremental, num_workers)
+
+# ── Entry point parallelo (singola macchina) ───────────────────────────────────
+def compute_patterns_parallel(
+    num_workers: int = NUM_WORKERS,
+    chunk_size:  int = CHUNK_SIZE,
+    mode:        str = "asset",
+    resume:      bool = False,
+):
+    """
+    Calcolo completo con joblib sui core della macchina locale (vedi `plan_jobs`).
+    Le modalità a shard sono registrate nel ledger: `resume=True` riprende
+    l'ultimo run interrotto eseguendo solo gli shard non completati.
+    """
+    if mode != "pattern":
+        run_id, shard_ids = open_run("full", mode, resume)
+        print(f"\n🚀 Lancio {len(shard_ids)} shard ({mode}) su {num_workers} core\n")
+        summary = _execute_shards(run_id, shard_ids, False, num_workers)
+        if summary['status'] == "done":
+            print("\n✅ Tutti i pattern completati con successo.")
+        return summary
+
+    jobs = plan_jobs(mode)
+    print(f"\n🚀 Lancio {len(jobs)} job ({mode}) su {num_workers} core (batch_size={chunk_size})\n")
 
     Parallel(
         n_jobs     = num_workers,
@@ -196,11 +514,94 @@ def compute_patterns_parallel(
         verbose    = 5,
         batch_size = chunk_size
     )(
-        delayed(process_single_pattern)(*job)
-        for job in jobs
+        delayed(fn)(*args)
+        for fn, args in jobs
     )
 
+    refresh_after_run()
     print("\n✅ Tutti i pattern completati con successo.")
 
+# ── Modalità distribuita: fan-out / fan-in via Celery ──────────────────────────
+@shared_task(name="backend.jobs.compute_patterns.compute_shard_task", acks_late=True)
+def compute_shard_task(shard_id, incremental=False):
+    """Sotto-task: uno shard del ledger su qualunque nodo della coda `computations`."""
+    return run_shard(shard_id, incremental)
+
+@shared_task(name="backend.jobs.compute_patterns.aggregate_shards_task")
+def aggregate_shards_task(results, run_id):
+    """Passo finale del chord: chiude il run nel ledger, riepiloga gli shard e aggiorna il screener."""
+    summary = {
+        'run_id':  run_id,
+        'shards':  len(results),
+        'failed':  sum(r['status'] == 'failed' for r in results),
+        'saved':   sum(r['saved'] for r in results),
+        'seconds': round(sum(r['seconds'] for r in results), 3),
+        'hosts':   {},
+    }
+    for r in results:
+        summary['hosts'][r['host']] = summary['hosts'].get(r['host'], 0) + 1
+    summary['status'] = finish_run(run_id)['status']
+    summary['screener_rows'] = refresh_after_run(run_id)
+    print(f"\n✅ Run {run_id}: {summary['shards']} shard ({summary['failed']} falliti), "
+          f"{summary['saved']} pattern ({summary['seconds']}s di calcolo su {len(summary['hosts'])} nodi)")
+    return summary
+
+def _dispatch(run_id, shard_ids, incremental):
+    if not shard_ids:
+        finish_run(run_id)
+        return None
+    return chord(
+        group(compute_shard_task.s(sid, incremental) for sid in shard_ids),
+        aggregate_shards_task.s(run_id),
+    ).apply_async(queue='computations')
+
+def compute_patterns_distributed(mode: str = "asset", incremental: bool = False, resume: bool = False):
+    """
+    Un sotto-task Celery per shard (group) + aggregazione finale (chord),
+    tutti sulla coda `computations`: aggiungere nodi accorcia il run.
+    Gli shard sono registrati nel ledger come in `compute_patterns_parallel`.
+    Con `task_always_eager` (CELERY_TASK_ALWAYS_EAGER=1) gira in locale.
+    """
+    if mode not in ("asset", "asset_type"):
+        raise ValueError(f"mode distribuito non valido: {mode!r}")
+    kind = "incremental" if incremental else "full"
+    run_id, shard_ids = open_run(kind, mode, resume, prepare=False)
+    print(f"\n🚀 Distribuzione di {len(shard_ids)} shard ({mode}) sulla coda computations\n")
+    return _dispatch(run_id, shard_ids, incremental)
+
+@shared_task(name="backend.jobs.compute_patterns.compute_patterns_task")
+def compute_patterns_task(mode=None):
+    """
+    Job Celery settimanale. COMPUTE_MODE=distributed (default) fa fan-out sugli
+    worker della coda; COMPUTE_MODE=local usa joblib sulla macchina corrente.
+    """
+    mode = mode or COMPUTE_MODE
+    if mode == "local":
+        compute_patterns_parallel()
+        return None
+    res = compute_patterns_distributed()
+    return res.id if res is not None else None
+
 if __name__ == '__main__':
-    compute_patterns_parallel()
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Calcolo pattern")
+    ap.add_argument('--mode', default="asset", choices=("asset", "asset_type", "pattern"))
+    ap.add_argument('--workers', type=int, default=NUM_WORKERS)
+    ap.add_argument('--resume', action='store_true', help="riprende l'ultimo run interrotto")
+    ap.add_argument('--retry', type=int, metavar='RUN_ID', help="ritenta gli shard falliti del run")
+    ap.add_argument('--shard', type=int, action='append', help="con --retry: solo questi shard")
+    ap.add_argument('--runs', action='store_true', help="elenca gli ultimi run")
+    args = ap.parse_args()
+
+    if args.runs:
+        session = SessionLocal()
+        try:
+            for row in run_summary(session):
+                print(row)
+        finally:
+            session.close()
+    elif args.retry:
+        retry_failed(args.retry, args.shard, args.workers)
+    else:
+        compute_patterns_parallel(args.workers, mode=args.mode, resume=args.resume)
@@ -1,46 +1,41 @@
 #!/usr/bin/env python3
-from backend.data_fetch.download_all_mt5 import (
-    init_mt5,
-    shutdown_mt5,
-    discover_symbols_by_group,
-    TIMEFRAMES,
-    TIMEFRAME_MAP,
-    OUTPUT_ROOT,
-    fetch_and_save,
-    update_csv,
-)
+from celery import shared_task, chain, signature
 
+from backend.services.history_parquet import compact_all
+from backend.data_fetch.download_all_mt5 import OUTPUT_ROOT, fetch_all
+
+@shared_task(name="backend.jobs.fetch_historical.fetch_and_save_task")
 def fetch_and_save_task():
     """
-    Job on-demand / Celery: aggiorna incrementale dei file Parquet
-    per ciascun gruppo e li salva in OUTPUT_ROOT.
+    Job on-demand / Celery: aggiornamento incrementale dello storico per
+    ciascun gruppo, simboli × timeframe in parallelo (vedi
+    data_fetch/scheduler.py). Sorgente da env BAR_SOURCE (default MT5).
+    """
+    summary = fetch_all()
+    return {k: v for k, v in summary.items() if k != 'errors'}
+
+@shared_task(name="backend.jobs.fetch_historical.fetch_and_refresh_task")
+def fetch_and_refresh_task():
+    """
+    Job notturno: fetch dello storico e, solo a fetch concluso, ricalcolo
+    incrementale dei pattern (chain: se il fetch fallisce il ricalcolo non
+    parte). Il ricalcolo salta da sé se un run completo è in corso.
     """
-    # 1) inizializza MT5
-    init_mt5()
-    try:
-        # 2) scopri simboli
-        symbols_by_group = discover_symbols_by_group()
-        if not any(symbols_by_group.values()):
-            print("❌ Nessun asset trovato – controlla config/groups")
-            return
+    return chain(
+        fetch_and_save_task.si().set(queue='fetchers'),
+        signature("backend.jobs.compute_patterns.compute_patterns_incremental_task",
+                  immutable=True, queue='computations'),
+    ).apply_async()
 
-        # 3) cicla gruppi, simboli e timeframe
-        for group, symbols in symbols_by_group.items():
-            if not symbols:
-                continue
-            print(f"\n📁 Gruppo '{group}' – {len(symbols)} simboli")
-            for symbol in symbols:
-                out_dir = OUTPUT_ROOT / group / symbol
-                for tf_str in TIMEFRAMES:
-                    tf_const = TIMEFRAME_MAP.get(tf_str)
-                    if not tf_const:
-                        print(f"   ⚠️ Timeframe non supportato: {tf_str}")
-                        continue
-                    # 4) usa update_csv (scrive Parquet) invece di fetch_and_save
-                    update_csv(symbol, tf_str, tf_const, out_dir)
-    finally:
-        # 5) chiude MT5
-        shutdown_mt5()
+@shared_task(name="backend.jobs.fetch_historical.compact_history_task")
+def compact_history_task(min_deltas: int = 1):
+    """
+    Job periodico: fonde i segmenti delta scritti da `update_csv` nelle
+    partizioni annuali dello storico.
+    """
+    n = compact_all(OUTPUT_ROOT, min_deltas)
+    print(f"🗜 Compattazione storico: {n} anni")
+    return n
 
 # Permette esecuzione diretta:
 # python -c "from backend.jobs.fetch_historical import fetch_and_save_task; fetch_and_save_task()"
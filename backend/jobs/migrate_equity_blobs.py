@@ -0,0 +1,102 @@
+# backend/jobs/migrate_equity_blobs.py
+"""
+Migrazione da `equity_series` (una riga per punto) a `equity_blobs`
+(una riga compressa per pattern).
+
+  1. crea la tabella `equity_blobs` se manca;
+  2. per i pattern con righe in `equity_series` e senza blob, legge i punti a
+     blocchi di pattern, li codifica e inserisce i blob (BulkWriter);
+  3. con `--drop-rows` cancella le righe migrate da `equity_series`.
+
+Ogni blocco è una transazione: il job può essere interrotto e rilanciato.
+
+    python -m backend.jobs.migrate_equity_blobs [--drop-rows] [--float32]
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from backend.db.session import SessionLocal
+from backend.db.models import EquitySeries, EquityBlob
+from backend.services.bulk_writer import BulkWriter
+from backend.services.equity_codec import encode_equity
+from backend.services.pattern_store import _chunks
+
+PATTERNS_PER_BATCH = 2000
+
+
+def _pending_pattern_ids(session) -> list[int]:
+    migrated = session.query(EquityBlob.pattern_id)
+    return [
+        pid for (pid,) in session.query(EquitySeries.pattern_id)
+                                 .filter(~EquitySeries.pattern_id.in_(migrated))
+                                 .distinct()
+                                 .order_by(EquitySeries.pattern_id)
+    ]
+
+
+def _encode_batch(session, ids, value_dtype) -> list[dict]:
+    rows = []
+    for chunk in _chunks(ids):
+        rows.extend(
+            session.query(EquitySeries.pattern_id, EquitySeries.timestamp, EquitySeries.equity_value)
+                   .filter(EquitySeries.pattern_id.in_(chunk))
+                   .order_by(EquitySeries.pattern_id, EquitySeries.timestamp)
+        )
+    if not rows:
+        return []
+    pid  = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+    ts   = pd.DatetimeIndex([r[1] for r in rows]).as_unit('ns').asi8
+    vals = np.fromiter((r[2] for r in rows), dtype=np.float64, count=len(rows))
+
+    # confini dei pattern nell'array ordinato per pattern_id
+    cuts = np.flatnonzero(np.diff(pid)) + 1
+    out = []
+    for a, b in zip(np.r_[0, cuts], np.r_[cuts, len(pid)]):
+        out.append({
+            'pattern_id': int(pid[a]),
+            'n_points':   int(b - a),
+            'first_ts':   pd.Timestamp(ts[a]).to_pydatetime(),
+            'last_ts':    pd.Timestamp(ts[b - 1]).to_pydatetime(),
+            'data':       encode_equity(ts[a:b], vals[a:b], value_dtype),
+        })
+    return out
+
+
+def migrate_equity_blobs(drop_rows: bool = False, value_dtype: str = 'float64') -> int:
+    session = SessionLocal()
+    migrated = 0
+    try:
+        EquityBlob.__table__.create(session.get_bind(), checkfirst=True)
+        pending = _pending_pattern_ids(session)
+        print(f"→ {len(pending)} pattern da migrare")
+
+        writer = BulkWriter.for_session(session)
+        for i in range(0, len(pending), PATTERNS_PER_BATCH):
+            ids   = pending[i:i + PATTERNS_PER_BATCH]
+            blobs = _encode_batch(session, ids, value_dtype)
+            writer.insert(EquityBlob, blobs)
+            if drop_rows:
+                for chunk in _chunks(ids):
+                    session.query(EquitySeries) \
+                           .filter(EquitySeries.pattern_id.in_(chunk)) \
+                           .delete(synchronize_session=False)
+            session.commit()
+            migrated += len(blobs)
+            print(f"✔ {migrated}/{len(pending)} blob scritti")
+        return migrated
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Migra equity_series → equity_blobs")
+    ap.add_argument('--drop-rows', action='store_true', help="cancella le righe migrate da equity_series")
+    ap.add_argument('--float32', action='store_true', help="valori in float32 (metà spazio)")
+    args = ap.parse_args()
+    migrate_equity_blobs(args.drop_rows, 'float32' if args.float32 else 'float64')
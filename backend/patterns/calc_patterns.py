@@ -1,16 +1,21 @@
 #!/usr/bin/env python3
 import os
 import pandas as pd
-import numpy as np
 import traceback
 
 from datetime import timedelta
 from joblib import Parallel, delayed
 
 from backend.db.session import SessionLocal
-from backend.db.models import Asset, Pattern, Statistic, EquitySeries
-from backend.services.statistics import get_pattern_statistics
-from backend.services.backtest_engine import _drawdown_duration
+from backend.db.models import Asset
+from backend.services.statistics import (
+    batch_intraday_statistics, batch_monthly_statistics, batch_annual_statistics,
+)
+from backend.services.history_parquet import load_history
+from backend.services.history_store import load_history_arrays, prepare_history_store
+from backend.services.history_catalog import load_catalog, has_history
+from backend.services.pattern_store import upsert_patterns, PatternSink, safe_value
+from backend.services import compute_metrics as metrics
 
 # ── Config paths ───────────────────────────────────────────────────────────────
 ROOT_DIR     = os.path.abspath(os.path.join(os.path.dirname(__file__), '../..'))
@@ -40,96 +45,24 @@ for m in range(1,13):
 years_options = [5,10,15,20]
 
 # ── Helpers ────────────────────────────────────────────────────────────────────
-def load_symbol_history(group: str, symbol: str, tf_str: str = 'D1') -> pd.DataFrame:
+def load_symbol_history(group: str, symbol: str, tf_str: str = 'D1', start=None, end=None,
+                        columns=('open', 'high', 'low', 'close'), years_back=None) -> pd.DataFrame:
     """
-    Parquet-first / CSV-fallback; restituisce DataFrame con colonne
-    ['timestamp','open','high','low','close'].
+    Storico fra `start` e `end` (o gli ultimi `years_back` anni) con le sole
+    colonne richieste: DataFrame ['timestamp', *columns]. Dal layout per anno
+    legge solo partizioni, row group e colonne necessari; altrimenti
+    ripiega sul file unico parquet/CSV.
     """
-    symbol_dir = os.path.join(HISTORY_ROOT, group, symbol)
-    fname_base = f"{symbol}_{tf_str}"
-    pq_path = os.path.join(symbol_dir, f"{fname_base}.parquet")
-
-    if os.path.isfile(pq_path):
-        df = pd.read_parquet(pq_path)
-        if 'timestamp' not in df.columns and df.index.dtype.kind == 'M':
-            df = df.reset_index().rename(columns={'index':'timestamp'})
-    else:
-        csv_path = os.path.join(symbol_dir, f"{fname_base}.csv")
-        if not os.path.isfile(csv_path):
-            raise FileNotFoundError(f"History file non trovato: {csv_path}")
-        sample = pd.read_csv(csv_path, nrows=0)
-        date_col = 'timestamp' if 'timestamp' in sample.columns else 'time'
-        df = pd.read_csv(csv_path, parse_dates=[date_col])
-        if date_col == 'time':
-            df = df.rename(columns={'time':'timestamp'})
-
-    # ora ho certamente la colonna 'timestamp'
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
-    df = df.sort_values('timestamp')
-
-    # restituisco solo le colonne che servono
-    return df[['timestamp','open','high','low','close']]
-
-
-def safe_value(val):
-    if isinstance(val, (np.generic,)):
-        return val.item()
-    if isinstance(val, pd.Timestamp):
-        return val.to_pydatetime()
-    if pd.isna(val):
-        return None
-    return val
+    return load_history(group, symbol, tf_str, start=start, end=end,
+                        columns=list(columns), years_back=years_back, root=HISTORY_ROOT)
+
 
 def convert_types_for_sqlalchemy(d: dict) -> dict:
     return {k: safe_value(v) for k,v in d.items()}
 
-# ── Core “make, but don’t commit” ───────────────────────────────────────────────
+# ── Core “make, but don’t commit” (upsert per pattern_key) ──────────────────────
 def save_pattern(session, asset, pattern_type, params, years_back, stats, equity_series):
-    pat = Pattern(
-        asset_id   = asset.id,
-        type       = pattern_type,
-        params     = params,
-        years_back = years_back,
-        source     = "precomputed"
-    )
-    session.add(pat)
-    session.flush()
-
-    # drawdowns
-    full_idx = pd.DatetimeIndex(sorted(pt["timestamp"] for pt in equity_series))
-    eq = pd.Series(
-        [pt["value"] for pt in sorted(equity_series, key=lambda x: x["timestamp"])],
-        index=full_idx
-    )
-    dd_realized = _drawdown_duration(eq)
-    dd_floating = dd_realized
-    from datetime import datetime
-    def _iso_dates(d: dict) -> dict:
-        return {k:(v.isoformat() if isinstance(v,(pd.Timestamp,datetime)) else v)
-                for k,v in d.items()}
-    stats["extra_json"] = {
-        "dd_realized":_iso_dates(dd_realized),
-        "dd_floating":_iso_dates(dd_floating),
-    }
-    stats.setdefault("recovery_days",0)
-
-    stat_kwargs = convert_types_for_sqlalchemy(stats)
-    from sqlalchemy.inspection import inspect
-    cols = {c.key for c in inspect(Statistic).mapper.column_attrs}
-    stat_kwargs = {k:v for k,v in stat_kwargs.items() if k in cols}
-    session.add(Statistic(pattern_id=pat.id, **stat_kwargs))
-
-    # EquitySeries objects (ritornati per bulk save)
-    eq_objs = []
-    for pt in equity_series:
-        if pt["value"] is None:
-            continue
-        eq_objs.append(EquitySeries(
-            pattern_id   = pat.id,
-            timestamp    = safe_value(pt['timestamp']),
-            equity_value = safe_value(pt['value'])
-        ))
-    return pat, eq_objs
+    return upsert_patterns(session, asset.id, pattern_type, [(params, years_back, stats, equity_series)])
 
 # ── Process singolo asset in batch ─────────────────────────────────────────────
 def process_asset(asset_id: int):
@@ -137,64 +70,66 @@ def process_asset(asset_id: int):
     session = SessionLocal()
     try:
         asset = session.get(Asset, asset_id)
-        try: df_int = load_symbol_history(asset.group, asset.symbol, 'H1')
-        except: df_int = None
-        try: df_dly = load_symbol_history(asset.group, asset.symbol, 'D1')
-        except: df_dly = None
-
-        for yb in years_options:
-            patterns, equities = [], []
-
-            if df_int is not None:
-                for p in intraday_defs:
-                    stats, eqv = get_pattern_statistics(df_int, 'intraday', p, yb)
-                    if not stats:
-                        print(f"⚠️ No stats for {asset.symbol}|intraday|yb={yb}|{p}")
-                    else:
-                        pat, eos = save_pattern(session, asset, 'intraday', p, yb, stats, eqv)
-                        patterns.append(pat); equities.extend(eos)
-
-            if df_dly is not None:
-                for p in monthly_defs:
-                    stats, eqv = get_pattern_statistics(df_dly, 'monthly', p, yb)
-                    if not stats:
-                        print(f"⚠️ No stats for {asset.symbol}|monthly|yb={yb}|{p}")
-                    else:
-                        pat, eos = save_pattern(session, asset, 'monthly', p, yb, stats, eqv)
-                        patterns.append(pat); equities.extend(eos)
-                for p in annual_defs:
-                    stats, eqv = get_pattern_statistics(df_dly, 'annual', p, yb)
-                    if not stats:
-                        print(f"⚠️ No stats for {asset.symbol}|annual|yb={yb}|{p}")
-                    else:
-                        pat, eos = save_pattern(session, asset, 'annual', p, yb, stats, eqv)
-                        patterns.append(pat); equities.extend(eos)
-
-            if patterns:
-                session.bulk_save_objects(patterns)
-                session.bulk_save_objects(equities)
-                session.commit()
-                print(f"✔ Commit Asset {asset_id} yb={yb} ({len(patterns)} patterns)")
-                patterns.clear(); equities.clear()
+        # storico memory-mapped (convertito una volta, condiviso fra i worker)
+        with metrics.labels("", asset.group):
+            with metrics.stage("load"):
+                try: df_int = load_history_arrays(asset.group, asset.symbol, 'H1')
+                except Exception: df_int = None
+                try: df_dly = load_history_arrays(asset.group, asset.symbol, 'D1')
+                except Exception: df_dly = None
+
+        # un tipo e un lookback alla volta: risultati del motore scritti in
+        # streaming (flush a soglia) e rilasciati prima dei successivi
+        engines = []
+        if df_int is not None:
+            engines.append(('intraday', batch_intraday_statistics, df_int, intraday_defs))
+        if df_dly is not None:
+            engines.append(('monthly', batch_monthly_statistics, df_dly, monthly_defs))
+            engines.append(('annual',  batch_annual_statistics,  df_dly, annual_defs))
+
+        with metrics.labels("", asset.group):
+            for ptype, engine, hist, defs in engines:
+                with PatternSink(session, asset.id) as sink, metrics.labels(ptype):
+                    # un lookback alla volta, scritto prima del successivo
+                    for yb, res in metrics.timed("extract", engine(hist, defs, years_options)):
+                        metrics.patterns_computed(len(res))
+                        for p, stats, eqv in res:
+                            if not stats:
+                                print(f"⚠️ No stats for {asset.symbol}|{ptype}|yb={yb}|{p}")
+                            else:
+                                sink.add(ptype, p, yb, stats, eqv)
+                        del res
+                t = sink.totals
+                print(f"✔ Commit Asset {asset_id} {ptype} "
+                      f"({t['inserted'] + t['updated']} patterns, {t['skipped']} invariati)")
+                metrics.sample_memory()
 
     except Exception:
         print(f"❌ [Asset {asset_id}] ERRORE:\n{traceback.format_exc()}")
     finally:
         session.close()
+        metrics.export()
 
 # ── Parallel compute with chunking ─────────────────────────────────────────────
 def compute_patterns_parallel(num_workers: int = 14):
     session = SessionLocal()
     try:
         #asset_ids = [a.id for a in session.query(Asset.id).all()] <--- RIPRISTINARE PER IL CALCOLO DI TUTTI GLI ASSETS
-        asset_ids = [
-            a.id
-            for a in session.query(Asset.id)
-                             .filter(Asset.group.in_(["Cryptocurrencies", "Forex"]))
-                             .all()
-        ]
+        assets = (
+            session.query(Asset.id, Asset.group, Asset.symbol)
+                   .filter(Asset.group.in_(["Cryptocurrencies", "Forex"]))
+                   .all()
+        )
     finally:
         session.close()
+    asset_ids = [a.id for a in assets]
+
+    # conversione nello store memory-mapped una volta sola, prima dei worker
+    catalog = load_catalog()
+    prepare_history_store(
+        (a.group, a.symbol, tf) for a in assets for tf in ('H1', 'D1')
+        if has_history(catalog, a.group, a.symbol, tf)
+    )
 
     total = len(asset_ids)
     chunk = (total + num_workers - 1)//num_workers
@@ -1,6 +1,9 @@
 from flask import Blueprint, jsonify
 from sqlalchemy.orm import sessionmaker
-from backend.db.models import EquityPoint
+import pandas as pd
+
+from backend.db.models import EquityBlob, EquitySeries
+from backend.services.equity_codec import decode_equity
 
 pattern_returns_bp = Blueprint('pattern_returns', __name__, url_prefix='/api/pattern_returns')
 
@@ -12,16 +15,27 @@ def pattern_returns(pattern_id):
     Session = sessionmaker(bind=get_engine())
     session = Session()
 
-    points = (
-        session.query(EquityPoint)
-               .filter_by(pattern_id=pattern_id)
-               .order_by(EquityPoint.timestamp)
-               .all()
-    )
-    equity = [
-        {'timestamp': p.timestamp.isoformat(), 'value': p.equity_value}
-        for p in points
-    ]
+    # una sola riga: curva compressa (equity_blobs)
+    blob = session.get(EquityBlob, pattern_id)
+    if blob is not None:
+        ts, vals = decode_equity(blob.data)
+        stamps = pd.to_datetime(ts, unit='ns')
+        equity = [
+            {'timestamp': t.isoformat(), 'value': float(v)}
+            for t, v in zip(stamps, vals)
+        ]
+    else:
+        # pattern non ancora migrati: righe legacy di equity_series
+        points = (
+            session.query(EquitySeries)
+                   .filter_by(pattern_id=pattern_id)
+                   .order_by(EquitySeries.timestamp)
+                   .all()
+        )
+        equity = [
+            {'timestamp': p.timestamp.isoformat(), 'value': p.equity_value}
+            for p in points
+        ]
 
     session.close()
     return jsonify({
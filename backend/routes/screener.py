@@ -1,14 +1,11 @@
 from flask import Blueprint, request, jsonify
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import cast, String, and_, extract, Integer
+from sqlalchemy import cast, false, Integer
 from backend.services.cache import get_cache, set_cache
-from backend.db.models import Asset, Pattern, Statistic, EquitySeries
+from backend.db.models import Asset, Pattern, ScreenerRow
+from backend.services.screener_view import PARAM_COLUMNS, fallback_drawdowns
 from backend.db.session import SessionLocal
 
-
-import pandas as pd
-from ..services.backtest_engine import _drawdown_duration
-
 screener_bp = Blueprint('screener', __name__, url_prefix='/api/screener')
 
 def make_cache_key(args: dict) -> str:
@@ -20,6 +17,15 @@ def make_cache_key(args: dict) -> str:
         parts.append(f"{k}={v}")
     return "screener:" + "|".join(parts)
 
+def _param_filter(k: str, v: str):
+    """Filtro su un param: colonna intera di screener_rows se c'è, altrimenti sul JSON."""
+    if k in PARAM_COLUMNS:
+        try:
+            return getattr(ScreenerRow, k) == int(v)
+        except ValueError:
+            return false()
+    return ScreenerRow.params[k].as_string() == str(v)
+
 @screener_bp.route('', methods=['GET'])
 def screener():
     from backend.app import get_engine
@@ -45,42 +51,42 @@ def screener():
     exclude = {'patternType','yearsBack','assetGroups','symbols','group','asset','sortBy','sortOrder','limit','page'}
     time_params = {k: request.args.get(k) for k in request.args if k not in exclude}
 
-    # 4) Base query
-    q = session.query(Pattern, Asset, Statistic) \
-        .join(Asset,   Pattern.asset_id   == Asset.id) \
-        .join(Statistic, Statistic.pattern_id == Pattern.id)
+    # 4) Base query: read model denormalizzato (services/screener_view), nessun join
+    q = session.query(ScreenerRow)
 
     if pattern_type:
-        q = q.filter(Pattern.type == pattern_type)
+        q = q.filter(ScreenerRow.pattern_type == pattern_type)
     if years_back:
-        q = q.filter(Pattern.years_back.in_(years_back))
+        q = q.filter(ScreenerRow.years_back.in_(years_back))
     if asset_groups:
-        q = q.filter(Asset.group.in_(asset_groups))
+        q = q.filter(ScreenerRow.asset_group.in_(asset_groups))
     if symbols:
-        q = q.filter(Asset.symbol.in_(symbols))
+        q = q.filter(ScreenerRow.asset_symbol.in_(symbols))
     for k, v in time_params.items():
         if v is not None:
-            q = q.filter(cast(Pattern.params[k], String) == str(v))
+            q = q.filter(_param_filter(k, v))
 
-    # 5) Sorting only on pure-SQL columns
+    # 5) Sorting (colonne indicizzate di screener_rows)
     sortables = {
-        'grossProfitPct': Statistic.gross_profit_pct,
-        'grossLossPct':   Statistic.gross_loss_pct,
-        'netReturnPct':   Statistic.net_return_pct,
-        'winRate':        Statistic.win_rate,
-        'profitFactor':   Statistic.profit_factor,
-        'expectancy':     Statistic.expectancy,
-        'maxDrawdownPct': Statistic.max_drawdown_pct,
-        'sharpeRatio':    Statistic.sharpe_ratio,
-        'sortinoRatio':   Statistic.sortino_ratio,
-        'assetSymbol':    Asset.symbol,
-        'yearsBack':      Pattern.years_back,
+        'grossProfitPct': ScreenerRow.gross_profit_pct,
+        'grossLossPct':   ScreenerRow.gross_loss_pct,
+        'netReturnPct':   ScreenerRow.net_return_pct,
+        'winRate':        ScreenerRow.win_rate,
+        'profitFactor':   ScreenerRow.profit_factor,
+        'expectancy':     ScreenerRow.expectancy,
+        'maxDrawdownPct': ScreenerRow.max_drawdown_pct,
+        'sharpeRatio':    ScreenerRow.sharpe_ratio,
+        'sortinoRatio':   ScreenerRow.sortino_ratio,
+        'assetSymbol':    ScreenerRow.asset_symbol,
+        'yearsBack':      ScreenerRow.years_back,
+        'realizedMaxDrawdownPct': ScreenerRow.realized_max_drawdown_pct,
+        'floatingMaxDrawdownPct': ScreenerRow.floating_max_drawdown_pct,
     }
     if sort_by in sortables:
         col = sortables[sort_by]
-        q = q.order_by(col.asc() if sort_order=='asc' else col.desc())
+        q = q.order_by(col.asc() if sort_order=='asc' else col.desc(), ScreenerRow.pattern_id)
     elif sort_by:
-        print(f"[screener.py] ⚠️ cannot sort by JSON field `{sort_by}` via SQL, ignoring.")
+        print(f"[screener.py] ⚠️ cannot sort by `{sort_by}`, ignoring.")
 
     # 6) Pagination
     try:
@@ -94,46 +100,44 @@ def screener():
     q = q.limit(limit).offset(offset)
 
     # 7) Build output array
+    rows = q.all()
+    # drawdown non ancora persistito (vedi jobs/backfill_drawdowns): una lettura per pagina
+    fallback = fallback_drawdowns(
+        session, [r.pattern_id for r in rows if r.realized_max_drawdown_pct is None]
+    )
+
     out = []
-    for pattern, asset, stat in q.all():
-        ej = stat.extra_json or {}
-        dr = ej.get("dd_realized") or {}
-        df = ej.get("dd_floating") or {}
-
-        # Fallback: if no realized‐drawdown in JSON, recompute from stored EquitySeries
-        if dr.get("max_drawdown_pct") is None:
-            rows = (
-                session.query(EquitySeries)
-                       .filter_by(pattern_id=pattern.id)
-                       .order_by(EquitySeries.timestamp)
-                       .all()
-            )
-            if rows:
-                ser = pd.Series(
-                    { r.timestamp: r.equity_value for r in rows }
-                ).sort_index()
-                dr = _drawdown_duration(ser)
+    for row in rows:
+        dr = fallback.get(row.pattern_id) or {
+            "max_drawdown_pct": row.realized_max_drawdown_pct,
+            "dd_duration_days": row.realized_dd_duration_days,
+        }
+        # floating mancante: stessa curva del realizzato (come in pattern_store.statistic_rows)
+        df = dr if row.floating_max_drawdown_pct is None else {
+            "max_drawdown_pct": row.floating_max_drawdown_pct,
+            "dd_duration_days": row.floating_dd_duration_days,
+        }
 
         out.append({
-            'id':           pattern.id,
-            'assetSymbol':  asset.symbol,
-            'patternType':  pattern.type,
-            'params':       pattern.params,
-            'yearsBack':    pattern.years_back,
+            'id':           row.pattern_id,
+            'assetSymbol':  row.asset_symbol,
+            'patternType':  row.pattern_type,
+            'params':       row.params,
+            'yearsBack':    row.years_back,
             'stats': {
-                'grossProfitPct':        stat.gross_profit_pct,
-                'grossLossPct':          stat.gross_loss_pct,
-                'netReturnPct':          stat.net_return_pct,
-                'winRate':               stat.win_rate,
-                'profitFactor':          stat.profit_factor,
-                'expectancy':            stat.expectancy,
-                'maxDrawdownPct':        stat.max_drawdown_pct,
-                'sharpeRatio':           stat.sharpe_ratio,
-                'sortinoRatio':          stat.sortino_ratio,
-                # realized drawdown (from JSON or fallback):
+                'grossProfitPct':        row.gross_profit_pct,
+                'grossLossPct':          row.gross_loss_pct,
+                'netReturnPct':          row.net_return_pct,
+                'winRate':               row.win_rate,
+                'profitFactor':          row.profit_factor,
+                'expectancy':            row.expectancy,
+                'maxDrawdownPct':        row.max_drawdown_pct,
+                'sharpeRatio':           row.sharpe_ratio,
+                'sortinoRatio':          row.sortino_ratio,
+                # realized drawdown (stored or fallback):
                 'realizedMaxDrawdownPct': dr.get("max_drawdown_pct"),
                 'realizedDdDurationDays': dr.get("dd_duration_days"),
-                # floating drawdown (only if JSON present):
+                # floating drawdown (stored or fallback):
                 'floatingMaxDrawdownPct':  df.get("max_drawdown_pct"),
                 'floatingDdDurationDays':  df.get("dd_duration_days"),
             }
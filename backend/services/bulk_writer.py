@@ -0,0 +1,119 @@
+# backend/services/bulk_writer.py
+from __future__ import annotations
+
+"""
+Scrittura massiva di Pattern / Statistic / equity.
+
+Su PostgreSQL:
+  • gli id dei Pattern sono pre-allocati dalla sequence a blocchi
+    (`nextval` su `generate_series`), quindi niente flush per pattern;
+  • le righe vengono inviate con `COPY ... FROM STDIN (FORMAT csv)` sulla
+    stessa connessione (e transazione) della sessione.
+
+Su SQLite (`init_db.py`) ricade su `executemany`; gli id dei nuovi Pattern
+arrivano da un unico INSERT ... RETURNING.
+
+Il writer è legato alla sessione (`BulkWriter.for_session`) così il blocco
+di id avanzato resta disponibile al batch successivo. Non esegue commit.
+"""
+
+import csv
+import io
+import json
+from datetime import date, datetime
+
+from sqlalchemy import insert, text
+
+# id pre-allocati per richiesta alla sequence
+ID_BLOCK = 1000
+# righe per singolo COPY / executemany
+COPY_CHUNK = 50_000
+
+
+def _csv_value(val):
+    if val is None:
+        return None
+    if isinstance(val, (bytes, bytearray, memoryview)):
+        return '\\x' + bytes(val).hex()          # bytea, formato hex
+    if isinstance(val, (dict, list)):
+        return json.dumps(val)
+    if isinstance(val, datetime):
+        return val.isoformat(sep=' ')
+    if isinstance(val, date):
+        return val.isoformat()
+    return val
+
+
+class BulkWriter:
+    def __init__(self, session):
+        self.session = session
+        self.use_copy = session.get_bind().dialect.name == 'postgresql'
+        self._ids: dict[str, list[int]] = {}
+
+    @classmethod
+    def for_session(cls, session) -> BulkWriter:
+        writer = session.info.get('bulk_writer')
+        if writer is None:
+            writer = session.info['bulk_writer'] = cls(session)
+        return writer
+
+    # ── Id ──────────────────────────────────────────────────────────────────
+    def allocate_ids(self, table, n: int) -> list[int]:
+        """`n` id dalla sequence di `table.id`, richiesti a blocchi di ID_BLOCK."""
+        pool = self._ids.setdefault(table.name, [])
+        if len(pool) < n:
+            rows = self.session.execute(
+                text("SELECT nextval(pg_get_serial_sequence(:t, 'id')) FROM generate_series(1, :n)"),
+                {'t': table.name, 'n': max(n - len(pool), ID_BLOCK)},
+            )
+            pool.extend(r[0] for r in rows)
+        ids, self._ids[table.name] = pool[:n], pool[n:]
+        return ids
+
+    def insert_with_ids(self, model, rows: list[dict]) -> list[int]:
+        """Inserisce `rows` e ritorna gli id nello stesso ordine."""
+        if not rows:
+            return []
+        table = model.__table__
+        if self.use_copy:
+            ids = self.allocate_ids(table, len(rows))
+            self.insert(model, [{'id': i, **r} for i, r in zip(ids, rows)])
+            return ids
+        res = self.session.execute(
+            insert(table).returning(table.c.id, sort_by_parameter_order=True),
+            self._normalize(table, rows),
+        )
+        return [r[0] for r in res]
+
+    # ── Righe ───────────────────────────────────────────────────────────────
+    def insert(self, model, rows: list[dict]):
+        """COPY su PostgreSQL, executemany altrove."""
+        if not rows:
+            return
+        table = model.__table__
+        for i in range(0, len(rows), COPY_CHUNK):
+            chunk = self._normalize(table, rows[i:i + COPY_CHUNK])
+            if self.use_copy:
+                self._copy(table, chunk)
+            else:
+                self.session.execute(insert(table), chunk)
+
+    @staticmethod
+    def _normalize(table, rows: list[dict]) -> list[dict]:
+        # stesso insieme di colonne per ogni riga (executemany / COPY)
+        keys = set().union(*rows)
+        cols = [c.key for c in table.columns if c.key in keys]
+        return [{c: r.get(c) for c in cols} for r in rows]
+
+    def _copy(self, table, rows: list[dict]):
+        cols = list(rows[0])
+        buf  = io.StringIO()
+        out  = csv.writer(buf)
+        for r in rows:
+            out.writerow([_csv_value(r[c]) for c in cols])
+        buf.seek(0)
+
+        names = ', '.join(f'"{c}"' for c in cols)
+        raw = self.session.connection().connection
+        with raw.cursor() as cur:
+            cur.copy_expert(f"COPY {table.name} ({names}) FROM STDIN WITH (FORMAT csv)", buf)
@@ -0,0 +1,266 @@
+# backend/services/compute_metrics.py
+from __future__ import annotations
+
+"""
+Metriche Prometheus della pipeline di calcolo pattern.
+
+    seasonality_compute_stage_seconds{stage, pattern_type, group}     histogram
+    seasonality_patterns_computed_total{pattern_type, group}          counter
+    seasonality_patterns_written_total{pattern_type, group, outcome}  counter
+    seasonality_patterns_per_second{pattern_type, group}              gauge (ultimo shard)
+    seasonality_worker_rss_bytes / _peak_rss_bytes{worker}            gauge
+
+Stage: load, extract, metrics, equity, drawdown, flush, commit. Il tempo di
+uno stage è *esclusivo*: `extract` (motore batch) non include i `metrics` e
+`equity` annidati al suo interno, così la somma degli stage è il tempo totale.
+
+I worker sono processi separati (joblib / Celery): ognuno ha il proprio
+registry e lo esporta con `export()` a fine shard verso
+  • Pushgateway, se PROMETHEUS_PUSHGATEWAY è impostato (es. localhost:9091);
+  • node_exporter textfile collector, se PROMETHEUS_TEXTFILE_DIR è impostato.
+Gruppo Pushgateway, file .prom ed etichetta `worker` usano un nome stabile
+(`worker_name()`: PROMETHEUS_INSTANCE o hostname, più lo slot del processo
+nel pool), non il pid: un worker riavviato sovrascrive la propria serie
+invece di aggiungerne una. Gruppo e file restano dopo l'uscita del processo,
+così le metriche di fine run arrivano allo scrape successivo; con
+PROMETHEUS_CLEANUP_ON_EXIT=1 `shutdown()` (atexit e `worker_process_shutdown`
+di Celery) li cancella all'uscita.
+Senza `prometheus_client` tutte le funzioni sono no-op.
+"""
+
+import atexit
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:                     # Windows: niente getrusage
+    resource = None
+
+try:
+    from prometheus_client import (
+        CollectorRegistry, Counter, Gauge, Histogram,
+        push_to_gateway, delete_from_gateway, write_to_textfile,
+    )
+except ImportError:                     # metriche disattivate
+    CollectorRegistry = None
+
+PUSHGATEWAY  = os.getenv("PROMETHEUS_PUSHGATEWAY")
+TEXTFILE_DIR = os.getenv("PROMETHEUS_TEXTFILE_DIR")
+JOB_NAME     = os.getenv("PROMETHEUS_JOB", "seasonality_compute")
+INSTANCE     = os.getenv("PROMETHEUS_INSTANCE")
+CLEANUP_ON_EXIT = os.getenv("PROMETHEUS_CLEANUP_ON_EXIT", "0") == "1"
+
+STAGE_BUCKETS = (.001, .005, .01, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_local = threading.local()
+
+if CollectorRegistry is not None:
+    REGISTRY = CollectorRegistry()
+    STAGE_SECONDS = Histogram(
+        "seasonality_compute_stage_seconds", "Tempo esclusivo per stage della pipeline",
+        ("stage", "pattern_type", "group"), buckets=STAGE_BUCKETS, registry=REGISTRY,
+    )
+    PATTERNS_COMPUTED = Counter(
+        "seasonality_patterns_computed_total", "Pattern calcolati dai motori",
+        ("pattern_type", "group"), registry=REGISTRY,
+    )
+    PATTERNS_WRITTEN = Counter(
+        "seasonality_patterns_written_total", "Esito dell'upsert dei pattern",
+        ("pattern_type", "group", "outcome"), registry=REGISTRY,
+    )
+    PATTERNS_PER_SECOND = Gauge(
+        "seasonality_patterns_per_second", "Throughput dell'ultimo shard (pattern/s)",
+        ("pattern_type", "group"), registry=REGISTRY,
+    )
+    WORKER_RSS = Gauge(
+        "seasonality_worker_rss_bytes", "Memoria residente del worker",
+        ("worker",), registry=REGISTRY,
+    )
+    WORKER_PEAK_RSS = Gauge(
+        "seasonality_worker_peak_rss_bytes", "Picco di memoria residente del worker",
+        ("worker",), registry=REGISTRY,
+    )
+else:
+    REGISTRY = None
+
+
+def enabled() -> bool:
+    return REGISTRY is not None
+
+
+# ── Etichette correnti (per thread) ────────────────────────────────────────────
+def _labels() -> dict:
+    return getattr(_local, "labels", {"pattern_type": "", "group": ""})
+
+
+@contextmanager
+def labels(pattern_type: str = "", group: str | None = None):
+    """Imposta pattern_type / group per gli stage annidati (es. in statistics)."""
+    prev = _labels()
+    _local.labels = {
+        "pattern_type": pattern_type,
+        "group":        prev["group"] if group is None else group,
+    }
+    try:
+        yield
+    finally:
+        _local.labels = prev
+
+
+# ── Stage ──────────────────────────────────────────────────────────────────────
+@contextmanager
+def stage(name: str):
+    """Cronometra uno stage; il tempo degli stage annidati viene sottratto."""
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    stack.append(0.0)
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - t0
+        nested  = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        if REGISTRY is not None:
+            STAGE_SECONDS.labels(stage=name, **_labels()).observe(max(elapsed - nested, 0.0))
+
+
+def timed(name: str, iterable):
+    """Itera `iterable` cronometrando come stage `name` solo la produzione di ogni elemento."""
+    it = iter(iterable)
+    while True:
+        with stage(name):
+            item = next(it, _END)
+        if item is _END:
+            return
+        yield item
+
+
+_END = object()
+
+
+def patterns_computed(n: int):
+    if REGISTRY is not None and n:
+        PATTERNS_COMPUTED.labels(**_labels()).inc(n)
+
+
+def patterns_written(result: dict):
+    """`result` come ritornato da `upsert_patterns`."""
+    if REGISTRY is not None:
+        for outcome, n in result.items():
+            if n:
+                PATTERNS_WRITTEN.labels(outcome=outcome, **_labels()).inc(n)
+
+
+def throughput(n: int, seconds: float):
+    if REGISTRY is not None and seconds > 0:
+        PATTERNS_PER_SECOND.labels(**_labels()).set(n / seconds)
+
+
+# ── Nome del worker ────────────────────────────────────────────────────────────
+def _pool_slot() -> str | None:
+    """Slot del processo nel pool: indice del figlio Celery prefork o nome del worker loky/multiprocessing."""
+    try:
+        from celery.utils.log import current_process_index
+        index = current_process_index()
+    except ImportError:
+        index = None
+    if index is not None:
+        return str(index)
+    proc = multiprocessing.current_process()
+    return None if proc.name == "MainProcess" else proc.name
+
+
+def worker_name() -> str:
+    """Nome stabile del processo: PROMETHEUS_INSTANCE (o hostname) e slot nel pool."""
+    slot = _pool_slot()
+    base = INSTANCE or socket.gethostname()
+    return f"{base}-{slot}" if slot else base
+
+
+# ── Memoria ────────────────────────────────────────────────────────────────────
+_peak_seen = 0
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return 0
+
+
+def _peak_rss_bytes(rss: int) -> int:
+    global _peak_seen
+    _peak_seen = max(_peak_seen, rss)
+    if resource is None:
+        return _peak_seen                                   # solo i campioni visti
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak = peak if sys.platform == "darwin" else peak * 1024   # Linux: KiB
+    return max(peak, _peak_seen)
+
+
+def sample_memory():
+    if REGISTRY is None:
+        return
+    rss    = _rss_bytes()
+    worker = worker_name()
+    WORKER_RSS.labels(worker=worker).set(rss)
+    WORKER_PEAK_RSS.labels(worker=worker).set(_peak_rss_bytes(rss))
+
+
+# ── Export ─────────────────────────────────────────────────────────────────────
+_exported = None        # nome del worker dell'ultimo export (gruppo Pushgateway e file .prom)
+
+
+def _textfile(worker: str) -> str:
+    return os.path.join(TEXTFILE_DIR, f"{JOB_NAME}_{worker}.prom")
+
+
+def export():
+    """Pubblica il registry del processo (Pushgateway e/o textfile). Non solleva."""
+    global _exported
+    if REGISTRY is None or not (PUSHGATEWAY or TEXTFILE_DIR):
+        return
+    sample_memory()
+    worker = worker_name()
+    if _exported is None and CLEANUP_ON_EXIT:
+        atexit.register(shutdown)
+    _exported = worker
+    try:
+        if PUSHGATEWAY:
+            push_to_gateway(PUSHGATEWAY, job=JOB_NAME,
+                            grouping_key={"instance": worker}, registry=REGISTRY)
+        if TEXTFILE_DIR:
+            os.makedirs(TEXTFILE_DIR, exist_ok=True)
+            write_to_textfile(_textfile(worker), REGISTRY)
+    except Exception as e:
+        print(f"⚠️ [Metrics] export fallito: {e}")
+
+
+def shutdown(**_):
+    """
+    Con PROMETHEUS_CLEANUP_ON_EXIT=1 rimuove il gruppo Pushgateway e il file
+    .prom del processo, se esportati. Non solleva.
+    """
+    global _exported
+    if not CLEANUP_ON_EXIT:
+        return
+    worker, _exported = _exported, None
+    if worker is None:
+        return
+    try:
+        if PUSHGATEWAY:
+            delete_from_gateway(PUSHGATEWAY, job=JOB_NAME, grouping_key={"instance": worker})
+        if TEXTFILE_DIR and os.path.exists(_textfile(worker)):
+            os.remove(_textfile(worker))
+    except Exception as e:
+        print(f"⚠️ [Metrics] pulizia fallita: {e}")
@@ -0,0 +1,135 @@
+# backend/services/equity_codec.py
+from __future__ import annotations
+
+"""
+Formato binario compatto per le curve di equity dei pattern (`EquityBlob`).
+
+Una curva = un blob:
+
+    header  '<4sBBBxIq'  magic, unità, dtype delta, dtype valori, n punti, base
+    payload zlib( delta[n] | valori[n] )
+
+I timestamp sono salvati come offset interi dalla base, nell'unità più
+grossolana che li rappresenta senza perdita (giorno per le curve D1,
+secondo per quelle intraday), e delta-codificati con il dtype intero più
+piccolo che li contiene. I valori sono float64 (o float32 a richiesta).
+Encode e decode sono interamente vettoriali (`np.diff` / `np.cumsum`).
+
+In memoria i motori batch restituiscono `EquityCurve`: due array (timestamp
+ns, valori) con l'interfaccia della lista [{'timestamp','value'}] usata dal
+resto del codice, ma 16 byte per punto invece di un dict per punto.
+"""
+
+import struct
+import zlib
+from collections.abc import Sequence
+
+import numpy as np
+import pandas as pd
+
+MAGIC  = b'EQB1'
+HEADER = struct.Struct('<4sBBBxIq')
+
+_UNITS       = (86_400_000_000_000, 1_000_000_000, 1)        # giorno, secondo, ns
+_DELTA_TYPES = (np.dtype('<u1'), np.dtype('<u2'), np.dtype('<u4'), np.dtype('<i8'))
+_VALUE_TYPES = (np.dtype('<f8'), np.dtype('<f4'))
+
+
+class EquityCurve(Sequence):
+    """Curva di equity compatta, indicizzabile come lista di {'timestamp','value'}."""
+    __slots__ = ('ts_ns', 'values')
+
+    def __init__(self, ts_ns: np.ndarray, values: np.ndarray):
+        self.ts_ns  = ts_ns
+        self.values = values
+
+    def __len__(self) -> int:
+        return len(self.ts_ns)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return EquityCurve(self.ts_ns[i], self.values[i])
+        return {"timestamp": pd.Timestamp(int(self.ts_ns[i])), "value": float(self.values[i])}
+
+    def __iter__(self):
+        for ts, v in zip(pd.to_datetime(self.ts_ns, unit='ns'), self.values.tolist()):
+            yield {"timestamp": ts, "value": v}
+
+    def __repr__(self) -> str:
+        return f"EquityCurve({len(self)} punti)"
+
+
+def curve_arrays(equity_series, drop_none: bool = True) -> tuple[np.ndarray, np.ndarray]:
+    """
+    (timestamp int64 ns, valori float64) da `EquityCurve` o lista di dict.
+    I punti con valore None sono scartati, o resi NaN con drop_none=False.
+    """
+    if isinstance(equity_series, EquityCurve):
+        return equity_series.ts_ns, equity_series.values
+    pts = [pt for pt in equity_series if pt["value"] is not None] if drop_none else list(equity_series)
+    ts  = pd.DatetimeIndex([pt["timestamp"] for pt in pts]).as_unit('ns').asi8
+    return ts, np.fromiter((np.nan if pt["value"] is None else pt["value"] for pt in pts),
+                           dtype=np.float64, count=len(pts))
+
+
+def encode_equity(timestamps, values, value_dtype='float64', level: int = 6) -> bytes:
+    """
+    timestamps: datetime-like o int64 epoch ns (ordinati), values: float.
+    Ritorna il blob compresso.
+    """
+    ts = np.asarray(timestamps)
+    if ts.dtype != np.int64:
+        ts = pd.DatetimeIndex(ts).as_unit('ns').asi8
+    vals = np.asarray(values, dtype=np.float64)
+    if len(ts) != len(vals):
+        raise ValueError("timestamps e values hanno lunghezze diverse")
+
+    unit_code = next(i for i, u in enumerate(_UNITS) if not (ts % u).any())
+    ticks = ts // _UNITS[unit_code]
+    base  = int(ticks[0]) if len(ticks) else 0
+    delta = np.diff(ticks, prepend=base)
+
+    lo, hi = (int(delta.min()), int(delta.max())) if len(delta) else (0, 0)
+    delta_code = next(
+        i for i, dt in enumerate(_DELTA_TYPES)
+        if dt.kind == 'i' or (lo >= 0 and hi <= np.iinfo(dt).max)
+    )
+    value_code = _VALUE_TYPES.index(np.dtype(value_dtype).newbyteorder('<'))
+
+    header  = HEADER.pack(MAGIC, unit_code, delta_code, value_code, len(ts), base)
+    payload = delta.astype(_DELTA_TYPES[delta_code]).tobytes() \
+            + vals.astype(_VALUE_TYPES[value_code]).tobytes()
+    return header + zlib.compress(payload, level)
+
+
+def decode_equity(blob: bytes) -> tuple[np.ndarray, np.ndarray]:
+    """Blob → (timestamp int64 epoch ns, valori float64)."""
+    magic, unit_code, delta_code, value_code, n, base = HEADER.unpack_from(blob)
+    if magic != MAGIC:
+        raise ValueError("blob di equity non valido")
+    payload = zlib.decompress(memoryview(blob)[HEADER.size:])
+
+    dt_delta, dt_value = _DELTA_TYPES[delta_code], _VALUE_TYPES[value_code]
+    delta = np.frombuffer(payload, dtype=dt_delta, count=n)
+    vals  = np.frombuffer(payload, dtype=dt_value, count=n, offset=n * dt_delta.itemsize)
+
+    ts = (np.cumsum(delta, dtype=np.int64) + base) * _UNITS[unit_code]
+    return ts, vals.astype(np.float64)
+
+
+def decode_series(blob: bytes) -> pd.Series:
+    """Blob → pd.Series di equity indicizzata per timestamp."""
+    ts, vals = decode_equity(blob)
+    return pd.Series(vals, index=pd.to_datetime(ts, unit='ns'))
+
+
+def blob_row(pattern_id, equity_series, value_dtype='float64') -> dict:
+    """Riga `EquityBlob` da `EquityCurve` o lista [{'timestamp','value'}]."""
+    ts, vals = curve_arrays(equity_series)
+    return {
+        'pattern_id': pattern_id,
+        'n_points':   len(ts),
+        'first_ts':   pd.Timestamp(ts[0]).to_pydatetime() if len(ts) else None,
+        'last_ts':    pd.Timestamp(ts[-1]).to_pydatetime() if len(ts) else None,
+        'data':       encode_equity(ts, vals, value_dtype),
+    }
@@ -0,0 +1,223 @@
+# backend/services/history_catalog.py
+from __future__ import annotations
+
+"""
+Catalogo (manifest) degli storici in `mt5_history/`.
+
+Per ogni simbolo/timeframe registra path, numero di righe, primo/ultimo
+timestamp, dimensione, mtime e checksum del file (o della cartella per
+anno, vedi `history_parquet`: righe e timestamp dai metadati parquet). Viene aggiornato da
+`update_csv` / `fetch_and_save` a ogni scrittura, così pianificazione dei
+job, skip e ricalcoli incrementali leggono un solo JSON invece di aprire
+ogni parquet.
+
+    python -m backend.services.history_catalog     # ricostruisce da zero
+"""
+
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import fcntl
+except ImportError:                     # Windows (terminale MT5): lock di msvcrt
+    fcntl = None
+    import msvcrt
+
+import pandas as pd
+
+from backend.services.history_parquet import HISTORY_ROOT, segment_files, history_bounds
+from backend.services.history_resample import read_marker
+
+CATALOG_NAME = 'catalog.json'
+
+# thread dello stesso processo; fra processi (Celery prefork, CLI) il file lock
+_lock = threading.Lock()
+
+
+def catalog_key(group: str, symbol: str, tf_str: str) -> str:
+    return f"{group}/{symbol}/{tf_str}"
+
+
+def _catalog_path(root: str) -> str:
+    return os.path.join(root, CATALOG_NAME)
+
+
+def _checksum(path: str) -> str:
+    h = hashlib.sha256()
+    if os.path.isdir(path):
+        # cartella per anno: digest di nome/dimensione/mtime dei segmenti, così
+        # l'aggiornamento notturno non rilegge gli anni che non ha toccato
+        for fp in segment_files(path):
+            st = os.stat(fp)
+            h.update(f"{os.path.relpath(fp, path)}|{st.st_size}|{st.st_mtime_ns}\n".encode())
+        return h.hexdigest()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _describe_dir(path: str) -> dict:
+    first, last, rows = history_bounds(path)
+    stats  = [os.stat(fp) for fp in segment_files(path)]
+    marker = read_marker(path)
+    return {
+        'rows':         rows,
+        'first_ts':     first.isoformat() if first is not None else None,
+        'last_ts':      last.isoformat() if last is not None else None,
+        'size':         sum(st.st_size for st in stats),
+        'mtime_ns':     max((st.st_mtime_ns for st in stats), default=0),
+        # timeframe costruito localmente (es. D1 da H1), None se scaricato
+        'derived_from': marker['from'] if marker else None,
+    }
+
+
+def describe_file(path: str, df: pd.DataFrame | None = None, root: str = HISTORY_ROOT) -> dict:
+    """
+    Voce di catalogo per un file di storico o una cartella per anno. Se `df`
+    è già in memoria (appena scritto) evita di rileggere il file per righe e
+    timestamp; per le cartelle bastano i metadati.
+    """
+    if os.path.isdir(path):
+        info = _describe_dir(path)
+    else:
+        if df is None:
+            if path.endswith('.parquet'):
+                df = pd.read_parquet(path, columns=['timestamp'])
+            else:
+                df = pd.read_csv(path)
+                df = df.rename(columns={'time': 'timestamp'})
+        ts = pd.to_datetime(df['timestamp'])
+        st = os.stat(path)
+        info = {
+            'rows':     int(len(df)),
+            'first_ts': ts.min().isoformat() if len(ts) else None,
+            'last_ts':  ts.max().isoformat() if len(ts) else None,
+            'size':     st.st_size,
+            'mtime_ns': st.st_mtime_ns,
+        }
+    return {
+        'path':       os.path.relpath(path, root),
+        **info,
+        'sha256':     _checksum(path),
+        'updated_at': datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def load_catalog(root: str = HISTORY_ROOT) -> dict:
+    """{ "group/symbol/tf": voce } – dict vuoto se il catalogo non esiste."""
+    try:
+        with open(_catalog_path(root)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+@contextmanager
+def _catalog_lock(root: str):
+    """
+    Sezione critica di lettura + scrittura del catalogo, esclusiva fra thread
+    e fra processi: lock esclusivo su `catalog.json.lock` accanto al JSON.
+    """
+    os.makedirs(root, exist_ok=True)
+    with _lock, open(_catalog_path(root) + '.lock', 'a+') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:             # LK_LOCK rinuncia dopo ~10 s: si riprova
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _write_catalog(catalog: dict, root: str):
+    path = _catalog_path(root)
+    tmp  = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    with open(tmp, 'w') as f:
+        json.dump(catalog, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def refresh_entry(group: str, symbol: str, tf_str: str, path: str,
+                  df: pd.DataFrame | None = None, root: str = HISTORY_ROOT) -> dict:
+    """Aggiorna (o crea) la voce di `group/symbol/tf` dopo una scrittura."""
+    entry = describe_file(str(path), df=df, root=str(root))
+    with _catalog_lock(str(root)):
+        catalog = load_catalog(root)
+        catalog[catalog_key(group, symbol, tf_str)] = entry
+        _write_catalog(catalog, root)
+    return entry
+
+
+def get_entry(catalog: dict, group: str, symbol: str, tf_str: str) -> dict | None:
+    return catalog.get(catalog_key(group, symbol, tf_str))
+
+
+def has_history(catalog: dict, group: str, symbol: str, tf_str: str,
+                root: str = HISTORY_ROOT) -> bool:
+    """
+    True se lo storico esiste. Senza voce di catalogo (es. file copiati a
+    mano) ripiega su un semplice controllo di esistenza, senza aprirlo.
+    """
+    entry = get_entry(catalog, group, symbol, tf_str)
+    if entry is not None:
+        return entry['rows'] > 0
+    base = os.path.join(root, group, symbol, f"{symbol}_{tf_str}")
+    return bool(segment_files(base)) or os.path.isfile(base + '.parquet') or os.path.isfile(base + '.csv')
+
+
+def rebuild_catalog(root: str = HISTORY_ROOT) -> dict:
+    """
+    Scansiona `root/<group>/<symbol>/` (cartelle `<symbol>_<tf>/` per anno,
+    file `<symbol>_<tf>.parquet|csv` legacy) e riscrive il catalogo.
+    """
+    catalog = {}
+    for group in sorted(os.listdir(root)):
+        gdir = os.path.join(root, group)
+        if group.startswith('.') or not os.path.isdir(gdir):
+            continue
+        for symbol in sorted(os.listdir(gdir)):
+            sdir = os.path.join(gdir, symbol)
+            if not os.path.isdir(sdir):
+                continue
+            for fname in sorted(os.listdir(sdir)):
+                fp = os.path.join(sdir, fname)
+                stem, ext = os.path.splitext(fname)
+                if os.path.isdir(fp):
+                    # cartella per anno: ha la precedenza sui file unici
+                    if not fname.startswith(f"{symbol}_") or not segment_files(fp):
+                        continue
+                    tf_str, ext = fname[len(symbol) + 1:], ''
+                elif ext in ('.parquet', '.csv') and stem.startswith(f"{symbol}_"):
+                    tf_str = stem[len(symbol) + 1:]
+                else:
+                    continue
+                key = catalog_key(group, symbol, tf_str)
+                prev = catalog.get(key)
+                if prev is not None and (os.path.isdir(os.path.join(root, prev['path']))
+                                         or (ext == '.csv' and prev['path'].endswith('.parquet'))):
+                    continue
+                catalog[key] = describe_file(fp, root=root)
+    with _catalog_lock(str(root)):
+        _write_catalog(catalog, root)
+    return catalog
+
+
+if __name__ == '__main__':
+    cat = rebuild_catalog()
+    print(f"✅ Catalogo ricostruito: {len(cat)} storici in {_catalog_path(HISTORY_ROOT)}")
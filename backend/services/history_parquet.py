@@ -0,0 +1,449 @@
+# backend/services/history_parquet.py
+from __future__ import annotations
+
+"""
+Storico OHLC partizionato per anno in `mt5_history/`.
+
+    <group>/<symbol>/<symbol>_<tf>/
+        year=2005/part-0.parquet
+        year=2006/part-0.parquet
+        ...
+
+Ogni file contiene le barre di un anno solare, ordinate per timestamp e
+senza duplicati, in row group da ROW_GROUP_ROWS righe (con statistiche
+min/max). `read_history(start, end, columns)` non apre gli anni fuori
+dal range (cartelle `year=`) e dentro l'anno legge con pyarrow solo i row
+group e le colonne richiesti (predicate pushdown sul timestamp). Un pattern a 5 anni su H1 legge così
+un quarto dello storico a 20 anni.
+
+Gli aggiornamenti notturni non riscrivono nulla: `append_segment` aggiunge
+le sole barre nuove come segmento delta accanto alla partizione
+
+        year=2025/part-0.parquet
+        year=2025/delta-<epoch ns>-<pid>.parquet
+
+e la lettura fonde partizione e delta, eliminando i duplicati per
+timestamp (vince il segmento più recente). `compact` riassorbe i delta
+nella partizione: da `update_csv` quando un anno supera
+HISTORY_COMPACT_SEGMENTS delta, e periodicamente dal task Celery.
+
+`write_history` scrive un DataFrame di barre nel layout riscrivendo solo
+gli anni che tocca. Il file unico legacy `<symbol>_<tf>.parquet` (o .csv)
+resta leggibile da `load_history`; conversione e compattazione sono
+
+    python -m backend.services.history_parquet --migrate [--remove-legacy]
+    python -m backend.services.history_parquet --compact
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+ROOT_DIR     = os.path.abspath(os.path.join(os.path.dirname(__file__), '../..'))
+HISTORY_ROOT = os.path.join(ROOT_DIR, 'mt5_history')
+
+PART_NAME      = 'part-0.parquet'
+DELTA_PREFIX   = 'delta-'
+ROW_GROUP_ROWS = 4096
+
+# delta per anno oltre i quali update_csv compatta subito
+COMPACT_SEGMENTS = int(os.getenv("HISTORY_COMPACT_SEGMENTS", 8))
+# letture ripetute se una compattazione concorrente rimuove un delta
+LIST_RETRIES = 5
+
+
+# ── Percorsi ───────────────────────────────────────────────────────────────────
+def dataset_dir(group: str, symbol: str, tf_str: str, root: str = HISTORY_ROOT) -> str:
+    return os.path.join(str(root), group, symbol, f"{symbol}_{tf_str}")
+
+
+def legacy_path(group: str, symbol: str, tf_str: str, root: str = HISTORY_ROOT) -> str | None:
+    """File unico `<symbol>_<tf>.parquet|csv`, se esiste."""
+    base = dataset_dir(group, symbol, tf_str, root)
+    for ext in ('.parquet', '.csv'):
+        if os.path.isfile(base + ext):
+            return base + ext
+    return None
+
+
+def _year_dir(path: str, year: int) -> str:
+    return os.path.join(path, f"year={year}")
+
+
+def year_segments(path: str) -> dict[int, list[str]]:
+    """
+    {anno: [partizione, delta...]} in ordine di anno. Nella lista la
+    partizione (se c'è) viene prima, poi i delta dal più vecchio: è
+    l'ordine di precedenza della fusione.
+    """
+    out = {}
+    if not os.path.isdir(path):
+        return out
+    for name in os.listdir(path):
+        ydir = os.path.join(path, name)
+        if not name.startswith('year=') or not os.path.isdir(ydir):
+            continue
+        files = sorted(f for f in os.listdir(ydir) if f.startswith(DELTA_PREFIX) and f.endswith('.parquet'))
+        if os.path.isfile(os.path.join(ydir, PART_NAME)):
+            files.insert(0, PART_NAME)
+        if files:
+            out[int(name[5:])] = [os.path.join(ydir, f) for f in files]
+    return dict(sorted(out.items()))
+
+
+def with_segments(path: str, read):
+    """
+    Ritorna `read(year_segments(path))`. Se un segmento sparisce durante la
+    lettura (compattazione concorrente: i delta rimossi sono già nella
+    partizione nuova) rilegge l'elenco e riprova, fino a LIST_RETRIES volte.
+    """
+    for attempt in range(LIST_RETRIES):
+        try:
+            return read(year_segments(path))
+        except FileNotFoundError:
+            if attempt == LIST_RETRIES - 1:
+                raise
+            time.sleep(0.01 * 2 ** attempt)     # lascia finire la compattazione
+
+
+def segment_files(path: str) -> list[str]:
+    """Tutti i file (partizioni e delta) della cartella, in ordine di fusione."""
+    return [fp for files in year_segments(path).values() for fp in files]
+
+
+def _is_delta(fp: str) -> bool:
+    return os.path.basename(fp).startswith(DELTA_PREFIX)
+
+
+def is_partitioned(path: str) -> bool:
+    return bool(year_segments(path))
+
+
+# ── Normalizzazione ────────────────────────────────────────────────────────────
+def normalize_bars(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Colonna `timestamp` datetime64[ns], ordinata, senza duplicati (a parità
+    di timestamp vince l'ultima barra, cioè la più recente scaricata).
+    """
+    if 'time' in df.columns and 'timestamp' not in df.columns:
+        df = df.rename(columns={'time': 'timestamp'})
+    if 'timestamp' not in df.columns:
+        df = df.reset_index().rename(columns={'index': 'timestamp'})
+    df = df.assign(timestamp=pd.to_datetime(df['timestamp']).astype('datetime64[ns]'))
+    df = df.drop_duplicates('timestamp', keep='last')
+    return df.sort_values('timestamp', kind='stable').reset_index(drop=True)
+
+
+# ── Scrittura ──────────────────────────────────────────────────────────────────
+def _write_atomic(table: pa.Table, dest: str):
+    """Scrive `table` in `dest` passando da un file temporaneo (ignorato dai lettori)."""
+    fd, tmp = tempfile.mkstemp(prefix='.tmp-', suffix='.parquet', dir=os.path.dirname(dest))
+    os.close(fd)
+    try:
+        pq.write_table(table, tmp, row_group_size=ROW_GROUP_ROWS, compression='snappy')
+        os.replace(tmp, dest)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _write_year(path: str, year: int, df: pd.DataFrame, merged=()):
+    """
+    Riscrive la partizione `year` e poi rimuove i delta già fusi in `df`.
+    Un lettore che elenca i segmenti fra i due passi vede righe doppie, che
+    la fusione elimina; uno che li ha elencati prima trova un delta già
+    rimosso (FileNotFoundError) e `with_segments` rilegge l'elenco.
+    """
+    ydir = _year_dir(path, year)
+    os.makedirs(ydir, exist_ok=True)
+    _write_atomic(pa.Table.from_pandas(df, preserve_index=False), os.path.join(ydir, PART_NAME))
+    for fp in merged:
+        if _is_delta(fp):
+            try:
+                os.remove(fp)
+            except FileNotFoundError:
+                pass
+
+
+def write_history(path: str, df: pd.DataFrame, replace: bool = False) -> list[int]:
+    """
+    Scrive le barre di `df` nella cartella `path`. Per ogni anno presente in
+    `df` la partizione esistente (con i suoi delta) viene fusa con le nuove
+    barre e riscritta; gli altri anni non vengono toccati. Con
+    `replace=True` gli anni di `df` sostituiscono quelli esistenti.
+    Ritorna gli anni riscritti.
+    """
+    df = normalize_bars(df)
+    if df.empty:
+        return []
+    existing = year_segments(path)
+    years = df['timestamp'].dt.year.to_numpy()
+    written = []
+    for year in np.unique(years):
+        year = int(year)
+        part  = df[years == year]
+        segs  = existing.get(year, [])
+        if not replace and segs:
+            part = normalize_bars(pd.concat([_read_segments(segs), part], ignore_index=True))
+        _write_year(path, year, part, merged=segs)
+        written.append(year)
+    return written
+
+
+def append_segment(path: str, df: pd.DataFrame) -> list[str]:
+    """
+    Aggiunge le barre di `df` come segmenti delta (uno per anno toccato),
+    senza leggere né riscrivere le partizioni. Ritorna i file scritti.
+    """
+    df = normalize_bars(df)
+    if df.empty:
+        return []
+    years = df['timestamp'].dt.year.to_numpy()
+    name  = f"{DELTA_PREFIX}{time.time_ns():020d}-{os.getpid()}.parquet"
+    out = []
+    for year in np.unique(years):
+        ydir = _year_dir(path, int(year))
+        os.makedirs(ydir, exist_ok=True)
+        dest = os.path.join(ydir, name)
+        _write_atomic(pa.Table.from_pandas(df[years == year], preserve_index=False), dest)
+        out.append(dest)
+    return out
+
+
+def drop_years(path: str, keep) -> list[int]:
+    """Cancella le partizioni (con i loro delta) degli anni non in `keep`. Ritorna gli anni rimossi."""
+    keep = set(keep)
+    dropped = [year for year in year_segments(path) if year not in keep]
+    for year in dropped:
+        shutil.rmtree(_year_dir(path, year))
+    return dropped
+
+
+def delta_counts(path: str) -> dict[int, int]:
+    """{anno: numero di delta} per gli anni che ne hanno."""
+    return {
+        year: n for year, files in year_segments(path).items()
+        if (n := sum(map(_is_delta, files)))
+    }
+
+
+def compact(path: str, min_deltas: int = 1) -> list[int]:
+    """
+    Fonde nella partizione i delta degli anni che ne hanno almeno
+    `min_deltas`. Ritorna gli anni compattati.
+    """
+    done = []
+    for year, segs in year_segments(path).items():
+        if sum(map(_is_delta, segs)) < min_deltas:
+            continue
+        _write_year(path, year, _read_segments(segs), merged=segs)
+        done.append(year)
+    return done
+
+
+# ── Lettura ────────────────────────────────────────────────────────────────────
+def _ts_filter(start, end):
+    """Filtro pyarrow sul timestamp (pushdown sulle statistiche dei row group)."""
+    expr = None
+    if start is not None:
+        expr = ds.field('timestamp') >= pd.Timestamp(start).to_pydatetime()
+    if end is not None:
+        cond = ds.field('timestamp') <= pd.Timestamp(end).to_pydatetime()
+        expr = cond if expr is None else expr & cond
+    return expr
+
+
+def _read_segments(files, columns=None, filters=None) -> pd.DataFrame:
+    """
+    Legge e fonde i segmenti nell'ordine dato (partizione, poi delta):
+    a parità di timestamp resta la barra del segmento più recente.
+    """
+    tables = [pq.read_table(fp, columns=columns, filters=filters) for fp in files]
+    df = pa.concat_tables(tables, promote_options='default').to_pandas()
+    if any(map(_is_delta, files)):
+        return normalize_bars(df)
+    return df.sort_values('timestamp', kind='stable').reset_index(drop=True)
+
+
+def read_history(path: str, start=None, end=None, columns=None) -> pd.DataFrame:
+    """
+    Barre della cartella partizionata `path` con start <= timestamp <= end
+    (estremi opzionali, inclusi), solo per `columns` (timestamp sempre
+    incluso). Ordinate per timestamp, delta fusi e senza duplicati.
+    """
+    cols = None if columns is None else ['timestamp', *[c for c in columns if c != 'timestamp']]
+    lo = pd.Timestamp(start) if start is not None else None
+    hi = pd.Timestamp(end) if end is not None else None
+
+    def read(segments):
+        files = [
+            fp for year, segs in segments.items()
+            if (lo is None or year >= lo.year) and (hi is None or year <= hi.year)
+            for fp in segs
+        ]
+        if not files:
+            return pd.DataFrame({c: [] for c in (cols or ['timestamp'])}) \
+                     .astype({'timestamp': 'datetime64[ns]'})
+        return _read_segments(files, cols, _ts_filter(lo, hi))
+
+    return with_segments(path, read)
+
+
+def history_bounds(path: str) -> tuple[pd.Timestamp | None, pd.Timestamp | None, int]:
+    """
+    (primo timestamp, ultimo timestamp, righe) dai soli metadati parquet.
+    Le righe includono i duplicati dei delta non ancora compattati.
+    """
+    def read(segments):
+        first = last = None
+        rows = 0
+        for fp in (fp for files in segments.values() for fp in files):
+            meta = pq.ParquetFile(fp).metadata
+            idx  = meta.schema.to_arrow_schema().get_field_index('timestamp')
+            for i in range(meta.num_row_groups):
+                rg = meta.row_group(i)
+                rows += rg.num_rows
+                st = rg.column(idx).statistics
+                if st is None or not st.has_min_max:
+                    continue
+                lo, hi = pd.Timestamp(st.min), pd.Timestamp(st.max)
+                first = lo if first is None or lo < first else first
+                last  = hi if last is None or hi > last else last
+        return first, last, rows
+
+    return with_segments(path, read)
+
+
+def _read_legacy(path: str, start=None, end=None, columns=None) -> pd.DataFrame:
+    if path.endswith('.parquet'):
+        df = pd.read_parquet(path)
+    else:
+        df = pd.read_csv(path)
+    df = normalize_bars(df)
+    if start is not None:
+        df = df[df['timestamp'] >= pd.Timestamp(start)]
+    if end is not None:
+        df = df[df['timestamp'] <= pd.Timestamp(end)]
+    if columns is not None:
+        df = df[['timestamp', *[c for c in columns if c != 'timestamp']]]
+    return df.reset_index(drop=True)
+
+
+def load_history(group: str, symbol: str, tf_str: str, start=None, end=None,
+                 columns=None, years_back: int | None = None,
+                 root: str = HISTORY_ROOT) -> pd.DataFrame:
+    """
+    Storico di `symbol`+`tf_str` fra `start` e `end`, solo per `columns`.
+
+    `years_back` (al posto di `start`) seleziona la stessa finestra di
+    `get_pattern_statistics`: gli ultimi N anni fino all'ultima barra.
+    Legge il layout partizionato se presente, altrimenti il file legacy;
+    un timeframe derivato (vedi `history_resample`) senza file viene
+    aggregato al volo dal timeframe base.
+    """
+    path = dataset_dir(group, symbol, tf_str, root)
+    if is_partitioned(path):
+        if years_back is not None:
+            last = history_bounds(path)[1]
+            if last is not None:
+                start = last - pd.DateOffset(years=years_back)
+        return read_history(path, start, end, columns)
+
+    legacy = legacy_path(group, symbol, tf_str, root)
+    if legacy is None:
+        # timeframe derivato non ancora su disco: aggregato al volo dal base
+        from backend.services.history_resample import load_derived
+        if years_back is None:
+            return load_derived(group, symbol, tf_str, start, end, columns, root=root)
+        df = load_derived(group, symbol, tf_str, None, end, columns, root=root)
+    elif years_back is not None:
+        df = _read_legacy(legacy, None, end, columns)
+    if years_back is not None:
+        if df.empty:
+            return df
+        return df[df['timestamp'] >= df['timestamp'].iloc[-1] - pd.DateOffset(years=years_back)] \
+                 .reset_index(drop=True)
+    return _read_legacy(legacy, start, end, columns)
+
+
+# ── Migrazione dal file unico ──────────────────────────────────────────────────
+def migrate_legacy(group: str, symbol: str, tf_str: str, root: str = HISTORY_ROOT,
+                   remove: bool = False) -> str | None:
+    """Converte `<symbol>_<tf>.parquet|csv` nel layout per anno. Ritorna la cartella."""
+    legacy = legacy_path(group, symbol, tf_str, root)
+    if legacy is None:
+        return None
+    path = dataset_dir(group, symbol, tf_str, root)
+    write_history(path, _read_legacy(legacy), replace=True)
+    if remove:
+        os.remove(legacy)
+    return path
+
+
+def migrate_all(root: str = HISTORY_ROOT, remove: bool = False) -> int:
+    done = 0
+    for group in sorted(os.listdir(root)):
+        gdir = os.path.join(root, group)
+        if group.startswith('.') or not os.path.isdir(gdir):
+            continue
+        for symbol in sorted(os.listdir(gdir)):
+            sdir = os.path.join(gdir, symbol)
+            if not os.path.isdir(sdir):
+                continue
+            tfs = {
+                os.path.splitext(f)[0][len(symbol) + 1:]
+                for f in os.listdir(sdir)
+                if f.startswith(f"{symbol}_") and f.endswith(('.parquet', '.csv'))
+            }
+            for tf_str in sorted(tfs):
+                if migrate_legacy(group, symbol, tf_str, root, remove):
+                    print(f"   ✅ {group}/{symbol} {tf_str}")
+                    done += 1
+    return done
+
+
+def compact_all(root: str = HISTORY_ROOT, min_deltas: int = 1) -> int:
+    """Compatta tutte le cartelle per anno sotto `root`. Ritorna gli anni compattati."""
+    done = 0
+    for group in sorted(os.listdir(root)):
+        gdir = os.path.join(root, group)
+        if group.startswith('.') or not os.path.isdir(gdir):
+            continue
+        for symbol in sorted(os.listdir(gdir)):
+            sdir = os.path.join(gdir, symbol)
+            if not os.path.isdir(sdir):
+                continue
+            for name in sorted(os.listdir(sdir)):
+                path = os.path.join(sdir, name)
+                if name.startswith(f"{symbol}_") and os.path.isdir(path):
+                    years = compact(path, min_deltas)
+                    if years:
+                        print(f"   🗜 {group}/{symbol} {name[len(symbol) + 1:]}: anni {years}")
+                    done += len(years)
+    return done
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description="Storico partizionato per anno")
+    ap.add_argument('--migrate', action='store_true', help="converte i file unici legacy")
+    ap.add_argument('--remove-legacy', action='store_true', help="cancella i file legacy convertiti")
+    ap.add_argument('--compact', action='store_true', help="fonde i delta nelle partizioni annuali")
+    ap.add_argument('--root', default=HISTORY_ROOT)
+    args = ap.parse_args()
+    if args.migrate:
+        n = migrate_all(args.root, args.remove_legacy)
+        print(f"✅ Migrati {n} storici nel layout per anno")
+    if args.compact:
+        n = compact_all(args.root)
+        print(f"✅ Compattati {n} anni")
+    if not (args.migrate or args.compact):
+        ap.print_help()
@@ -0,0 +1,222 @@
+# backend/services/history_resample.py
+from __future__ import annotations
+
+"""
+Timeframe derivati: H4 / D1 / W1 / MN1 costruiti localmente dalle barre
+del timeframe base (H1, o M1) invece di scaricarli uno per uno.
+
+Quali timeframe sono scaricati e quali derivati lo dice
+`config/default.yaml`:
+
+    mt5:
+      timeframes: [H1]                  # materializzati (scaricati)
+      derived_timeframes: {H4: H1, D1: H1, W1: H1, MN1: H1}
+      session_start_hour: 0             # ora server d'inizio sessione
+
+Aggregazione OHLC: open = prima, high = max, low = min, close = ultima,
+tick_volume / real_volume = somma, spread = max. Le barre sono etichettate
+con l'inizio del periodo, come MT5, allineato alla sessione del broker
+(ora server + session_start_hour): H4 su multipli di 4 ore, D1 al giorno,
+W1 alla domenica, MN1 al primo del mese.
+
+Aggiornamento incrementale: dopo un append di barre base si ricalcolano
+solo i periodi dalla prima barra nuova in poi e si scrivono come segmento
+delta; la barra del periodo in corso sostituisce quella parziale
+precedente alla fusione (vince il segmento più recente). Il delta si
+aggiunge solo a uno storico già derivato con la stessa base e sessione
+(marker `_derived.json`): uno storico scaricato da MT5 (es. il vecchio D1)
+viene ricostruito per intero alla prima derivazione, senza mescolare
+barre del broker e barre aggregate.
+
+La profondità di un timeframe derivato è quella del timeframe base: D1 /
+W1 / MN1 costruiti da H1 partono dalla prima barra H1, di solito anni dopo
+l'inizio del D1 che MT5 fornirebbe. Chi ha bisogno di 20 anni di D1 con
+un H1 più corto deve tenere D1 fra i timeframe scaricati (`timeframes`).
+"""
+
+import json
+import os
+
+import pandas as pd
+import yaml
+
+from backend.services.history_parquet import (
+    HISTORY_ROOT, ROOT_DIR, dataset_dir, is_partitioned, legacy_path,
+    read_history, write_history, append_segment, drop_years, load_history,
+)
+
+CONFIG_FP = os.path.join(ROOT_DIR, 'config', 'default.yaml')
+
+DEFAULT_DERIVED = {'H4': 'H1', 'D1': 'H1', 'W1': 'H1', 'MN1': 'H1'}
+
+MARKER = '_derived.json'
+
+_AGG = {
+    'open':        'first',
+    'high':        'max',
+    'low':         'min',
+    'close':       'last',
+    'tick_volume': 'sum',
+    'real_volume': 'sum',
+    'spread':      'max',
+}
+
+
+def _load_config() -> dict:
+    try:
+        with open(CONFIG_FP) as f:
+            return (yaml.safe_load(f) or {}).get('mt5', {})
+    except OSError:
+        return {}
+
+
+_cfg = _load_config()
+# un timeframe elencato anche fra quelli scaricati resta materializzato
+DERIVED_TIMEFRAMES = {
+    tf: base for tf, base in (_cfg.get('derived_timeframes') or DEFAULT_DERIVED).items()
+    if tf not in (_cfg.get('timeframes') or ())
+}
+SESSION_START_HOUR = int(_cfg.get('session_start_hour', 0))
+
+
+def base_timeframe(tf_str: str) -> str | None:
+    """Timeframe base da cui `tf_str` è derivato, None se è materializzato."""
+    return DERIVED_TIMEFRAMES.get(tf_str)
+
+
+def derived_from(base_tf: str) -> list[str]:
+    """Timeframe derivati da `base_tf`."""
+    return [tf for tf, base in DERIVED_TIMEFRAMES.items() if base == base_tf]
+
+
+# ── Aggregazione ───────────────────────────────────────────────────────────────
+def period_start(ts, tf_str: str, session_hour: int = SESSION_START_HOUR) -> pd.Series:
+    """Inizio del periodo `tf_str` (allineato alla sessione) per ogni timestamp."""
+    ts = pd.Series(pd.to_datetime(ts))
+    shift = pd.Timedelta(hours=session_hour)
+    local = ts - shift
+    if tf_str == 'H4':
+        start = local.dt.floor('4h')
+    elif tf_str == 'D1':
+        start = local.dt.floor('D')
+    elif tf_str == 'W1':
+        day   = local.dt.floor('D')
+        start = day - pd.to_timedelta((day.dt.dayofweek + 1) % 7, unit='D')   # domenica
+    elif tf_str == 'MN1':
+        start = local.dt.to_period('M').dt.start_time
+    else:
+        raise ValueError(f"Timeframe non derivabile: {tf_str}")
+    return (start + shift).astype('datetime64[ns]')
+
+
+def resample_bars(df: pd.DataFrame, tf_str: str, session_hour: int = SESSION_START_HOUR) -> pd.DataFrame:
+    """Barre base (ordinate) → barre `tf_str`, colonna `timestamp` = inizio periodo."""
+    if df.empty:
+        return df.copy()
+    key = period_start(df['timestamp'], tf_str, session_hour).to_numpy()
+    agg = {c: f for c, f in _AGG.items() if c in df.columns}
+    out = df.groupby(key, sort=True).agg(agg)
+    out.index.name = 'timestamp'
+    return out.reset_index()
+
+
+# ── Storico derivato ───────────────────────────────────────────────────────────
+def _write_marker(path: str, tf_str: str, base_tf: str, session_hour: int):
+    with open(os.path.join(path, MARKER), 'w') as f:
+        json.dump({'timeframe': tf_str, 'from': base_tf, 'session_start_hour': session_hour}, f)
+
+
+def read_marker(path: str) -> dict | None:
+    try:
+        with open(os.path.join(path, MARKER)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _same_derivation(path: str, base_tf: str, session_hour: int) -> bool:
+    """Storico su disco già derivato da `base_tf` con la stessa sessione (delta ammessi)."""
+    marker = read_marker(path)
+    return (
+        is_partitioned(path) and marker is not None
+        and marker.get('from') == base_tf and marker.get('session_start_hour') == session_hour
+    )
+
+
+def derive_timeframe(group: str, symbol: str, tf_str: str, root: str = HISTORY_ROOT,
+                     since=None, session_hour: int = SESSION_START_HOUR) -> str | None:
+    """
+    Costruisce (o aggiorna) lo storico `tf_str` dalle barre del timeframe
+    base. Senza `since` ricostruisce tutto; con `since` (prima barra base
+    nuova) ricalcola solo i periodi da lì in poi e li aggiunge come delta,
+    se la cartella è già uno storico derivato dalla stessa base e sessione:
+    altrimenti (es. barre scaricate da MT5) la ricostruisce da zero.
+    Ritorna la cartella scritta, None se manca lo storico base.
+    """
+    base_tf = base_timeframe(tf_str)
+    if base_tf is None:
+        raise ValueError(f"{tf_str} non è un timeframe derivato")
+    base_dir = dataset_dir(group, symbol, base_tf, root)
+    if not is_partitioned(base_dir):
+        return None
+    path = dataset_dir(group, symbol, tf_str, root)
+
+    if since is not None and _same_derivation(path, base_tf, session_hour):
+        start = period_start([since], tf_str, session_hour).iloc[0]
+        bars  = resample_bars(read_history(base_dir, start=start), tf_str, session_hour)
+        append_segment(path, bars)
+    else:
+        if since is not None and is_partitioned(path):
+            print(f"      ↳ {symbol} {tf_str}: storico non derivato da {base_tf}, ricostruito da zero")
+        bars = resample_bars(read_history(base_dir), tf_str, session_hour)
+        # ricostruzione completa: via anche gli anni fuori dallo storico base
+        drop_years(path, keep=write_history(path, bars, replace=True))
+    _write_marker(path, tf_str, base_tf, session_hour)
+    return path
+
+
+def update_derived(group: str, symbol: str, base_tf: str, root: str = HISTORY_ROOT,
+                   since=None) -> list[str]:
+    """Aggiorna tutti i timeframe derivati da `base_tf` (dopo un fetch). Ritorna i timeframe scritti."""
+    done = []
+    for tf_str in derived_from(base_tf):
+        if derive_timeframe(group, symbol, tf_str, root, since=since):
+            done.append(tf_str)
+    return done
+
+
+def timeframe_kind(group: str, symbol: str, tf_str: str, root: str = HISTORY_ROOT) -> str | None:
+    """
+    'materialized' (scaricato), 'derived' (costruito da un timeframe base,
+    su disco o calcolabile al volo) o None se non disponibile.
+    """
+    path = dataset_dir(group, symbol, tf_str, root)
+    stored = is_partitioned(path) or legacy_path(group, symbol, tf_str, root) is not None
+    if stored and read_marker(path) is None:
+        return 'materialized'
+    base_tf = base_timeframe(tf_str)
+    if stored or (base_tf and timeframe_kind(group, symbol, base_tf, root)):
+        return 'derived'
+    return None
+
+
+def load_derived(group: str, symbol: str, tf_str: str, start=None, end=None, columns=None,
+                 root: str = HISTORY_ROOT, session_hour: int = SESSION_START_HOUR) -> pd.DataFrame:
+    """
+    Barre `tf_str` calcolate al volo dal timeframe base (senza scriverle),
+    per i timeframe derivati non ancora su disco.
+    """
+    base_tf = base_timeframe(tf_str)
+    if base_tf is None:
+        raise FileNotFoundError(f"History file non trovato: {dataset_dir(group, symbol, tf_str, root)}")
+    base_start = period_start([start], tf_str, session_hour).iloc[0] if start is not None else None
+    base_cols  = None if columns is None else [c for c in columns if c in _AGG]
+    bars = resample_bars(
+        load_history(group, symbol, base_tf, start=base_start, end=end, columns=base_cols, root=root),
+        tf_str, session_hour,
+    )
+    if start is not None:
+        bars = bars[bars['timestamp'] >= pd.Timestamp(start)]
+    if columns is not None:
+        bars = bars[['timestamp', *[c for c in columns if c != 'timestamp']]]
+    return bars.reset_index(drop=True)
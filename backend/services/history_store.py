@@ -0,0 +1,228 @@
+# backend/services/history_store.py
+from __future__ import annotations
+
+"""
+Store dello storico in formato NumPy memory-mapped per i worker di calcolo.
+
+Ogni storico `mt5_history/<group>/<symbol>/<symbol>_<tf>/` (layout per anno,
+vedi `history_parquet`) o file legacy `<symbol>_<tf>.parquet|csv` viene
+convertito una sola volta per run in una cartella
+
+    mt5_history/.mmap/<group>/<symbol>_<tf>/
+        current         nome della versione attiva
+        v-<ns>-<pid>/
+            timestamp.npy   int64, epoch ns (naive), ordinato
+            open.npy high.npy low.npy close.npy   float64
+            meta.json       sorgente, mtime, size, righe
+
+Una nuova conversione scrive una nuova versione e poi sostituisce `current`
+con un solo `os.replace`: chi legge vede sempre una versione completa.
+
+I worker aprono gli array con `np.load(..., mmap_mode="r")`: le pagine sono
+condivise dalla page-cache del sistema operativo, quindi N processi non
+tengono N copie pandas dello stesso storico.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from backend.services.history_parquet import (
+    HISTORY_ROOT, dataset_dir, segment_files, with_segments, read_history, normalize_bars,
+)
+from backend.services.history_resample import base_timeframe, derive_timeframe
+
+STORE_ROOT   = os.path.join(HISTORY_ROOT, '.mmap')
+
+COLUMNS = ('timestamp', 'open', 'high', 'low', 'close')
+POINTER = 'current'
+STALE_GRACE = 60            # secondi prima di rimuovere una versione sostituita
+
+
+class HistoryArrays(NamedTuple):
+    timestamp: np.ndarray       # int64 epoch ns
+    open:      np.ndarray
+    high:      np.ndarray
+    low:       np.ndarray
+    close:     np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.timestamp)
+
+    def to_frame(self) -> pd.DataFrame:
+        """DataFrame ['timestamp','open','high','low','close'] (copia)."""
+        return pd.DataFrame({
+            'timestamp': pd.to_datetime(np.asarray(self.timestamp), unit='ns'),
+            'open':      np.asarray(self.open),
+            'high':      np.asarray(self.high),
+            'low':       np.asarray(self.low),
+            'close':     np.asarray(self.close),
+        })
+
+
+# ── Sorgenti ───────────────────────────────────────────────────────────────────
+def _source_path(group: str, symbol: str, tf_str: str) -> str:
+    base = dataset_dir(group, symbol, tf_str, HISTORY_ROOT)
+    if segment_files(base):
+        return base
+    for ext in ('.parquet', '.csv'):
+        if os.path.isfile(base + ext):
+            return base + ext
+    # timeframe derivato mai costruito: lo materializza dal timeframe base
+    if base_timeframe(tf_str) and derive_timeframe(group, symbol, tf_str, HISTORY_ROOT):
+        return base
+    raise FileNotFoundError(f"History file non trovato: {base}.parquet")
+
+
+def _read_source(path: str) -> pd.DataFrame:
+    if os.path.isdir(path):
+        return read_history(path, columns=COLUMNS[1:])
+    if path.endswith('.parquet'):
+        df = pd.read_parquet(path)
+    else:
+        df = pd.read_csv(path)
+    return normalize_bars(df)
+
+
+def _store_dir(group: str, symbol: str, tf_str: str) -> str:
+    return os.path.join(STORE_ROOT, group, f"{symbol}_{tf_str}")
+
+
+def _source_meta(path: str) -> dict:
+    if os.path.isdir(path):
+        # cartella per anno: cambia se cambia una qualunque partizione
+        stats = with_segments(path, lambda segments: [
+            os.stat(fp) for files in segments.values() for fp in files
+        ])
+        return {'source': path, 'mtime_ns': max(st.st_mtime_ns for st in stats),
+                'size': sum(st.st_size for st in stats), 'files': len(stats)}
+    st = os.stat(path)
+    return {'source': path, 'mtime_ns': st.st_mtime_ns, 'size': st.st_size}
+
+
+def _current_version(store_dir: str) -> str | None:
+    """Cartella della versione attiva indicata da `current`, o None."""
+    try:
+        with open(os.path.join(store_dir, POINTER)) as f:
+            name = f.read().strip()
+    except OSError:
+        return None
+    return os.path.join(store_dir, name) if name else None
+
+
+def _is_fresh(store_dir: str, src_meta: dict) -> bool:
+    version = _current_version(store_dir)
+    if version is None:
+        return False
+    try:
+        with open(os.path.join(version, 'meta.json')) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return all(meta.get(k) == v for k, v in src_meta.items())
+
+
+def _drop_stale(store_dir: str, keep: str) -> None:
+    """
+    Rimuove i file del vecchio layout (array direttamente nella cartella) e le
+    versioni sostituite da più di `STALE_GRACE` secondi: chi ha appena letto
+    `current` ha il tempo di aprire gli array anche se intanto un altro
+    processo pubblica una versione nuova. Chi ha già aperto una versione in
+    memory-map continua a leggerla; su Windows i file aperti restano e vengono
+    ripuliti al giro dopo.
+    """
+    names    = os.listdir(store_dir)
+    versions = sorted(n for n in names if n.startswith('v-'))
+    now      = time.time_ns()
+    for name, successor in zip(versions, versions[1:]):
+        # una versione smette di essere attiva quando nasce la successiva
+        if name != keep and now - int(successor.split('-')[1]) > STALE_GRACE * 1e9:
+            shutil.rmtree(os.path.join(store_dir, name), ignore_errors=True)
+    for name in names:
+        if name == 'meta.json' or name.endswith('.npy'):
+            try:
+                os.remove(os.path.join(store_dir, name))
+            except OSError:
+                pass
+
+
+# ── Conversione ────────────────────────────────────────────────────────────────
+def convert_history(group: str, symbol: str, tf_str: str, force: bool = False) -> str:
+    """
+    Converte lo storico di `symbol`+`tf_str` nel layout memory-mapped, se la
+    copia esistente manca o è più vecchia della sorgente. Ritorna la cartella
+    della versione attiva.
+    """
+    src  = _source_path(group, symbol, tf_str)
+    meta = _source_meta(src)
+    dest = _store_dir(group, symbol, tf_str)
+    if not force and _is_fresh(dest, meta):
+        return _current_version(dest)
+
+    df = _read_source(src)
+    os.makedirs(dest, exist_ok=True)
+    version = tempfile.mkdtemp(prefix='.v-', dir=dest)
+    try:
+        np.save(os.path.join(version, 'timestamp.npy'),
+                df['timestamp'].to_numpy(dtype='datetime64[ns]').view('int64'))
+        for col in COLUMNS[1:]:
+            np.save(os.path.join(version, f'{col}.npy'), df[col].to_numpy(dtype='float64'))
+        with open(os.path.join(version, 'meta.json'), 'w') as f:
+            json.dump({**meta, 'rows': len(df)}, f)
+
+        # versione completa → nome definitivo (ordinato nel tempo), poi un solo
+        # os.replace del puntatore: chi legge `current` trova sempre una
+        # versione intera
+        name = f"v-{time.time_ns():020d}-{os.getpid()}"
+        os.replace(version, os.path.join(dest, name))
+        version = os.path.join(dest, name)
+        fd, pointer = tempfile.mkstemp(prefix='.current.', dir=dest)
+        with os.fdopen(fd, 'w') as f:
+            f.write(name)
+        os.replace(pointer, os.path.join(dest, POINTER))
+    except OSError:
+        shutil.rmtree(version, ignore_errors=True)
+        if not _is_fresh(dest, meta):
+            raise
+        return _current_version(dest)
+    _drop_stale(dest, name)
+    return version
+
+
+def prepare_history_store(items) -> int:
+    """
+    Converte in anticipo (nel processo padre) una sequenza di
+    (group, symbol, tf). Ritorna il numero di storici disponibili.
+    """
+    ready = 0
+    for group, symbol, tf_str in items:
+        try:
+            convert_history(group, symbol, tf_str)
+            ready += 1
+        except FileNotFoundError:
+            continue
+    return ready
+
+
+def load_history_arrays(group: str, symbol: str, tf_str: str) -> HistoryArrays:
+    """
+    Apre lo storico in memory-map (zero-copy, sola lettura), convertendolo
+    al volo se non ancora presente nello store.
+    """
+    for attempt in range(2):
+        version = convert_history(group, symbol, tf_str)
+        try:
+            return HistoryArrays(*(
+                np.load(os.path.join(version, f'{col}.npy'), mmap_mode='r') for col in COLUMNS
+            ))
+        except FileNotFoundError:
+            # versione sostituita e rimossa da un'altra conversione mentre la
+            # aprivamo: si rilegge il puntatore (una volta)
+            if attempt:
+                raise
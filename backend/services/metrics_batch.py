@@ -0,0 +1,221 @@
+# backend/services/metrics_batch.py
+from __future__ import annotations
+
+"""
+Metriche di trade calcolate in blocco per molti pattern.
+
+I rendimenti di N pattern arrivano come un unico array "ragged"
+(`values` concatenati + `offsets` di lunghezza N+1): il pattern `i` occupa
+`values[offsets[i]:offsets[i+1]]`. Il kernel compilato con numba restituisce
+array colonnari con gli stessi nomi delle colonne di `Statistic`, pronti per
+l'insert massivo.
+
+È l'unica definizione delle metriche dei pattern: la usano sia i motori
+batch sia `get_pattern_statistics` (una curva sola). Con r_1 … r_n i
+rendimenti dei trade (frazioni) e T = n / max(years_back, 1) i trade per anno:
+
+    gross_profit_pct      Σ r⁺ · 100
+    gross_loss_pct        Σ r⁻ · 100                     (≤ 0)
+    net_return_pct        (Π (1 + r) − 1) · 100          (composto)
+    win_rate              #(r > 0) / n · 100
+    profit_factor         Σ r⁺ / |Σ r⁻|                  (NaN senza perdite)
+    expectancy            media(r) · 100
+    avg_trade_pct         media(r) · 100                 (= expectancy)
+    max_drawdown_pct      min(E / max(E) − 1) · 100, E = Π(1 + r) per trade
+    sharpe_ratio          media(r) / std(r, ddof=1) · √T (NaN se n < 2 o std = 0)
+    sortino_ratio         media(r) / √(Σ (r⁻)² / n) · √T (NaN senza perdite)
+    annual_volatility_pct std(r, ddof=1) · √T · 100
+    num_trades            n
+    max_consec_wins/losses serie più lunga di r > 0 / r < 0 (r = 0 la interrompe)
+
+Il test di parità (tests/test_metrics_batch.py) confronta il kernel con
+queste formule scritte in NumPy.
+"""
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:                     # numba assente: stesso kernel in Python puro
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        return lambda fn: fn
+
+# colonne float / int prodotte dal kernel (nomi = colonne di Statistic)
+FLOAT_COLUMNS = (
+    "gross_profit_pct", "gross_loss_pct", "net_return_pct", "win_rate",
+    "profit_factor", "expectancy", "max_drawdown_pct", "sharpe_ratio",
+    "sortino_ratio", "annual_volatility_pct", "avg_trade_pct",
+)
+INT_COLUMNS = ("num_trades", "max_consec_wins", "max_consec_losses")
+
+NAT = np.iinfo(np.int64).min
+DAY_NS = 86_400_000_000_000
+
+
+@njit(cache=True)
+def _metrics_kernel(values, offsets, years_back):
+    n_pat = offsets.shape[0] - 1
+    out_f = np.full((n_pat, 11), np.nan)
+    out_i = np.zeros((n_pat, 3), dtype=np.int64)
+
+    for i in range(n_pat):
+        a, b = offsets[i], offsets[i + 1]
+        n = b - a
+        out_i[i, 0] = n
+        if n == 0:
+            continue
+
+        gp = 0.0; gl = 0.0; s = 0.0; down2 = 0.0
+        wins = 0; cw = 0; cl = 0; mw = 0; ml = 0
+        eq = 1.0; peak = 1.0; mdd = 0.0
+        for k in range(a, b):
+            r = values[k]
+            s += r
+            if r > 0:
+                gp += r; wins += 1
+                cw += 1; cl = 0
+                if cw > mw:
+                    mw = cw
+            elif r < 0:
+                gl += r; down2 += r * r
+                cl += 1; cw = 0
+                if cl > ml:
+                    ml = cl
+            else:
+                cw = 0; cl = 0
+            eq *= 1.0 + r
+            if eq > peak:
+                peak = eq
+            dd = eq / peak - 1.0
+            if dd < mdd:
+                mdd = dd
+
+        mean = s / n
+        var = 0.0
+        for k in range(a, b):
+            var += (values[k] - mean) ** 2
+        std = np.sqrt(var / (n - 1)) if n > 1 else np.nan
+        down = np.sqrt(down2 / n)
+        ann = np.sqrt(n / years_back[i])           # trade per anno
+
+        out_f[i, 0] = gp * 100.0
+        out_f[i, 1] = gl * 100.0
+        out_f[i, 2] = (eq - 1.0) * 100.0
+        out_f[i, 3] = wins / n * 100.0
+        if gl < 0:
+            out_f[i, 4] = gp / -gl
+        out_f[i, 5] = mean * 100.0
+        out_f[i, 6] = mdd * 100.0
+        if std > 0:
+            out_f[i, 7] = mean / std * ann
+        if down > 0:
+            out_f[i, 8] = mean / down * ann
+        out_f[i, 9] = std * ann * 100.0
+        out_f[i, 10] = mean * 100.0
+        out_i[i, 1] = mw
+        out_i[i, 2] = ml
+
+    return out_f, out_i
+
+
+def ragged(arrays) -> tuple[np.ndarray, np.ndarray]:
+    """Lista di array di rendimenti → (values, offsets)."""
+    lengths = np.fromiter((len(a) for a in arrays), dtype=np.int64)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    values = np.concatenate(arrays).astype(float) if len(arrays) else np.empty(0)
+    return values, offsets
+
+
+def batch_metrics(values: np.ndarray, offsets: np.ndarray, years_back) -> dict[str, np.ndarray]:
+    """
+    Metriche per tutti i pattern di un array ragged di rendimenti per trade.
+
+    `years_back` può essere uno scalare o un array (uno per pattern) e serve
+    ad annualizzare Sharpe / Sortino / volatilità (trade per anno).
+    I valori non definiti (es. profit factor senza perdite) sono NaN.
+
+    Ritorna {colonna_Statistic: array} di lunghezza N.
+    """
+    values  = np.ascontiguousarray(values, dtype=np.float64)
+    offsets = np.ascontiguousarray(offsets, dtype=np.int64)
+    yb = np.broadcast_to(
+        np.maximum(np.asarray(years_back, dtype=np.float64), 1.0), (len(offsets) - 1,)
+    ).copy()
+
+    out_f, out_i = _metrics_kernel(values, offsets, yb)
+    cols = {name: out_f[:, k] for k, name in enumerate(FLOAT_COLUMNS)}
+    cols.update({name: out_i[:, k] for k, name in enumerate(INT_COLUMNS)})
+    return cols
+
+
+@njit(cache=True)
+def _drawdown_kernel(values, ts_ns, offsets):
+    n_pat = offsets.shape[0] - 1
+    mdd   = np.zeros(n_pat)
+    start = np.full(n_pat, NAT, dtype=np.int64)     # picco prima del minimo
+    end   = np.full(n_pat, NAT, dtype=np.int64)     # minimo
+    recov = np.full(n_pat, NAT, dtype=np.int64)     # ritorno al picco
+
+    for i in range(n_pat):
+        a, b = offsets[i], offsets[i + 1]
+        if b <= a:
+            continue
+        peak = values[a]; peak_k = a
+        best = 0.0; best_peak = -1; best_k = -1
+        for k in range(a, b):
+            v = values[k]
+            if v > peak:
+                peak = v; peak_k = k
+            dd = v / peak - 1.0 if peak != 0 else 0.0
+            if dd < best:
+                best = dd; best_peak = peak_k; best_k = k
+        if best_k < 0:
+            continue
+        mdd[i]   = best * 100.0
+        start[i] = ts_ns[best_peak]
+        end[i]   = ts_ns[best_k]
+        level = values[best_peak]
+        for k in range(best_k + 1, b):
+            if values[k] >= level:
+                recov[i] = ts_ns[k]
+                break
+
+    return mdd, start, end, recov
+
+
+def batch_drawdowns(values: np.ndarray, ts_ns: np.ndarray, offsets: np.ndarray) -> dict[str, np.ndarray]:
+    """
+    Drawdown massimo di N curve di equity in formato ragged (valori e
+    timestamp int64 ns allineati, ordinati per curva).
+
+    Ritorna array di lunghezza N:
+        max_drawdown_pct  – minimo di equity/picco − 1, in % (≤ 0)
+        drawdown_start    – timestamp (ns) del picco, NAT se nessun drawdown
+        drawdown_end      – timestamp (ns) del minimo
+        recovered_at      – timestamp (ns) del ritorno al picco, NAT se non recuperato
+        dd_duration_days  – giorni dal picco al recupero (o all'ultimo punto)
+        recovery_days     – giorni dal minimo al recupero (o all'ultimo punto)
+    """
+    values  = np.ascontiguousarray(values, dtype=np.float64)
+    ts_ns   = np.ascontiguousarray(ts_ns, dtype=np.int64)
+    offsets = np.ascontiguousarray(offsets, dtype=np.int64)
+
+    mdd, start, end, recov = _drawdown_kernel(values, ts_ns, offsets)
+    has_dd = start != NAT
+    last   = ts_ns[np.maximum(offsets[1:] - 1, 0)] if len(ts_ns) else np.zeros_like(start)
+    until  = np.where(recov != NAT, recov, last)
+    dur    = np.zeros_like(start)
+    rec    = np.zeros_like(start)
+    dur[has_dd] = (until[has_dd] - start[has_dd]) // DAY_NS
+    rec[has_dd] = (until[has_dd] - end[has_dd]) // DAY_NS
+    return {
+        "max_drawdown_pct": mdd,
+        "drawdown_start":   start,
+        "drawdown_end":     end,
+        "recovered_at":     recov,
+        "dd_duration_days": dur,
+        "recovery_days":    rec,
+    }
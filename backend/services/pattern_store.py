@@ -0,0 +1,327 @@
+# backend/services/pattern_store.py
+from __future__ import annotations
+
+"""
+Scrittura idempotente dei pattern precalcolati.
+
+Ogni pattern è identificato da una chiave stabile
+    sha256(asset_id | type | params canonici | years_back)
+salvata in `Pattern.pattern_key` (indice unico). `Pattern.inputs_hash`
+riassume la lista dei trade (timestamp + equity): se non cambia, il pattern
+viene saltato; altrimenti Statistic ed equity (un `EquityBlob` compresso per
+curva) vengono riscritti in place, senza creare nuove righe Pattern a ogni
+run. Gli insert passano da `BulkWriter` (COPY su PostgreSQL, executemany
+su SQLite).
+
+`PatternSink` è il punto di scrittura in streaming dei worker: accumula i
+risultati dei motori e li scarica (upsert + commit) appena il buffer supera
+PATTERN_FLUSH_ROWS pattern o PATTERN_FLUSH_BYTES byte stimati.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.inspection import inspect
+
+from backend.db.models import Pattern, Statistic, EquitySeries, EquityBlob
+from backend.services.bulk_writer import BulkWriter
+from backend.services.equity_codec import blob_row, curve_arrays, decode_equity
+from backend.services.metrics_batch import batch_drawdowns, NAT
+from backend.services import compute_metrics as metrics
+
+# da incrementare quando cambia il calcolo delle metriche: invalida gli hash
+#   2 – drawdown in batch: recovery_days, drawdown_start/end, extra_json dd_*
+#   3 – una sola definizione delle metriche (metrics_batch), NaN salvati come NULL
+METRICS_VERSION = 3
+
+# limite parametri per IN (...) – sicuro anche su SQLite
+_IN_CHUNK = 900
+
+# soglie di flush di PatternSink (la prima raggiunta scarica il buffer)
+FLUSH_ROWS  = int(os.getenv("PATTERN_FLUSH_ROWS", 2000))
+FLUSH_BYTES = int(os.getenv("PATTERN_FLUSH_BYTES", 64 * 1024 * 1024))
+
+# stima per pattern in buffer: params/stats/tupla + 16 byte per punto di equity
+_ITEM_BYTES  = 2048
+_POINT_BYTES = 16
+
+
+# ── Chiavi ─────────────────────────────────────────────────────────────────────
+def canonical_params(params: dict) -> str:
+    return json.dumps(params, sort_keys=True, separators=(',', ':'))
+
+
+def pattern_key(asset_id: int, pattern_type: str, params: dict, years_back: int) -> str:
+    raw = f"{asset_id}|{pattern_type}|{canonical_params(params)}|{years_back}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def inputs_hash(equity_series) -> str:
+    ts, val = curve_arrays(equity_series, drop_none=False)
+    h = hashlib.sha256(f"v{METRICS_VERSION}|".encode())
+    h.update(ts.tobytes())
+    h.update(val.tobytes())
+    return h.hexdigest()
+
+
+# ── Conversione righe ──────────────────────────────────────────────────────────
+def safe_value(val):
+    # NaN / NaT prima di .item(): np.float64('nan') diventerebbe un float nan
+    # e finirebbe come 'NaN' in JSON e nel COPY invece che NULL
+    if pd.api.types.is_scalar(val) and pd.isna(val):
+        return None
+    if isinstance(val, (np.generic,)):
+        return val.item()
+    if isinstance(val, pd.Timestamp):
+        return val.to_pydatetime()
+    return val
+
+
+def _ns_to_dt(ns):
+    return None if ns == NAT else pd.Timestamp(int(ns)).to_pydatetime()
+
+
+def drawdown_info(arrays) -> list[tuple[dict, object, object]]:
+    """
+    arrays: list[(timestamp ns, valori)] → per curva (dd_realized, inizio, fine),
+    con `dd_realized` nel formato di `Statistic.extra_json` e inizio/fine
+    come datetime (None se nessun drawdown).
+
+    I drawdown di tutte le curve sono calcolati in un solo passaggio su
+    array ragged (`batch_drawdowns`), senza Series pandas per curva.
+    """
+    if not arrays:
+        return []
+    lengths = np.fromiter((len(a[0]) for a in arrays), dtype=np.int64, count=len(arrays))
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    ts  = np.concatenate([a[0] for a in arrays]).astype(np.int64, copy=False)
+    val = np.concatenate([a[1] for a in arrays]).astype(np.float64, copy=False)
+    # un solo sort stabile per (curva, timestamp), di norma già ordinato
+    order = np.lexsort((ts, np.repeat(np.arange(len(arrays)), lengths)))
+    with metrics.stage("drawdown"):
+        dd = batch_drawdowns(val[order], ts[order], offsets)
+
+    out = []
+    for i in range(len(arrays)):
+        start, end = _ns_to_dt(dd["drawdown_start"][i]), _ns_to_dt(dd["drawdown_end"][i])
+        out.append(({
+            "max_drawdown_pct": float(dd["max_drawdown_pct"][i]),
+            "dd_duration_days": int(dd["dd_duration_days"][i]),
+            "recovery_days":    int(dd["recovery_days"][i]),
+            "recovered":        bool(dd["recovered_at"][i] != NAT),
+            "drawdown_start":   start.isoformat() if start else None,
+            "drawdown_end":     end.isoformat() if end else None,
+        }, start, end))
+    return out
+
+
+def statistic_rows(items) -> list[dict]:
+    """items: list[(pattern_id, stats, equity_series)] → righe `Statistic`."""
+    if not items:
+        return []
+    dds = drawdown_info([curve_arrays(eq, drop_none=False) for _, _, eq in items])
+
+    cols = {c.key for c in inspect(Statistic).mapper.column_attrs}
+    rows = []
+    for (pid, stats, _), (dd_realized, start, end) in zip(items, dds):
+        row = {
+            "max_drawdown_pct": dd_realized["max_drawdown_pct"],
+            **stats,
+            "drawdown_start": start,
+            "drawdown_end":   end,
+            "recovery_days":  dd_realized["recovery_days"],
+            "extra_json":     {"dd_realized": dd_realized, "dd_floating": dict(dd_realized)},
+        }
+        # filtra per colonne presenti in Statistic
+        rows.append({'pattern_id': pid,
+                     **{k: safe_value(v) for k, v in row.items() if k in cols and k != 'pattern_id'}})
+    return rows
+
+
+def _chunks(seq, n=_IN_CHUNK):
+    for i in range(0, len(seq), n):
+        yield seq[i:i + n]
+
+
+# ── Upsert ─────────────────────────────────────────────────────────────────────
+def existing_patterns(session, keys) -> dict:
+    """{pattern_key: (pattern_id, inputs_hash)} per le chiavi già salvate."""
+    found = {}
+    for chunk in _chunks(list(keys)):
+        found.update({
+            k: (pid, h)
+            for pid, k, h in session.query(Pattern.id, Pattern.pattern_key, Pattern.inputs_hash)
+                                    .filter(Pattern.pattern_key.in_(chunk))
+        })
+    return found
+
+
+def equity_arrays(session, pattern_ids) -> dict:
+    """
+    {pattern_id: (timestamp ns, valori)} per i pattern indicati: prima dagli
+    `EquityBlob`, poi dalle righe legacy di `EquitySeries` per i restanti.
+    Una query per tabella (a blocchi di _IN_CHUNK id), non una per pattern.
+    """
+    out = {}
+    for chunk in _chunks(list(pattern_ids)):
+        for pid, data in session.query(EquityBlob.pattern_id, EquityBlob.data) \
+                                .filter(EquityBlob.pattern_id.in_(chunk)):
+            out[pid] = decode_equity(data)
+        rest = [pid for pid in chunk if pid not in out]
+        if not rest:
+            continue
+        rows = session.query(EquitySeries.pattern_id, EquitySeries.timestamp, EquitySeries.equity_value) \
+                      .filter(EquitySeries.pattern_id.in_(rest)) \
+                      .order_by(EquitySeries.pattern_id, EquitySeries.timestamp).all()
+        if not rows:
+            continue
+        pid  = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+        ts   = pd.DatetimeIndex([r[1] for r in rows]).as_unit('ns').asi8
+        vals = np.fromiter((r[2] for r in rows), dtype=np.float64, count=len(rows))
+        cuts = np.flatnonzero(np.diff(pid)) + 1
+        for a, b in zip(np.r_[0, cuts], np.r_[cuts, len(pid)]):
+            out[int(pid[a])] = (ts[a:b], vals[a:b])
+    return out
+
+
+def upsert_patterns(session, asset_id, pattern_type, items, source="precomputed") -> dict:
+    """
+    items: list[(params, years_back, stats, equity_series)].
+
+    • chiave assente        → nuovo Pattern + Statistic + equity
+    • chiave con hash uguale → saltato
+    • chiave con hash nuovo  → Statistic ed equity riscritti, stesso Pattern.id
+
+    Non esegue commit. Ritorna {"inserted", "updated", "skipped"}.
+    """
+    rows = [
+        (pattern_key(asset_id, pattern_type, params, yb), inputs_hash(equity), params, yb, stats, equity)
+        for params, yb, stats, equity in items
+    ]
+    existing = existing_patterns(session, [r[0] for r in rows])
+
+    new, changed = [], []
+    for r in rows:
+        hit = existing.get(r[0])
+        if hit is None:
+            new.append(r)
+        elif hit[1] != r[1]:
+            changed.append((hit[0], r))
+
+    targets = []
+    writer  = BulkWriter.for_session(session)
+    with metrics.stage("flush"):
+        if changed:
+            ids = [pid for pid, _ in changed]
+            for chunk in _chunks(ids):
+                session.query(Statistic).filter(Statistic.pattern_id.in_(chunk)) \
+                       .delete(synchronize_session=False)
+                session.query(EquityBlob).filter(EquityBlob.pattern_id.in_(chunk)) \
+                       .delete(synchronize_session=False)
+                # righe legacy (pre-blob) ancora presenti
+                session.query(EquitySeries).filter(EquitySeries.pattern_id.in_(chunk)) \
+                       .delete(synchronize_session=False)
+            session.bulk_update_mappings(
+                Pattern, [{'id': pid, 'inputs_hash': r[1]} for pid, r in changed]
+            )
+            targets.extend(changed)
+
+        if new:
+            # id pre-allocati (PostgreSQL) o da un solo INSERT ... RETURNING
+            ids = writer.insert_with_ids(Pattern, [
+                {
+                    'asset_id':    asset_id,
+                    'type':        pattern_type,
+                    'params':      params,
+                    'years_back':  yb,
+                    'source':      source,
+                    'pattern_key': key,
+                    'inputs_hash': h,
+                }
+                for key, h, params, yb, _, _ in new
+            ])
+            targets.extend(zip(ids, new))
+
+    stat_rows = statistic_rows([(pid, stats, equity) for pid, (_, _, _, _, stats, equity) in targets])
+    blob_rows = [blob_row(pid, equity) for pid, (_, _, _, _, _, equity) in targets]
+    with metrics.stage("flush"):
+        writer.insert(Statistic, stat_rows)
+        writer.insert(EquityBlob, blob_rows)
+
+    result = {
+        "inserted": len(new),
+        "updated":  len(changed),
+        "skipped":  len(rows) - len(new) - len(changed),
+    }
+    metrics.patterns_written(result)
+    return result
+
+
+# ── Scrittura in streaming ─────────────────────────────────────────────────────
+class PatternSink:
+    """
+    Buffer di scrittura a soglia per un asset.
+
+    `add()` accoda un risultato e, se il buffer supera `max_rows` pattern o
+    `max_bytes` stimati, lo scarica subito: upsert + commit nello stesso
+    thread. Il motore che produce i risultati resta fermo finché il batch
+    non è scritto (backpressure), quindi in memoria c'è al più un buffer.
+
+        with PatternSink(session, asset.id) as sink:
+            for params, stats, equity in results:
+                sink.add(ptype, params, yb, stats, equity)
+        sink.totals   # {"inserted", "updated", "skipped"}
+    """
+
+    def __init__(self, session, asset_id, max_rows: int = FLUSH_ROWS,
+                 max_bytes: int = FLUSH_BYTES, commit: bool = True):
+        self.session   = session
+        self.asset_id  = asset_id
+        self.max_rows  = max_rows
+        self.max_bytes = max_bytes
+        self.commit    = commit
+        self.totals    = {"inserted": 0, "updated": 0, "skipped": 0}
+        self._buffer   = {}           # pattern_type → [(params, yb, stats, equity)]
+        self._rows     = 0
+        self._bytes    = 0
+
+    def add(self, pattern_type, params, years_back, stats, equity):
+        self._buffer.setdefault(pattern_type, []).append((params, years_back, stats, equity))
+        self._rows  += 1
+        self._bytes += _ITEM_BYTES + _POINT_BYTES * len(equity)
+        if self._rows >= self.max_rows or self._bytes >= self.max_bytes:
+            self.flush()
+
+    def flush(self) -> dict:
+        """Scrive il buffer (e fa commit se `commit`). Ritorna i conteggi del flush."""
+        buffer, self._buffer = self._buffer, {}
+        self._rows = self._bytes = 0
+        out = {"inserted": 0, "updated": 0, "skipped": 0}
+        for pattern_type, items in buffer.items():
+            with metrics.labels(pattern_type):
+                res = upsert_patterns(self.session, self.asset_id, pattern_type, items)
+            for k, n in res.items():
+                out[k] += n
+                self.totals[k] += n
+        if buffer and self.commit:
+            with metrics.stage("commit"):
+                self.session.commit()
+        return out
+
+    @property
+    def written(self) -> int:
+        return self.totals["inserted"] + self.totals["updated"]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+        else:
+            self._buffer, self._rows, self._bytes = {}, 0, 0
+        return False
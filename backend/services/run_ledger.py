@@ -0,0 +1,192 @@
+# backend/services/run_ledger.py
+from __future__ import annotations
+
+"""
+Ledger dei run di calcolo pattern (`compute_runs` / `compute_shards`).
+
+Ogni run registra i suoi shard (asset × tipi di pattern) con stato, tentativi,
+tempi, host e traceback dell'eventuale errore. Un run interrotto (crash,
+riavvio) o con shard falliti si riprende eseguendo solo gli shard non `done`:
+la scrittura dei pattern è idempotente (upsert per pattern_key), quindi
+ripetere uno shard rimasto a metà è sicuro. Un run ancora `running` si
+riprende solo se fermo da più di COMPUTE_RUN_STALE_SECONDS (default 6 h)
+dall'ultimo shard avviato o concluso, altrimenti è ancora in esecuzione.
+
+Le funzioni `shard_*` aprono una propria sessione: vengono chiamate dai
+processi worker (joblib o Celery).
+"""
+
+import os
+import socket
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from backend.db.session import SessionLocal
+from backend.db.models import ComputeRun, ComputeShard, ComputeWatermark
+
+UNFINISHED = ("pending", "running", "failed")
+
+# un run `running` senza shard avviati o conclusi da tanto è considerato morto
+RUN_STALE_AFTER = timedelta(seconds=int(os.getenv("COMPUTE_RUN_STALE_SECONDS", 6 * 3600)))
+
+
+_tables_ready = set()     # database (url) già verificati da questo processo
+
+
+def ensure_tables(session):
+    """
+    Crea su un database esistente le tabelle del ledger e dei watermark, se
+    mancano (una verifica per database e processo).
+    """
+    bind = session.get_bind()
+    url  = str(bind.url)
+    if url in _tables_ready:
+        return
+    for model in (ComputeRun, ComputeShard, ComputeWatermark):
+        model.__table__.create(bind, checkfirst=True)
+    _tables_ready.add(url)
+
+
+def _types_str(pattern_types) -> str:
+    return ",".join(pattern_types)
+
+
+def shard_types(shard: ComputeShard) -> tuple:
+    return tuple(shard.pattern_types.split(","))
+
+
+# ── Run ────────────────────────────────────────────────────────────────────────
+def create_run(session, kind: str, mode: str, shards) -> ComputeRun:
+    """shards: sequenza di (asset_id, pattern_types). Esegue commit."""
+    run = ComputeRun(kind=kind, mode=mode, status="running", n_shards=len(shards))
+    session.add(run)
+    session.flush()
+    session.add_all([
+        ComputeShard(run_id=run.id, asset_id=asset_id, pattern_types=_types_str(types))
+        for asset_id, types in shards
+    ])
+    session.commit()
+    return run
+
+
+def last_activity(session, run: ComputeRun) -> datetime:
+    """Heartbeat del run: ultimo avvio o chiusura di uno shard (o l'avvio del run)."""
+    started, finished = session.query(func.max(ComputeShard.started_at),
+                                      func.max(ComputeShard.finished_at)) \
+                               .filter(ComputeShard.run_id == run.id).one()
+    return max(t for t in (run.started_at, started, finished) if t is not None)
+
+
+def is_stale(session, run: ComputeRun, stale_after: timedelta = RUN_STALE_AFTER) -> bool:
+    return datetime.utcnow() - last_activity(session, run) > stale_after
+
+
+def active_run(session, kind: str | None = None, mode: str | None = None,
+               stale_after: timedelta = RUN_STALE_AFTER) -> ComputeRun | None:
+    """Run `running` ancora vivo (heartbeat più recente di `stale_after`), se c'è."""
+    q = session.query(ComputeRun).filter(ComputeRun.status == "running")
+    if kind is not None:
+        q = q.filter(ComputeRun.kind == kind)
+    if mode is not None:
+        q = q.filter(ComputeRun.mode == mode)
+    for run in q.order_by(ComputeRun.id.desc()):
+        if not is_stale(session, run, stale_after):
+            return run
+    return None
+
+
+def resumable_run(session, kind: str, mode: str,
+                  stale_after: timedelta = RUN_STALE_AFTER) -> ComputeRun | None:
+    """
+    Ultimo run dello stesso tipo da riprendere: `failed`, oppure `running` ma
+    fermo da più di `stale_after` (processo interrotto). Un run `running`
+    ancora vivo non è riprendibile: i suoi shard verrebbero eseguiti due volte.
+    """
+    for run in (
+        session.query(ComputeRun)
+               .filter(ComputeRun.kind == kind, ComputeRun.mode == mode,
+                       ComputeRun.status.in_(("running", "failed")))
+               .order_by(ComputeRun.id.desc())
+    ):
+        if run.status == "failed" or is_stale(session, run, stale_after):
+            return run
+    return None
+
+
+def unfinished_shards(session, run_id: int, only_failed: bool = False, shard_ids=None) -> list:
+    q = session.query(ComputeShard).filter(ComputeShard.run_id == run_id)
+    q = q.filter(ComputeShard.status == "failed") if only_failed \
+        else q.filter(ComputeShard.status.in_(UNFINISHED))
+    if shard_ids:
+        q = q.filter(ComputeShard.id.in_(list(shard_ids)))
+    return q.order_by(ComputeShard.id).all()
+
+
+def reopen_run(session, run_id: int):
+    run = session.get(ComputeRun, run_id)
+    run.status, run.finished_at = "running", None
+    session.commit()
+
+
+def finish_run(run_id: int) -> dict:
+    """Chiude il run: `done` se tutti gli shard sono `done`, altrimenti `failed`."""
+    session = SessionLocal()
+    try:
+        run = session.get(ComputeRun, run_id)
+        counts = {}
+        for shard in run.shards:
+            counts[shard.status] = counts.get(shard.status, 0) + 1
+        run.status = "done" if counts.get("done", 0) == run.n_shards else "failed"
+        run.finished_at = datetime.utcnow()
+        session.commit()
+        return {'run_id': run_id, 'status': run.status, **counts}
+    finally:
+        session.close()
+
+
+# ── Shard ──────────────────────────────────────────────────────────────────────
+def shard_started(shard_id: int) -> tuple[int, tuple]:
+    """Segna lo shard `running` (+1 tentativo). Ritorna (asset_id, pattern_types)."""
+    session = SessionLocal()
+    try:
+        shard = session.get(ComputeShard, shard_id)
+        shard.status      = "running"
+        shard.attempts   += 1
+        shard.host        = socket.gethostname()
+        shard.error       = None
+        shard.started_at  = datetime.utcnow()
+        shard.finished_at = None
+        session.commit()
+        return shard.asset_id, shard_types(shard)
+    finally:
+        session.close()
+
+
+def shard_finished(shard_id: int, saved: int | None = None, seconds: float | None = None,
+                   error: str | None = None):
+    session = SessionLocal()
+    try:
+        shard = session.get(ComputeShard, shard_id)
+        shard.status      = "failed" if error else "done"
+        shard.saved       = saved
+        shard.seconds     = seconds
+        shard.error       = error
+        shard.finished_at = datetime.utcnow()
+        session.commit()
+    finally:
+        session.close()
+
+
+def run_summary(session, limit: int = 10) -> list[dict]:
+    """Ultimi run con conteggi per stato (per la CLI)."""
+    out = []
+    for run in session.query(ComputeRun).order_by(ComputeRun.id.desc()).limit(limit):
+        counts = {}
+        for shard in run.shards:
+            counts[shard.status] = counts.get(shard.status, 0) + 1
+        out.append({
+            'id': run.id, 'kind': run.kind, 'mode': run.mode, 'status': run.status,
+            'started_at': run.started_at, 'finished_at': run.finished_at, **counts,
+        })
+    return out
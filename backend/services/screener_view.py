@@ -0,0 +1,173 @@
+# backend/services/screener_view.py
+from __future__ import annotations
+
+"""
+Read model del screener (`screener_rows`).
+
+Una riga larga per pattern con asset (simbolo, gruppo), tipo, years_back,
+i params come colonne intere (start_month … window_days), tutte le metriche
+di `Statistic` e i drawdown realizzato / flottante di `extra_json`. Il
+screener filtra e ordina solo su questa tabella, con indici compositi sulle
+combinazioni usate (vedi `ScreenerRow.__table_args__`).
+
+Refresh per asset: le righe dell'asset vengono cancellate e reinserite
+(BulkWriter: COPY su PostgreSQL) nella stessa transazione, quindi chi legge
+vede sempre un asset completo. A fine run (`refresh_after_run`) si
+rigenerano solo gli asset degli shard che hanno scritto qualcosa; a
+tabella vuota si ricostruisce tutto.
+
+    python -m backend.services.screener_view [--asset ID ...]
+"""
+
+import argparse
+from datetime import datetime
+
+from sqlalchemy import or_
+
+from backend.db.session import SessionLocal
+from backend.db.models import Asset, Pattern, Statistic, ScreenerRow, ComputeShard
+from backend.services.bulk_writer import BulkWriter
+from backend.services.pattern_store import equity_arrays, drawdown_info
+
+# params dei pattern con una colonna tipizzata in screener_rows
+PARAM_COLUMNS = (
+    'start_month', 'start_day', 'end_month', 'end_day',
+    'start_hour', 'end_hour', 'window_days',
+)
+
+METRIC_COLUMNS = (
+    'gross_profit_pct', 'gross_loss_pct', 'net_return_pct', 'win_rate',
+    'profit_factor', 'expectancy', 'max_drawdown_pct', 'recovery_days',
+    'sharpe_ratio', 'sortino_ratio', 'annual_volatility_pct', 'num_trades',
+    'avg_trade_pct', 'max_consec_wins', 'max_consec_losses',
+)
+
+
+def _int_param(params: dict, key: str):
+    val = params.get(key)
+    try:
+        return int(val) if val is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def screener_row(pattern_id, asset_id, symbol, group, ptype, years_back, params,
+                 metrics: dict, extra_json, now: datetime) -> dict:
+    params = params or {}
+    ej = extra_json or {}
+    dr = ej.get("dd_realized") or {}
+    df = ej.get("dd_floating") or {}
+    return {
+        'pattern_id':   pattern_id,
+        'asset_id':     asset_id,
+        'asset_symbol': symbol,
+        'asset_group':  group,
+        'pattern_type': ptype,
+        'years_back':   years_back,
+        'params':       params,
+        **{k: _int_param(params, k) for k in PARAM_COLUMNS},
+        **metrics,
+        'realized_max_drawdown_pct': dr.get("max_drawdown_pct"),
+        'realized_dd_duration_days': dr.get("dd_duration_days"),
+        'floating_max_drawdown_pct': df.get("max_drawdown_pct"),
+        'floating_dd_duration_days': df.get("dd_duration_days"),
+        'refreshed_at': now,
+    }
+
+
+def ensure_table(session):
+    ScreenerRow.__table__.create(session.get_bind(), checkfirst=True)
+
+
+def _asset_rows(session, asset_id: int, now: datetime) -> list[dict]:
+    stat_cols = [getattr(Statistic, c) for c in METRIC_COLUMNS]
+    q = (
+        session.query(Pattern.id, Pattern.asset_id, Asset.symbol, Asset.group, Pattern.type,
+                      Pattern.years_back, Pattern.params, Statistic.extra_json, *stat_cols)
+               .join(Asset, Pattern.asset_id == Asset.id)
+               .join(Statistic, Statistic.pattern_id == Pattern.id)
+               .filter(Pattern.asset_id == asset_id)
+    )
+    rows = []
+    for r in q:
+        metrics = dict(zip(METRIC_COLUMNS, r[8:]))
+        rows.append(screener_row(*r[:7], metrics, r[7], now))
+    return rows
+
+
+def fallback_drawdowns(session, pattern_ids) -> dict:
+    """
+    {pattern_id: dd_realized} ricalcolati dall'equity salvata, per le righe
+    senza drawdown persistito: equity di tutta la pagina in una sola lettura
+    (`equity_arrays`) e drawdown vettoriali (`drawdown_info`).
+    """
+    curves = equity_arrays(session, pattern_ids)
+    ids = [pid for pid in pattern_ids if pid in curves]
+    return {pid: dd for pid, (dd, _, _) in zip(ids, drawdown_info([curves[pid] for pid in ids]))}
+
+
+# ── Refresh ────────────────────────────────────────────────────────────────────
+def refresh_screener(session, asset_ids=None) -> int:
+    """
+    Rigenera le righe degli asset indicati (tutti se None), un commit per
+    asset. Senza `asset_ids` elimina anche le righe di asset non più presenti.
+    Ritorna il numero di righe scritte.
+    """
+    if asset_ids is None:
+        asset_ids = [a for (a,) in session.query(Asset.id).order_by(Asset.id)]
+        session.query(ScreenerRow).filter(ScreenerRow.asset_id.notin_(asset_ids)) \
+               .delete(synchronize_session=False)
+
+    writer  = BulkWriter.for_session(session)
+    written = 0
+    for asset_id in asset_ids:
+        rows = _asset_rows(session, asset_id, datetime.utcnow())
+        session.query(ScreenerRow).filter(ScreenerRow.asset_id == asset_id) \
+               .delete(synchronize_session=False)
+        writer.insert(ScreenerRow, rows)
+        session.commit()
+        written += len(rows)
+    return written
+
+
+def run_assets(session, run_id: int) -> list[int]:
+    """Asset degli shard del run che possono aver scritto pattern (saved > 0 o falliti a metà)."""
+    q = (
+        session.query(ComputeShard.asset_id)
+               .filter(ComputeShard.run_id == run_id)
+               .filter(or_(ComputeShard.saved > 0, ComputeShard.status == "failed"))
+               .distinct()
+    )
+    return sorted(a for (a,) in q)
+
+
+def refresh_after_run(run_id: int | None = None) -> int:
+    """
+    Passo finale di un run di calcolo: aggiorna il read model per gli asset
+    toccati dal run (tutti se `run_id` è None o la tabella è ancora vuota).
+    """
+    session = SessionLocal()
+    try:
+        ensure_table(session)
+        asset_ids = None
+        if run_id is not None and session.query(ScreenerRow.pattern_id).first() is not None:
+            asset_ids = run_assets(session, run_id)
+        written = refresh_screener(session, asset_ids)
+        scope = "tutti gli asset" if asset_ids is None else f"{len(asset_ids)} asset"
+        print(f"🔎 Screener aggiornato: {written} righe ({scope})")
+        return written
+    finally:
+        session.close()
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description="Rigenera il read model del screener")
+    ap.add_argument('--asset', type=int, action='append', help="id asset (default: tutti)")
+    args = ap.parse_args()
+    session = SessionLocal()
+    try:
+        ensure_table(session)
+        n = refresh_screener(session, args.asset)
+        print(f"✅ Screener: {n} righe")
+    finally:
+        session.close()
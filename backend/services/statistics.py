@@ -2,15 +2,21 @@
 from __future__ import annotations
 
 """
-Estrazione pattern e calcolo metriche unificate (trade-stats, ratio annualizzati,
-draw-down realized / floating) tramite `full_metrics`.
+Estrazione pattern e calcolo metriche (trade-stats, ratio annualizzati,
+max drawdown). Motore per-definizione e motori batch usano la stessa
+definizione delle metriche: il kernel `batch_metrics` (services/metrics_batch),
+chiamato su una curva sola o su tutte le definizioni insieme.
 """
 
 import numpy as np
 import pandas as pd
 from datetime import timedelta          # usato da chi importa questo modulo
 
-from .metrics_core import full_metrics  # unico entry-point “all-in-one”
+from .metrics_batch import batch_metrics  # unica definizione delle metriche
+from . import compute_metrics as metrics
+from .equity_codec import EquityCurve
+from .trading_calendar import TradingCalendar
+from .history_store import HistoryArrays
 
 # --------------------------------------------------------------------------- #
 # Mapping timeframe MT5 → freq pandas                                         #
@@ -20,17 +26,6 @@ TF_FREQ = {
     "D1": "1D", "W1": "1W", "MN1": "1M",
 }
 
-# --------------------------------------------------------------------------- #
-# Helper per date valide (non-trading)                                        #
-# --------------------------------------------------------------------------- #
-def _next_valid_date(dt: pd.Timestamp, idx: pd.DatetimeIndex) -> pd.Timestamp | None:
-    pos = idx.get_indexer([dt], method="bfill")[0]
-    return None if pos == -1 else idx[pos]
-
-def _prev_valid_date(dt: pd.Timestamp, idx: pd.DatetimeIndex) -> pd.Timestamp | None:
-    pos = idx.get_indexer([dt], method="ffill")[0]
-    return None if pos == -1 else idx[pos]
-
 # --------------------------------------------------------------------------- #
 # Funzione core                                                               #
 # --------------------------------------------------------------------------- #
@@ -39,10 +34,16 @@ def get_pattern_statistics(
     pattern_type: str,
     params: dict,
     years_back: int,
+    calendar: TradingCalendar | None = None,
 ):
     """
     Calcola equity-curve e statistiche per pattern **intraday / monthly / annual**.
 
+    `calendar` è il calendario di trading dell'intero `df`: chi calcola molte
+    definizioni sullo stesso storico lo costruisce una volta
+    (`TradingCalendar(df["timestamp"])`) invece di riordinare le barre a ogni
+    chiamata. Senza, viene costruito sulla finestra `years_back`.
+
     Ritorna:
         stats  – dict JSON-ready (percentuali già in %)
         equity – list[{"timestamp": ts, "value": equity}] (equity a fine-trade)
@@ -56,7 +57,8 @@ def get_pattern_statistics(
     data  = df[(df["timestamp"] >= start) & (df["timestamp"] <= end)].copy()
     data.set_index("timestamp", inplace=True)
 
-    valid_idx: pd.DatetimeIndex        = data.index
+    if calendar is None and pattern_type in ("monthly", "annual"):
+        calendar = TradingCalendar(data.index)
     returns: list[float]               = []
     timestamps: list[pd.Timestamp]     = []
 
@@ -102,8 +104,9 @@ def get_pattern_statistics(
                 if sd > last_day or win_end > last_day:
                     continue
                 rs, re = pd.Timestamp(yr, mo, sd), pd.Timestamp(yr, mo, win_end)
-                sdt = _next_valid_date(rs, valid_idx)
-                edt = _prev_valid_date(re, valid_idx)
+                # il calendario può coprire tutto `df`: entry dentro la finestra
+                sdt = calendar.next_valid(max(rs, start))
+                edt = calendar.prev_valid(re)
                 if sdt and edt and sdt < edt:
                     r = (data["close"].loc[edt] - data["close"].loc[sdt]) / data["close"].loc[sdt]
                     returns.append(r)
@@ -120,8 +123,8 @@ def get_pattern_statistics(
                 rs, re = pd.Timestamp(yr, sm, sd), pd.Timestamp(yr, em, ed)
             except ValueError:
                 continue
-            sdt = _next_valid_date(rs, valid_idx)
-            edt = _prev_valid_date(re, valid_idx)
+            sdt = calendar.next_valid(max(rs, start))
+            edt = calendar.prev_valid(re)
             if sdt and edt and sdt < edt:
                 r = (data["close"].loc[edt] - data["close"].loc[sdt]) / data["close"].loc[sdt]
                 returns.append(r)
@@ -129,24 +132,339 @@ def get_pattern_statistics(
     else:
         raise ValueError(f"Unknown pattern_type {pattern_type!r}")
 
-    # ---------------- equity curve ---------------------------------------- #
-    equity = [1.0]
-    for r in returns:
-        equity.append(equity[-1] * (1 + r))
+    return _equity_and_stats(returns, timestamps, years_back)
+
 
-    equity_series = [
+# --------------------------------------------------------------------------- #
+# Equity-curve + metriche (condiviso fra motore singolo e motori batch)       #
+# --------------------------------------------------------------------------- #
+def _equity_series(rets: np.ndarray, timestamps) -> list[dict]:
+    equity = np.cumprod(1.0 + rets)
+    return [
         {"timestamp": ts, "value": eq}
-        for ts, eq in zip(timestamps, equity[1:])
+        for ts, eq in zip(timestamps, equity.tolist())
     ]
 
-    # ---------------- metriche unificate ---------------------------------- #
-    if not returns:
+
+def _equity_and_stats(returns, timestamps, years_back: int):
+    rets          = np.asarray(returns, dtype=float)
+    equity_series = _equity_series(rets, timestamps)
+
+    # ---------------- metriche (stesso kernel dei motori batch) ----------- #
+    if not len(rets):
         return {}, equity_series
 
-    stats = full_metrics(
-        trade_returns = np.asarray(returns, dtype=float),
-        equity_series = equity_series,
-        years_back    = max(1, years_back),
+    cols  = batch_metrics(rets, np.array([0, len(rets)]), years_back)
+    stats = {name: col[0] for name, col in cols.items()}
+    return stats, equity_series
+
+
+# --------------------------------------------------------------------------- #
+# Motori batch: tutte le definizioni di un tipo in un'unica passata           #
+# --------------------------------------------------------------------------- #
+def _history_arrays(df) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Converte lo storico in due array allineati e ordinati:
+    timestamp (int64 ns, naive) e close (float64).
+    Accetta un DataFrame o un `HistoryArrays` memory-mapped (usato as-is).
+    """
+    if isinstance(df, HistoryArrays):
+        return df.timestamp, df.close
+
+    ts    = pd.to_datetime(df["timestamp"], errors="coerce")
+    keep  = ts.notna().to_numpy()
+    ts_ns = ts.to_numpy(dtype="datetime64[ns]")[keep].view("int64")
+    close = df["close"].to_numpy(dtype=float)[keep]
+
+    order = np.argsort(ts_ns, kind="stable")
+    return ts_ns[order], close[order]
+
+
+def _lookback_start(ts_ns: np.ndarray, years_back: int) -> int:
+    """Posizione della prima barra dentro la finestra `years_back`."""
+    end   = pd.Timestamp(ts_ns[-1])
+    start = end - pd.DateOffset(years=years_back)
+    return int(np.searchsorted(ts_ns, start.value, side="left"))
+
+
+def _trade_returns(ok, ps, pe, close):
+    """Rendimento (exit - entry) / entry per ogni cella valida della matrice."""
+    c_in  = close[np.where(ok, ps, 0)]
+    c_out = close[np.where(ok, pe, 0)]
+    return (c_out - c_in) / c_in
+
+
+def _collect_trades(ok, rets, exit_ns, defs, years_back):
+    """
+    Da matrici (trade × definizione) di rendimenti e timestamp di uscita a
+    lista [(params, stats, equity)] nello stesso ordine di `defs`.
+    Le metriche di tutte le definizioni escono da un'unica chiamata al
+    kernel batch.
+    """
+    # colonne della matrice → array ragged (values + offsets), in ordine di def
+    values  = rets.T[ok.T]
+    exits   = exit_ns.T[ok.T]
+    offsets = np.zeros(len(defs) + 1, dtype=np.int64)
+    np.cumsum(ok.sum(axis=0), out=offsets[1:])
+    with metrics.stage("metrics"):
+        cols = batch_metrics(values, offsets, years_back)
+
+    results = []
+    with metrics.stage("equity"):
+        for j, params in enumerate(defs):
+            a, b = offsets[j], offsets[j + 1]
+            if a == b:
+                results.append((params, {}, []))
+                continue
+            stats  = {name: col[j] for name, col in cols.items()}
+            equity = EquityCurve(exits[a:b], np.cumprod(1.0 + values[a:b]))
+            results.append((params, stats, equity))
+    return results
+
+
+def _lookback_suffix(ok, ps, pe, rets, r0: int, p0: int, close):
+    """
+    Vista dei trade estratti al lookback massimo ristretta a un lookback più
+    corto che inizia alla barra `p0` (riga `r0` della matrice).
+
+    Le righe precedenti `r0` escono per intero; sulle righe di confine le
+    entry anteriori a `p0` vengono agganciate a `p0`, come farebbe
+    l'estrazione su uno storico tagliato.
+    """
+    ok, ps, pe, rets = ok[r0:], ps[r0:], pe[r0:], rets[r0:]
+    cut = ok & (ps < p0)
+    if cut.any():
+        ps   = np.where(cut, p0, ps)
+        rets = rets.copy()
+        rets[cut] = (close[pe[cut]] - close[p0]) / close[p0]
+    return ok & (pe >= p0) & (ps < pe), rets
+
+
+def _years_range(ts_ns: np.ndarray, p_min: int) -> np.ndarray:
+    return np.arange(pd.Timestamp(ts_ns[p_min]).year, pd.Timestamp(ts_ns[-1]).year + 1)
+
+
+def _empty_results(defs, years_options):
+    for yb in years_options:
+        yield yb, [(p, {}, []) for p in defs]
+
+
+def batch_annual_statistics(df: pd.DataFrame, defs: list[dict], years_options: list[int]):
+    """
+    Equivalente vettoriale di `get_pattern_statistics(df, "annual", p, yb)`
+    per ogni `p` in `defs` e ogni `yb` in `years_options`.
+
+    Costruisce una sola volta la griglia anno × giorno dell'anno con le barre
+    valide successive/precedenti e ricava i trade di tutte le combinazioni
+    (start_month, start_day, end_month, end_day) con indicizzazione di array.
+    I trade sono estratti una volta al lookback più lungo; i lookback più
+    corti ne sono viste in coda.
+
+    Generatore di (yb, list[(params, stats, equity)]), un lookback alla
+    volta nell'ordine di `years_options`, liste nello stesso ordine di `defs`:
+    il chiamante scrive un lookback prima che venga calcolato il successivo.
+    """
+    ts_ns, close = _history_arrays(df)
+    if not len(ts_ns) or not defs:
+        yield from _empty_results(defs, years_options)
+        return
+
+    starts = {yb: _lookback_start(ts_ns, yb) for yb in years_options}
+    p_min  = min(starts.values())
+    years  = _years_range(ts_ns, p_min)
+    valid, nxt, prv = TradingCalendar(ts_ns).day_grid(years)
+
+    cols = {
+        k: np.array([p[k] for p in defs], dtype=int)
+        for k in ("start_month", "start_day", "end_month", "end_day")
+    }
+    # parametri fuori range → nessun trade (come il ValueError di pd.Timestamp)
+    in_range = np.ones(len(defs), dtype=bool)
+    for k, hi in (("start_month", 12), ("start_day", 31), ("end_month", 12), ("end_day", 31)):
+        in_range &= (cols[k] >= 1) & (cols[k] <= hi)
+        cols[k] = np.clip(cols[k], 1, hi) - 1
+
+    sm, sd, em, ed = (cols[k] for k in ("start_month", "start_day", "end_month", "end_day"))
+    ps = np.maximum(nxt[:, sm, sd], p_min)
+    pe = prv[:, em, ed]
+    ok = (
+        valid[:, sm, sd] & valid[:, em, ed] & in_range
+        & (pe >= p_min) & (ps < pe)
     )
+    rets    = _trade_returns(ok, ps, pe, close)
+    exit_ns = ts_ns[np.where(ok, pe, 0)]
 
-    return stats, equity_series
+    for yb, p0 in starts.items():
+        r0 = pd.Timestamp(ts_ns[p0]).year - years[0]
+        ok_yb, rets_yb = _lookback_suffix(ok, ps, pe, rets, r0, p0, close)
+        yield yb, _collect_trades(ok_yb, rets_yb, exit_ns[r0:], defs, yb)
+
+
+def batch_monthly_statistics(df: pd.DataFrame, defs: list[dict], years_options: list[int]):
+    """
+    Equivalente vettoriale di `get_pattern_statistics(df, "monthly", p, yb)`
+    per ogni `p` in `defs` e ogni `yb` in `years_options`.
+
+    Le close giornaliere sono mappate una sola volta sulla griglia
+    (anno, mese, giorno) con le barre valide successive/precedenti; i trade
+    di tutte le coppie (start_day, window_days) si ottengono con un'unica
+    indicizzazione (anno × mese) × definizione, al lookback più lungo.
+
+    Generatore di (yb, list[(params, stats, equity)]) come
+    `batch_annual_statistics`.
+    """
+    ts_ns, close = _history_arrays(df)
+    if not len(ts_ns) or not defs:
+        yield from _empty_results(defs, years_options)
+        return
+
+    sd = np.array([p["start_day"] for p in defs], dtype=int)
+    wd = np.array([p["window_days"] for p in defs], dtype=int)
+    we = sd + wd - 1
+    in_range = (sd >= 1) & (sd <= 31) & (wd >= 1) & (we <= 31)
+    sd_i = np.clip(sd, 1, 31) - 1
+    we_i = np.clip(we, 1, 31) - 1
+
+    starts = {yb: _lookback_start(ts_ns, yb) for yb in years_options}
+    p_min  = min(starts.values())
+    years  = _years_range(ts_ns, p_min)
+    valid, nxt, prv = TradingCalendar(ts_ns).day_grid(years)
+
+    # (anno, mese, def) → righe cronologiche anno×mese
+    n_rows = len(years) * 12
+    ps = np.maximum(nxt[:, :, sd_i], p_min).reshape(n_rows, -1)
+    pe = prv[:, :, we_i].reshape(n_rows, -1)
+    ok = (
+        valid[:, :, we_i].reshape(n_rows, -1) & in_range
+        & (pe >= p_min) & (ps < pe)
+    )
+    rets    = _trade_returns(ok, ps, pe, close)
+    exit_ns = ts_ns[np.where(ok, pe, 0)]
+
+    for yb, p0 in starts.items():
+        first = pd.Timestamp(ts_ns[p0])
+        r0 = (first.year - years[0]) * 12 + first.month - 1
+        ok_yb, rets_yb = _lookback_suffix(ok, ps, pe, rets, r0, p0, close)
+        yield yb, _collect_trades(ok_yb, rets_yb, exit_ns[r0:], defs, yb)
+
+
+_HOUR_NS = 3_600_000_000_000
+
+
+def _hour_matrix(ts_ns: np.ndarray, close: np.ndarray):
+    """
+    Pivot delle close H1 in una matrice giorno × ora (24 colonne), con la
+    stessa semantica di `resample("1h").last().ffill()`.
+
+    Ritorna (matrix, day0, hour_bins) dove `day0` è il giorno (epoch) della
+    prima riga e `hour_bins` l'ora (epoch) di ciascuna barra di `ts_ns`.
+    """
+    hour_bins = ts_ns // _HOUR_NS
+    finite    = np.isfinite(close)
+    hb, cl    = hour_bins[finite], close[finite]
+    last      = np.r_[hb[1:] != hb[:-1], True]       # ultima barra di ogni ora
+    hb, cl    = hb[last], cl[last]
+
+    day0   = hb[0] // 24
+    n_days = hb[-1] // 24 - day0 + 1
+    hours  = day0 * 24 + np.arange(n_days * 24)
+
+    pos    = np.searchsorted(hb, hours, side="right") - 1   # forward-fill
+    matrix = np.where(
+        (hours >= hb[0]) & (hours <= hb[-1]), cl[np.maximum(pos, 0)], np.nan
+    )
+    return matrix.reshape(n_days, 24), day0, hour_bins
+
+
+def batch_intraday_statistics(df: pd.DataFrame, defs: list[dict], years_options: list[int]):
+    """
+    Equivalente vettoriale di `get_pattern_statistics(df, "intraday", p, yb)`
+    per ogni `p` in `defs` e ogni `yb` in `years_options`.
+
+    Le close H1 vengono pivotate una sola volta in una matrice giorno × ora;
+    i trade di ogni finestra start_hour → end_hour si ricavano per slicing
+    delle colonne. Ogni lookback è una vista in coda dei giorni, in cui solo
+    il primo giorno (parziale) viene ricalcolato. Le definizioni con
+    timeframe diverso da H1 passano dal motore per-definizione.
+
+    Generatore di (yb, list[(params, stats, equity)]) come
+    `batch_annual_statistics`.
+    """
+    ts_ns, close = _history_arrays(df)
+    if not len(ts_ns) or not np.isfinite(close).any():
+        yield from _empty_results(defs, years_options)
+        return
+
+    h1_defs, other_defs, empty_defs = [], [], []
+    for j, p in enumerate(defs):
+        tf = p.get("tf")
+        if TF_FREQ.get(tf) is None:
+            raise ValueError(f"Timeframe non riconosciuto: {tf!r}")
+        sh, eh = p.get("start_hour"), p.get("end_hour")
+        if (
+            sh is None or eh is None
+            or not (0 <= sh <= 23)
+            or not (1 <= eh <= 24)
+            or eh < sh
+        ):
+            empty_defs.append(j)
+        elif tf != "H1":
+            other_defs.append(j)
+        else:
+            h1_defs.append(j)
+
+    frame = None
+    if other_defs:
+        frame = df.to_frame() if isinstance(df, HistoryArrays) else df
+
+    if h1_defs:
+        matrix, day0, hour_bins = _hour_matrix(ts_ns, close)
+        n_days = matrix.shape[0]
+        rows   = np.arange(n_days)[:, None]
+
+        sh = np.array([defs[j]["start_hour"] for j in h1_defs])
+        eh = np.minimum([defs[j]["end_hour"] for j in h1_defs], 23)
+        # l'ultimo giorno si ferma all'ora dell'ultima barra
+        hi = np.full(n_days, 23)
+        hi[-1] = hour_bins[-1] % 24
+        first = np.broadcast_to(sh, (n_days, len(h1_defs)))   # (giorni, def)
+        last  = np.minimum(eh[None, :], hi[:, None])
+        ok    = last > first
+
+        c_in    = matrix[rows, np.where(ok, first, 0)]
+        c_out   = matrix[rows, np.where(ok, last, 0)]
+        rets    = (c_out - c_in) / c_in
+        exit_ns = ((day0 + rows) * 24 + last) * _HOUR_NS
+        sub_defs = [defs[j] for j in h1_defs]
+
+    for yb in years_options:
+        results = {j: (defs[j], {}, []) for j in empty_defs}
+        for j in other_defs:
+            results[j] = (defs[j], *get_pattern_statistics(frame, "intraday", defs[j], yb))
+
+        if h1_defs:
+            # finestra years_back: la griglia parte dall'ora della prima barra utile
+            g0 = hour_bins[_lookback_start(ts_ns, yb)]
+            r0 = g0 // 24 - day0
+            ok_yb, rets_yb = ok[r0:], rets[r0:]
+
+            lo = g0 % 24
+            if lo:
+                f0 = np.maximum(sh, lo)
+                ok_yb, rets_yb = ok_yb.copy(), rets_yb.copy()
+                ok_yb[0]   = last[r0] > f0
+                c0         = matrix[r0, np.where(ok_yb[0], f0, 0)]
+                rets_yb[0] = (c_out[r0] - c0) / c0
+
+            sub = _collect_trades(ok_yb, rets_yb, exit_ns[r0:], sub_defs, yb)
+            results.update(zip(h1_defs, sub))
+
+        yield yb, [results[j] for j in range(len(defs))]
+
+
+# motori batch disponibili per tipo di pattern
+BATCH_ENGINES = {
+    "intraday": batch_intraday_statistics,
+    "monthly":  batch_monthly_statistics,
+    "annual":   batch_annual_statistics,
+}
@@ -0,0 +1,115 @@
+# backend/services/trading_calendar.py
+from __future__ import annotations
+
+"""
+Calendario di trading per asset, costruito una volta dallo storico caricato.
+
+Sostituisce le chiamate `idx.get_indexer([dt], method=...)` ripetute per
+ogni anno/pattern con:
+  • una tabella giorno (epoch) → prima barra >= / ultima barra <= mezzanotte,
+    con lookup O(1) per le date di calendario;
+  • un'API batch basata su `searchsorted` per timestamp arbitrari.
+
+Le posizioni fanno riferimento all'array ordinato dei timestamp delle barre;
+`next` vale `len(cal)` e `prev` vale -1 quando la barra non esiste.
+"""
+
+import numpy as np
+import pandas as pd
+
+DAY_NS = 86_400_000_000_000
+
+
+class TradingCalendar:
+    def __init__(self, timestamps):
+        idx = pd.DatetimeIndex(timestamps)
+        if idx.tz is not None:
+            idx = idx.tz_localize(None)
+        ts_ns = idx.as_unit("ns").asi8
+        if len(ts_ns) > 1 and (np.diff(ts_ns) < 0).any():
+            ts_ns = np.sort(ts_ns, kind="stable")
+        self.ts_ns = ts_ns
+
+        if len(ts_ns):
+            self.day0 = int(ts_ns[0] // DAY_NS)
+            days = (self.day0 + np.arange(int(ts_ns[-1] // DAY_NS) - self.day0 + 2)) * DAY_NS
+        else:
+            self.day0 = 0
+            days = np.zeros(1, dtype=np.int64)
+        # tabella per giorno: copre day0 … ultimo giorno + 1
+        self._day_next = np.searchsorted(ts_ns, days, side="left")
+        self._day_prev = np.searchsorted(ts_ns, days, side="right") - 1
+
+    def __len__(self) -> int:
+        return len(self.ts_ns)
+
+    # ------------------------------------------------------------------ #
+    # Lookup per numero di giorno (mezzanotte) – O(1)                     #
+    # ------------------------------------------------------------------ #
+    def day_next(self, day_numbers) -> np.ndarray:
+        """Prima barra >= mezzanotte del giorno (giorni dall'epoch)."""
+        k = np.asarray(day_numbers, dtype=np.int64) - self.day0
+        pos = self._day_next[np.clip(k, 0, len(self._day_next) - 1)]
+        return np.where(k < 0, 0, pos)
+
+    def day_prev(self, day_numbers) -> np.ndarray:
+        """Ultima barra <= mezzanotte del giorno (giorni dall'epoch)."""
+        k = np.asarray(day_numbers, dtype=np.int64) - self.day0
+        pos = self._day_prev[np.clip(k, 0, len(self._day_prev) - 1)]
+        return np.where(k < 0, -1, np.where(k >= len(self._day_prev), len(self) - 1, pos))
+
+    # ------------------------------------------------------------------ #
+    # API batch per timestamp arbitrari                                   #
+    # ------------------------------------------------------------------ #
+    def next_pos(self, when) -> np.ndarray:
+        """Posizioni della prima barra >= ciascun timestamp."""
+        return np.searchsorted(self.ts_ns, _as_ns(when), side="left")
+
+    def prev_pos(self, when) -> np.ndarray:
+        """Posizioni dell'ultima barra <= ciascun timestamp."""
+        return np.searchsorted(self.ts_ns, _as_ns(when), side="right") - 1
+
+    # ------------------------------------------------------------------ #
+    # Helper scalari (compatibili con _next/_prev_valid_date)             #
+    # ------------------------------------------------------------------ #
+    def next_valid(self, dt) -> pd.Timestamp | None:
+        pos = int(self._scalar_pos(dt, self.day_next, self.next_pos))
+        return None if pos >= len(self) else pd.Timestamp(self.ts_ns[pos])
+
+    def prev_valid(self, dt) -> pd.Timestamp | None:
+        pos = int(self._scalar_pos(dt, self.day_prev, self.prev_pos))
+        return None if pos < 0 else pd.Timestamp(self.ts_ns[pos])
+
+    def _scalar_pos(self, dt, by_day, by_ts):
+        ns = int(_as_ns(dt))
+        if ns % DAY_NS == 0:
+            return by_day(ns // DAY_NS)
+        return by_ts(ns)
+
+    # ------------------------------------------------------------------ #
+    # Griglia di calendario (anno, mese, giorno)                          #
+    # ------------------------------------------------------------------ #
+    def day_grid(self, years):
+        """
+        Griglia (anno, mese, giorno 1-31) → barra valida successiva / precedente.
+
+        Ritorna:
+            valid – bool, False per date inesistenti (es. 30 febbraio)
+            nxt   – posizione della prima barra >= data
+            prv   – posizione dell'ultima barra <= data
+        """
+        years  = np.asarray(years)
+        months = ((years[:, None] - 1970) * 12 + np.arange(12)).astype("datetime64[M]")
+        days   = months.astype("datetime64[D]")[..., None] + np.arange(31)
+        valid  = days.astype("datetime64[M]") == months[..., None]
+
+        day_numbers = days.astype(np.int64)
+        return valid, self.day_next(day_numbers), self.day_prev(day_numbers)
+
+
+def _as_ns(when):
+    if isinstance(when, np.ndarray) and when.dtype == np.int64:
+        return when
+    if np.ndim(when) == 0:
+        return pd.Timestamp(when).as_unit("ns").value
+    return pd.DatetimeIndex(when).as_unit("ns").asi8
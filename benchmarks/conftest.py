@@ -0,0 +1,55 @@
+# benchmarks/conftest.py
+"""
+Fixture dei benchmark (pytest-benchmark): storici sintetici deterministici
+H1 / D1 generati una volta per sessione.
+
+    pytest benchmarks --bench-years 20
+    pytest benchmarks --bench-years 5 --benchmark-compare --benchmark-compare-fail=min:10%
+"""
+
+import pytest
+
+from benchmarks.synthetic import synthetic_ohlc
+from backend.services.history_store import HistoryArrays
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("seasonality", "benchmark motore pattern")
+    group.addoption("--bench-years", type=int, default=20, help="anni di storico sintetico (default 20)")
+    group.addoption("--bench-seed", type=int, default=0, help="seed dello storico sintetico")
+    group.addoption("--bench-sample", type=int, default=10,
+                    help="definizioni misurate in per_definition (default 10)")
+    group.addoption("--bench-metrics-patterns", type=int, default=100_000,
+                    help="pattern sintetici per i benchmark delle metriche")
+
+
+@pytest.fixture(scope="session")
+def bench_config(pytestconfig):
+    years = pytestconfig.getoption("--bench-years")
+    if not 1 <= years <= 30:
+        raise pytest.UsageError("--bench-years fuori intervallo (1–30)")
+    return {
+        'years':            years,
+        'seed':             pytestconfig.getoption("--bench-seed"),
+        'sample':           pytestconfig.getoption("--bench-sample"),
+        'metrics_patterns': pytestconfig.getoption("--bench-metrics-patterns"),
+    }
+
+
+@pytest.fixture(scope="session")
+def ohlc(bench_config):
+    """{tf: DataFrame ['timestamp','open','high','low','close']} per H1 e D1."""
+    return {tf: synthetic_ohlc(tf, bench_config['years'], bench_config['seed']) for tf in ('H1', 'D1')}
+
+
+@pytest.fixture(scope="session")
+def arrays(ohlc):
+    """Gli stessi storici come `HistoryArrays` (input dei motori batch)."""
+    return {
+        tf: HistoryArrays(
+            df['timestamp'].to_numpy(dtype='datetime64[ns]').view('int64'),
+            *(df[c].to_numpy(dtype='float64') for c in ('open', 'high', 'low', 'close')),
+        )
+        for tf, df in ohlc.items()
+    }
+
@@ -0,0 +1,51 @@
+# benchmarks/synthetic.py
+"""
+Generatore deterministico di storici OHLC sintetici (H1 / D1) per i benchmark.
+
+Stesso seed → stesse barre, su qualunque macchina: niente MT5 né file in
+`mt5_history/`. Le barre seguono un random walk log-normale con:
+  • solo giorni feriali (lun–ven), come un simbolo forex;
+  • ~2% di barre mancanti (festivi, buchi di feed) per esercitare lo
+    snapping ai giorni validi;
+  • open = close precedente, high/low coerenti con open/close.
+"""
+
+import numpy as np
+import pandas as pd
+
+END = pd.Timestamp("2025-06-13 23:00")
+
+_FREQ = {"H1": "1h", "D1": "1D"}
+
+
+def synthetic_ohlc(tf: str = "D1", years: int = 20, seed: int = 0,
+                   end: pd.Timestamp = END, missing: float = 0.02) -> pd.DataFrame:
+    """DataFrame ['timestamp','open','high','low','close'] ordinato per timestamp."""
+    if tf not in _FREQ:
+        raise ValueError(f"timeframe non supportato: {tf!r}")
+    rng = np.random.default_rng(seed)
+
+    last = end if tf == "H1" else end.normalize()
+    idx  = pd.date_range(last - pd.DateOffset(years=years), last, freq=_FREQ[tf])
+    idx  = idx[idx.dayofweek < 5]
+    idx  = idx[rng.random(len(idx)) >= missing]
+
+    # volatilità per barra ~ 10% annuo su D1, scalata per H1
+    sigma = 0.10 / np.sqrt(252) / (np.sqrt(24) if tf == "H1" else 1.0)
+    close = 100.0 * np.exp(np.cumsum(rng.normal(0.0, sigma, len(idx))))
+    open_ = np.r_[100.0, close[:-1]]
+    wick  = np.abs(rng.normal(0.0, sigma, (2, len(idx)))) * close
+    return pd.DataFrame({
+        "timestamp": idx,
+        "open":      open_,
+        "high":      np.maximum(open_, close) + wick[0],
+        "low":       np.minimum(open_, close) - wick[1],
+        "close":     close,
+    })
+
+
+def synthetic_trade_returns(n_patterns: int, max_trades: int = 40, seed: int = 0):
+    """Lista di array di rendimenti per trade (lunghezze variabili) per i benchmark delle metriche."""
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(1, max_trades + 1, n_patterns)
+    return [rng.normal(0.001, 0.02, n) for n in lengths]
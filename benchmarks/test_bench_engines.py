@@ -0,0 +1,53 @@
+# benchmarks/test_bench_engines.py
+"""
+Motore pattern su storici sintetici:
+  • per_definition  – `get_pattern_statistics` su un campione di definizioni
+  • batch           – motore vettoriale per tipo (tutte le definizioni, tutti i lookback)
+  • full_asset      – i tre tipi su un asset H1 + D1 (come `process_asset_shard`, senza DB)
+"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from backend.services.statistics import BATCH_ENGINES, get_pattern_statistics  # noqa: E402
+from backend.services.trading_calendar import TradingCalendar  # noqa: E402
+from backend.jobs.compute_patterns import PATTERN_DEFS, PATTERN_TF, years_options  # noqa: E402
+
+PATTERN_TYPES = list(PATTERN_DEFS)
+
+
+def _n_results(steps) -> int:
+    """Pattern prodotti da un motore batch, consumando un lookback alla volta."""
+    return sum(len(res) for _, res in steps)
+
+
+@pytest.mark.parametrize("pattern_type", PATTERN_TYPES)
+def test_per_definition(benchmark, ohlc, bench_config, pattern_type):
+    defs  = PATTERN_DEFS[pattern_type]
+    picks = [defs[i] for i in np.linspace(0, len(defs) - 1, min(bench_config['sample'], len(defs))).astype(int)]
+    df    = ohlc[PATTERN_TF[pattern_type]]
+    cal   = TradingCalendar(df["timestamp"])
+    yb    = max(years_options)
+
+    benchmark.extra_info.update(n=len(picks), unit="definizioni")
+    benchmark(lambda: [get_pattern_statistics(df, pattern_type, p, yb, cal) for p in picks])
+
+
+@pytest.mark.parametrize("pattern_type", PATTERN_TYPES)
+def test_batch(benchmark, arrays, pattern_type):
+    engine = BATCH_ENGINES[pattern_type]
+    hist   = arrays[PATTERN_TF[pattern_type]]
+    n = benchmark(lambda: _n_results(engine(hist, PATTERN_DEFS[pattern_type], years_options)))
+    benchmark.extra_info.update(n=n, unit="pattern")
+
+
+def test_full_asset(benchmark, arrays):
+    def run():
+        return sum(
+            _n_results(BATCH_ENGINES[ptype](arrays[PATTERN_TF[ptype]], PATTERN_DEFS[ptype], years_options))
+            for ptype in PATTERN_TYPES
+        )
+    n = benchmark(run)
+    benchmark.extra_info.update(n=n, unit="pattern")
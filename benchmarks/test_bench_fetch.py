@@ -0,0 +1,45 @@
+# benchmarks/test_bench_fetch.py
+"""Download concorrente da `ReplaySource` (latenza simulata) con 1 e con N thread dello scheduler."""
+
+import tempfile
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from backend.data_fetch.scheduler import run_jobs, FetchJob  # noqa: E402
+from backend.data_fetch.sources import ReplaySource  # noqa: E402
+from backend.services.history_parquet import dataset_dir, write_history  # noqa: E402
+
+SYMBOLS = 8
+LATENCY = 0.02
+ROUNDS  = 3
+
+
+@pytest.fixture(scope="module")
+def replay(ohlc, tmp_path_factory):
+    """Storico sintetico servito da `ReplaySource`: (radice, job)."""
+    root = tmp_path_factory.mktemp("replay")
+    jobs = [FetchJob("Bench", f"SYN{i}", tf) for i in range(SYMBOLS) for tf in ohlc]
+    for job in jobs:
+        write_history(dataset_dir(*job, str(root)), ohlc[job.tf_str])
+    return str(root), jobs
+
+
+@pytest.mark.parametrize("workers", [1, 8])
+def test_replay(benchmark, replay, workers):
+    root, jobs = replay
+
+    def handler(gate, job, out):
+        with gate.request() as source:
+            df = source.fetch(job.symbol, job.tf_str, None, None)
+        write_history(dataset_dir(*job, out), df, replace=True)
+
+    def run():
+        with tempfile.TemporaryDirectory() as out:
+            source = ReplaySource(root, latency=LATENCY, max_concurrency=workers)
+            return run_jobs(source, jobs, lambda g, j: handler(g, j, out), max_workers=workers)
+
+    benchmark.extra_info.update(n=len(jobs), unit="job")
+    summary = benchmark.pedantic(run, rounds=ROUNDS)
+    assert not summary['failed'], summary['errors']
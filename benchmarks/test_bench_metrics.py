@@ -0,0 +1,29 @@
+# benchmarks/test_bench_metrics.py
+"""`batch_metrics` e `batch_drawdowns` su array ragged di trade sintetici."""
+
+import numpy as np
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from benchmarks.synthetic import synthetic_trade_returns  # noqa: E402
+from backend.services.metrics_batch import batch_metrics, batch_drawdowns, ragged  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def trades(bench_config):
+    return ragged(synthetic_trade_returns(bench_config['metrics_patterns']))
+
+
+def test_batch_metrics(benchmark, trades, bench_config):
+    values, offsets = trades
+    benchmark.extra_info.update(n=bench_config['metrics_patterns'], unit="pattern")
+    benchmark(batch_metrics, values, offsets, 20)
+
+
+def test_batch_drawdowns(benchmark, trades, bench_config):
+    values, offsets = trades
+    equity = np.cumprod(1.0 + values)
+    ts_ns  = np.arange(len(values), dtype=np.int64) * 86_400_000_000_000
+    benchmark.extra_info.update(n=bench_config['metrics_patterns'], unit="pattern")
+    benchmark(batch_drawdowns, equity, ts_ns, offsets)
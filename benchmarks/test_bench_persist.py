@@ -0,0 +1,76 @@
+# benchmarks/test_bench_persist.py
+"""`upsert_patterns` su SQLite: primo insert e rerun con trade invariati."""
+
+import itertools
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+pytest.importorskip("backend.db.session")   # modelli SQLAlchemy (ambiente completo)
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from backend.db.session import Base  # noqa: E402
+from backend.db.models import Asset  # noqa: E402
+from backend.services.pattern_store import upsert_patterns  # noqa: E402
+from backend.services.statistics import BATCH_ENGINES  # noqa: E402
+from backend.jobs.compute_patterns import PATTERN_DEFS, PATTERN_TF, years_options  # noqa: E402
+
+ROUNDS = 3
+
+
+@pytest.fixture(scope="module")
+def items(arrays):
+    """{tipo: [(params, years_back, stats, equity)]} di tutti i pattern con trade."""
+    return {
+        ptype: [
+            (p, yb, st, eq)
+            for yb, res in BATCH_ENGINES[ptype](arrays[PATTERN_TF[ptype]], defs, years_options)
+            for p, st, eq in res if st and eq
+        ]
+        for ptype, defs in PATTERN_DEFS.items()
+    }
+
+
+@pytest.fixture
+def new_session(tmp_path):
+    """Fabbrica di sessioni su database SQLite vuoti (uno per round)."""
+    engines, sessions, counter = [], [], itertools.count()
+
+    def make():
+        engine = create_engine(f"sqlite:///{tmp_path / f'bench{next(counter)}.db'}")
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        session.add(Asset(id=1, symbol="SYNTH", group="Bench"))
+        session.commit()
+        engines.append(engine)
+        sessions.append(session)
+        return session
+
+    yield make
+    for session in sessions:
+        session.close()
+    for engine in engines:
+        engine.dispose()
+
+
+def _upsert_all(session, items):
+    for ptype, rows in items.items():
+        upsert_patterns(session, 1, ptype, rows)
+    session.commit()
+
+
+def test_sqlite_insert(benchmark, items, new_session):
+    benchmark.extra_info.update(n=sum(map(len, items.values())), unit="pattern")
+    benchmark.pedantic(_upsert_all, setup=lambda: ((new_session(), items), {}), rounds=ROUNDS)
+
+
+def test_sqlite_unchanged(benchmark, items, new_session):
+    def setup():
+        session = new_session()
+        _upsert_all(session, items)
+        return (session, items), {}
+
+    benchmark.extra_info.update(n=sum(map(len, items.values())), unit="pattern")
+    benchmark.pedantic(_upsert_all, setup=setup, rounds=ROUNDS)
@@ -0,0 +1,4 @@
+#!/bin/bash
+# Benchmark offline del motore pattern (pytest-benchmark): risultati JSON in benchmarks/results/
+# es.  scripts/run_bench.sh --bench-years 5 --benchmark-compare --benchmark-compare-fail=min:10%
+python3 -m pytest benchmarks --benchmark-only --benchmark-storage=benchmarks/results --benchmark-autosave "$@"
@@ -0,0 +1,72 @@
+# tests/test_equity_codec.py
+"""Round-trip di `encode_equity` / `decode_equity`."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from backend.services.equity_codec import (
+    EquityCurve, HEADER, curve_arrays, decode_equity, decode_series, encode_equity,
+)
+
+
+def _curve(freq: str, n: int = 500, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    ts  = pd.date_range("2005-01-03", periods=n * 2, freq=freq)
+    ts  = ts[np.sort(rng.choice(len(ts), n, replace=False))]     # passo irregolare
+    return ts.as_unit("ns").asi8, np.cumprod(1 + rng.normal(0.001, 0.02, n))
+
+
+@pytest.mark.parametrize("freq, unit_code", [("1D", 0), ("1h", 1), ("1s", 1), ("7ms", 2)])
+def test_round_trip(freq, unit_code):
+    ts, vals = _curve(freq)
+    blob = encode_equity(ts, vals)
+    assert HEADER.unpack_from(blob)[1] == unit_code
+    ts_out, vals_out = decode_equity(blob)
+    np.testing.assert_array_equal(ts_out, ts)
+    np.testing.assert_array_equal(vals_out, vals)
+
+
+def test_round_trip_datetimes_and_series():
+    ts, vals = _curve("1D", n=50)
+    blob = encode_equity(pd.to_datetime(ts), vals)
+    series = decode_series(blob)
+    assert list(series.index) == list(pd.to_datetime(ts))
+    np.testing.assert_array_equal(series.to_numpy(), vals)
+
+
+def test_round_trip_float32():
+    ts, vals = _curve("1D", n=50)
+    ts_out, vals_out = decode_equity(encode_equity(ts, vals, value_dtype="float32"))
+    np.testing.assert_array_equal(ts_out, ts)
+    np.testing.assert_allclose(vals_out, vals, rtol=1e-6)
+
+
+def test_round_trip_wide_gaps_and_unsorted():
+    # delta oltre uint32 (in giorni no, in ns sì) e delta negativi → int64
+    ts = np.array([0, 5, 2**33 + 7, 3], dtype=np.int64)
+    vals = np.array([1.0, 1.1, 0.9, 1.2])
+    ts_out, vals_out = decode_equity(encode_equity(ts, vals))
+    np.testing.assert_array_equal(ts_out, ts)
+    np.testing.assert_array_equal(vals_out, vals)
+
+
+def test_round_trip_empty_and_single():
+    for n in (0, 1):
+        ts, vals = _curve("1D", n=n)
+        ts_out, vals_out = decode_equity(encode_equity(ts, vals))
+        assert len(ts_out) == len(vals_out) == n
+        np.testing.assert_array_equal(ts_out, ts)
+
+
+def test_curve_and_dict_list_encode_identically():
+    ts, vals = _curve("1h", n=40)
+    curve = EquityCurve(ts, vals)
+    assert encode_equity(*curve_arrays(curve)) == encode_equity(*curve_arrays(list(curve)))
+
+
+def test_invalid_blob():
+    with pytest.raises(ValueError):
+        decode_equity(b"XXXX" + bytes(HEADER.size))
+    with pytest.raises(ValueError):
+        encode_equity(np.arange(3, dtype=np.int64), [1.0, 2.0])
@@ -0,0 +1,83 @@
+# tests/test_metrics_batch.py
+"""Parità del kernel `batch_metrics` con le formule documentate in metrics_batch."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from backend.services.metrics_batch import batch_metrics, ragged
+from backend.services.statistics import _equity_and_stats
+
+
+def reference_metrics(r: np.ndarray, years_back: int) -> dict:
+    n   = len(r)
+    t   = n / max(years_back, 1)
+    pos = r[r > 0]
+    neg = r[r < 0]
+    eq  = np.cumprod(1 + r)
+    std = r.std(ddof=1) if n > 1 else np.nan
+    down = np.sqrt((neg ** 2).sum() / n)
+
+    def streak(mask):
+        best = cur = 0
+        for m in mask:
+            cur = cur + 1 if m else 0
+            best = max(best, cur)
+        return best
+
+    return {
+        "gross_profit_pct":      pos.sum() * 100,
+        "gross_loss_pct":        neg.sum() * 100,
+        "net_return_pct":        (eq[-1] - 1) * 100,
+        "win_rate":              len(pos) / n * 100,
+        "profit_factor":         pos.sum() / -neg.sum() if len(neg) else np.nan,
+        "expectancy":            r.mean() * 100,
+        "avg_trade_pct":         r.mean() * 100,
+        "max_drawdown_pct":      min((eq / np.maximum.accumulate(np.r_[1.0, eq])[1:] - 1).min(), 0) * 100,
+        "sharpe_ratio":          r.mean() / std * np.sqrt(t) if std > 0 else np.nan,
+        "sortino_ratio":         r.mean() / down * np.sqrt(t) if down > 0 else np.nan,
+        "annual_volatility_pct": std * np.sqrt(t) * 100,
+        "num_trades":            n,
+        "max_consec_wins":       streak(r > 0),
+        "max_consec_losses":     streak(r < 0),
+    }
+
+
+def _curves():
+    rng = np.random.default_rng(7)
+    curves = [rng.normal(0.002, 0.03, rng.integers(1, 60)) for _ in range(200)]
+    curves += [
+        np.array([0.01]),                  # un trade: std non definita
+        np.array([0.01, 0.02, 0.03]),      # solo vincite: profit factor / sortino NaN
+        np.array([-0.01, -0.02]),          # solo perdite
+        np.array([0.01, 0.0, 0.01, -0.01, 0.0, -0.02]),   # zeri che interrompono le serie
+    ]
+    return curves
+
+
+@pytest.mark.parametrize("years_back", [1, 5, 20])
+def test_kernel_matches_reference(years_back):
+    curves = _curves()
+    values, offsets = ragged(curves)
+    cols = batch_metrics(values, offsets, years_back)
+    for i, r in enumerate(curves):
+        for name, expected in reference_metrics(r, years_back).items():
+            np.testing.assert_allclose(cols[name][i], expected, rtol=1e-9, atol=1e-12,
+                                       equal_nan=True, err_msg=f"{name} curva {i}")
+
+
+def test_empty_pattern_has_no_trades():
+    values, offsets = ragged([np.array([0.01, -0.02]), np.array([])])
+    cols = batch_metrics(values, offsets, 5)
+    assert cols["num_trades"][1] == 0
+    assert np.isnan(cols["win_rate"][1])
+
+
+def test_single_definition_path_uses_kernel():
+    r  = np.array([0.02, -0.01, 0.03, -0.04, 0.01])
+    ts = pd.date_range("2020-01-01", periods=len(r), freq="30D")
+    stats, equity = _equity_and_stats(r, ts, 5)
+    values, offsets = ragged([r])
+    cols = batch_metrics(values, offsets, 5)
+    assert stats == {name: col[0] for name, col in cols.items()}
+    assert [pt["timestamp"] for pt in equity] == list(ts)
@@ -0,0 +1,19 @@
+# tests/test_pattern_store.py
+"""Conversione dei valori per Statistic / COPY."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("backend.db.session")   # modelli SQLAlchemy (ambiente completo)
+
+from backend.services.pattern_store import safe_value  # noqa: E402
+
+
+def test_safe_value_nan_is_null():
+    assert safe_value(np.float64("nan")) is None
+    assert safe_value(float("nan")) is None
+    assert safe_value(pd.NaT) is None
+    assert safe_value(np.float64(1.5)) == 1.5 and type(safe_value(np.float64(1.5))) is float
+    assert type(safe_value(np.int64(3))) is int
+    assert safe_value({"a": 1}) == {"a": 1}
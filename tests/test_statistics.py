@@ -0,0 +1,72 @@
+# tests/test_statistics.py
+"""Parità dei motori batch con `get_pattern_statistics` (una definizione alla volta)."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import synthetic_ohlc
+from backend.services.statistics import BATCH_ENGINES, get_pattern_statistics
+from backend.services.trading_calendar import TradingCalendar
+
+ANNUAL_DEFS = [
+    {'start_month': 1,  'start_day': 2,  'end_month': 1,  'end_day': 30},
+    {'start_month': 2,  'start_day': 29, 'end_month': 3,  'end_day': 5},    # 29 febbraio
+    {'start_month': 3,  'start_day': 31, 'end_month': 4,  'end_day': 14},
+    {'start_month': 6,  'start_day': 15, 'end_month': 9,  'end_day': 1},
+    {'start_month': 12, 'start_day': 1,  'end_month': 12, 'end_day': 31},
+    {'start_month': 13, 'start_day': 1,  'end_month': 13, 'end_day': 9},    # fuori range
+]
+MONTHLY_DEFS = [
+    {'start_day': d, 'window_days': w}
+    for d in (1, 10, 17, 28, 31) for w in (3, 7, 15) if d + w - 1 <= 31
+]
+INTRADAY_DEFS = [
+    {'tf': 'H1', 'start_hour': h, 'end_hour': h + d}
+    for d in (1, 3, 6) for h in (0, 7, 18, 24 - d)
+] + [{'tf': 'H1', 'start_hour': 5, 'end_hour': 2}]                         # finestra vuota
+
+CASES = {
+    # tipo: (timeframe, anni di storico, definizioni, lookback)
+    'annual':   ('D1', 8, ANNUAL_DEFS,   [1, 3, 10]),
+    'monthly':  ('D1', 6, MONTHLY_DEFS,  [1, 5]),
+    'intraday': ('H1', 1, INTRADAY_DEFS, [1, 2]),
+}
+
+
+def _same_stats(a: dict, b: dict) -> bool:
+    if a.keys() != b.keys():
+        return False
+    return all(
+        (pd.isna(a[k]) and pd.isna(b[k])) or np.isclose(a[k], b[k], rtol=1e-9, atol=1e-12)
+        for k in a
+    )
+
+
+def _same_equity(a, b) -> bool:
+    ts_a, ts_b = [pt["timestamp"] for pt in a], [pt["timestamp"] for pt in b]
+    return ts_a == ts_b and np.allclose([pt["value"] for pt in a], [pt["value"] for pt in b])
+
+
+@pytest.mark.parametrize("pattern_type", list(CASES))
+def test_batch_matches_per_definition(pattern_type):
+    tf, years, defs, years_options = CASES[pattern_type]
+    df  = synthetic_ohlc(tf, years, seed=3)
+    cal = TradingCalendar(df["timestamp"])
+
+    steps = list(BATCH_ENGINES[pattern_type](df, defs, years_options))
+    assert [yb for yb, _ in steps] == years_options
+
+    for yb, results in steps:
+        assert [p for p, _, _ in results] == defs
+        for params, stats, equity in results:
+            ref_stats, ref_equity = get_pattern_statistics(df, pattern_type, params, yb, cal)
+            assert _same_stats(stats, ref_stats), (yb, params)
+            assert _same_equity(equity, ref_equity), (yb, params)
+
+
+def test_batch_empty_history():
+    df = synthetic_ohlc("D1", 1).iloc[:0]
+    steps = list(BATCH_ENGINES["monthly"](df, MONTHLY_DEFS, [1, 5]))
+    assert [yb for yb, _ in steps] == [1, 5]
+    assert all(stats == {} and equity == [] for _, res in steps for _, stats, equity in res)